@@ -12,44 +12,81 @@ import pandas as pd
 # import numpy as np
 import plotly.graph_objects as go
 # import plotly.express as px
-# from plotly.subplots import make_subplots
-import math
+from plotly.subplots import make_subplots
 from pathlib import Path
-import json
+
+from hrrisk import loaders, metrics
+from hrrisk.cache import ProfileCache
+from hrrisk.categories import calculate_bmi, get_age_group_for_percentile, get_bmi_category
+from hrrisk.logwriter import RestSink
+from hrrisk.metrics import stage
+from hrrisk.registry import ModelRegistry, ModelVersion, get_registry
+from hrrisk.scoring import INPUT_COLUMNS, ScoringModel
+from hrrisk.spool import SpoolWriter
 
 here = Path(__file__).resolve().parent
-manifest_path = here / "model" / "manifest.json"
 
 
 ## [Supabase 連接]
-from supabase import create_client, Client
+import atexit
+import math
+import os
 import uuid
 # from datetime import datetime, timezone, timedelta
 
 
-# 初始化 Supabase Client（用 anon key 寫入）
-SUPABASE_URL = st.secrets["supabase"]["url"]
-SUPABASE_ANON_KEY = st.secrets["supabase"]["anon_key"]
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_ANON_KEY)
+@st.cache_resource
+def get_supabase_client() -> RestSink:
+    """
+    行程內共用的 Supabase REST 用戶端（用 anon key 寫入），跨 rerun 與 session 重複使用：
+    HTTP keep-alive 連線池，每次寫入不必重新做 TLS 握手；連線重用情形見 .stats()。
+    逾時秒數可在 secrets 的 [supabase] timeout 設定（預設 10 秒）。
+    延後到第一次寫入時才讀 st.secrets，匯入本模組不需網路或金鑰。
+    """
+    conf = st.secrets["supabase"]
+    client = RestSink(conf["url"], conf["anon_key"], timeout=float(conf.get("timeout", 10.0)))
+    atexit.register(client.close)
+    return client
 
-# 產生一個 session_id（每次重開頁面或重新評估都可共用）
-if "session_id" not in st.session_state:
-    st.session_state["session_id"] = str(uuid.uuid4())
+
+@st.cache_resource
+def get_log_writer() -> SpoolWriter:
+    """
+    行程內共用的背景寫入器：評估結果先寫進本機 spool（SQLite）後立即返回，
+    由背景執行緒寫入 Supabase；Supabase 無法連線或 App 重啟時資料留在 spool，恢復後補送。
+    spool 位置可用環境變數 HRRISK_SPOOL 指定，預設為 .spool/risk_log.sqlite3。
+    """
+    path = os.environ.get("HRRISK_SPOOL") or here / ".spool" / "risk_log.sqlite3"
+    writer = SpoolWriter(get_supabase_client(), path)
+    atexit.register(writer.close)
+    return writer
+
+@st.cache_resource
+def start_metrics_endpoint():
+    """
+    HRRISK_METRICS=1 且設定 HRRISK_METRICS_PORT 時，在背景提供 GET /metrics（各階段耗時，Prometheus 文字格式）。
+    預設只綁 127.0.0.1（HRRISK_METRICS_HOST 可改），僅供本機的管理者 / Prometheus 讀取；行程內只啟動一次。
+    """
+    port = os.environ.get("HRRISK_METRICS_PORT")
+    if not port:
+        return None
+    return metrics.serve_metrics(int(port), os.environ.get("HRRISK_METRICS_HOST", "127.0.0.1"))
 
 APP_VERSION = "app_percentage_tw.py-2025-09-04"
 MODEL_VERSION = "coef:2025-09-04; pct:2025-08-29"
 
+# 儀表呈現方式（環境變數 HRRISK_GAUGES）：
+# "plotly"（預設）每個疾病一張 Plotly 儀表；"plotly_grid" 全部儀表合成一張 subplot 圖；
+# "svg" 在結果卡片內直接畫 SVG 儀表（不載入 Plotly、不送 figure JSON，適合手機）
+GAUGE_MODES = ("plotly", "plotly_grid", "svg")
+GAUGE_MODE = os.environ.get("HRRISK_GAUGES", "plotly")
+if GAUGE_MODE not in GAUGE_MODES:
+    GAUGE_MODE = "plotly"
+GAUGE_GRID_COLUMNS = 4
 
-# Page configuration
-st.set_page_config(
-    page_title="❤️ 個人化健康風險評估平台",
-    page_icon="❤️",
-    layout="wide",
-    initial_sidebar_state="expanded"
-)
 
 # Custom CSS for better styling
-st.markdown("""
+_CUSTOM_CSS = """
 <style>
     .main-header {
         font-size: 3rem;
@@ -224,7 +261,23 @@ st.markdown("""
     }
     
 </style>
-""", unsafe_allow_html=True)
+"""
+
+
+def _setup_page():
+    """Page configuration + CSS；需在 main() 的第一個 Streamlit 指令前呼叫。"""
+    st.set_page_config(
+        page_title="❤️ 個人化健康風險評估平台",
+        page_icon="❤️",
+        layout="wide",
+        initial_sidebar_state="expanded"
+    )
+    st.markdown(_CUSTOM_CSS, unsafe_allow_html=True)
+
+    # 產生一個 session_id（每次重開頁面或重新評估都可共用）
+    if "session_id" not in st.session_state:
+        st.session_state["session_id"] = str(uuid.uuid4())
+
 
 # Disease categorization
 DISEASE_CATEGORIES = {
@@ -287,356 +340,47 @@ for category, diseases in DISEASE_CATEGORIES.items():
 
 
 ## [讀取 GH 資料夾]
-# ---- 自動尋找 manifest.json ----
-_BASE = Path(__file__).resolve().parent
-_MANIFEST_CANDIDATES = [
-    _BASE / "heart-rate-risk-model" / "model" / "manifest.json",
-    _BASE / "model" / "manifest.json",
-    _BASE / "manifest.json",
-]
-
-def _load_manifest() -> dict:
-    for p in _MANIFEST_CANDIDATES:
-        if p.exists():
-            data = json.loads(p.read_text(encoding="utf-8"))
-            base = p.parent  # 後續路徑一律相對於 manifest 所在資料夾
-            data["_base_dir"] = base
-            return data
-    raise FileNotFoundError(
-        "找不到 manifest.json，請將它放在 "
-        "heart-rate-risk-model/model/ 或 model/ 或專案根目錄。"
-    )
-
-
-# 你的疾病名稱對照（沿用你原本的 mapping）
-_DISEASE_MAP = {
-    'DEATH': 'Death',
-    't2d': 'Type 2 Diabetes',
-    'af': 'Atrial Fibrillation',
-    'anxiety': 'Anxiety',
-    'ckd': 'Chronic Kidney Disease',
-    'gerd': 'Gastroesophageal Reflux Disease',
-    'heart_failure': 'Heart Failure',
-    'anemias': 'Anemias',
-    'asthma': 'Asthma',
-    'atherosclerosis': 'Atherosclerosis',
-    'cardiac_arrhythmia': 'Cardiac Arrhythmia',
-    'dementia': 'Dementia',
-    'depression': 'Depression',
-    'hypertension': 'Hypertension',
-    'ischemic_heart_disease': 'Ischemic Heart Disease',
-    'ischemic_stroke': 'Ischemic Stroke',
-    'migraine': 'Migraine',
-}
-
-# Load and parse the Cox regression model coefficients
-@st.cache_data
-def load_model_coefficients(path: str | Path | None = None) -> pd.DataFrame:
-    """
-    從 CSV 讀 Cox 係數表（保留 'REF' 字樣供你後續邏輯判斷）。
-    優先使用參數 path；否則依 manifest.json 的 coef_path。
-    """
-    m = _load_manifest()
-    file = Path(path) if path else (m["_base_dir"] / m["coef_path"])
-    if not file.exists():
-        raise FileNotFoundError(f"係數檔不存在：{file}")
-
-    # 用 dtype=str 保留 'REF'，後續需要再轉 float 的欄位你已有判斷
-    df = pd.read_csv(file, dtype=str)
-    df.columns = df.columns.str.strip()
-
-    # 基本欄位檢查
-    required = {"Disease", "Variable", "Coef"}
-    if not required.issubset(df.columns):
-        missing = required - set(df.columns)
-        raise ValueError(f"係數檔缺少欄位：{missing}")
-
-    # 去空白、標準化疾病名稱
-    for c in ["Disease", "Variable", "Coef"]:
-        df[c] = df[c].astype(str).str.strip()
-
-    df["Disease"] = df["Disease"].map(_DISEASE_MAP).fillna(df["Disease"])
-    return df
-
-
-# Load the percentile data from the uploaded file
-@st.cache_data
-def load_percentile_data(path: str | Path | None = None) -> pd.DataFrame:
+def _model_registry() -> ModelRegistry:
     """
-    從 CSV 讀風險百分位表。
-    使用 sep=None + engine='python' 自動偵測分隔符（逗號/分號/Tab 都可）。
+    行程內共用的模型註冊表：manifest 只讀一次，模型依檔案內容雜湊快取；
+    背景執行緒監看模型檔，更新 coefficients_YYMMDD.csv 等檔案後自動換上新版本，不需重啟。
+    manifest.json 的位置同命令列（hrrisk.loaders.find_manifest）。
     """
-    m = _load_manifest()
-    file = Path(path) if path else (m["_base_dir"] / m["pct_path"])
-    if not file.exists():
-        raise FileNotFoundError(f"百分位檔不存在：{file}")
-
-    # 自動偵測分隔符
-    df = pd.read_csv(file, sep=None, engine="python")
-    df.columns = df.columns.str.strip()
-
-    # 期望欄位
-    pct_cols = ['1%', '3%', '5%', '10%', '15%', '20%', '30%', '40%', '50%',
-                '60%', '70%', '80%', '85%', '90%', '95%', '98%', '100%']
-    must_have = {"Disease", "SEX", "AGE"} | set(pct_cols)
-    missing = must_have - set(df.columns)
-    if missing:
-        raise ValueError(f"百分位檔缺少欄位：{missing}")
-
-    # 清理與轉碼
-    df["Disease"] = df["Disease"].astype(str).str.strip()
-    df["Disease"] = df["Disease"].map(_DISEASE_MAP).fillna(df["Disease"])
-    df["AGE"] = df["AGE"].astype(str).str.strip()
-    df["SEX"] = pd.to_numeric(df["SEX"], errors="coerce")
-    df["Gender"] = df["SEX"].map({1: "Male", 2: "Female"})
-
-    for c in pct_cols:
-        df[c] = pd.to_numeric(df[c], errors='coerce')
+    registry = get_registry()
+    registry.watch()
+    return registry
 
-    return df
 
+def _load_manifest() -> dict:
+    return _model_registry().manifest
 
 
+# 你的疾病名稱對照（沿用你原本的 mapping）
+_DISEASE_MAP = loaders.DISEASE_MAP
 
 
-# === [新增] 讀取 baseline hazard ＆ 絕對風險計算 ===
-@st.cache_data
-def load_baseline_hazard(path: str | Path | None = None) -> pd.DataFrame:
+def get_model_version() -> ModelVersion:
     """
-    從 CSV 讀每個疾病的 cumulative baseline hazard。
-    期望欄位：Disease, t_years, H0
-    - Disease：疾病英文名，與 _DISEASE_MAP 映射一致
-    - t_years：時間（年），例如 3 表示三年
-    - H0：對應 t_years 的累積基準危險度 H0(t)
+    目前的模型版本（manifest + 編譯好的評分模型）。一次評估內只取一次，
+    評分與寫表欄位都來自同一個版本，換版時不會前後不一。
+    評分模型為一次矩陣乘法 + 一次 np.searchsorted，並啟用全組合查表模式。
     """
-    m = _load_manifest()
-    file = Path(path) if path else (m["_base_dir"] / m.get("baseline_path", "baseline_hazard.csv"))
-    if not file.exists():
-        raise FileNotFoundError(f"baseline 檔不存在：{file}")
-
-    df = pd.read_csv(file)
-    required = {"Disease", "t_years", "H0"}
-    missing = required - set(df.columns)
-    if missing:
-        raise ValueError(f"baseline 檔缺少欄位：{missing}")
-
-    # 清理與標準化
-    df["Disease"] = df["Disease"].astype(str).str.strip()
-    df["Disease"] = df["Disease"].map(_DISEASE_MAP).fillna(df["Disease"])
-    df["t_years"] = pd.to_numeric(df["t_years"], errors="coerce")
-    df["H0"] = pd.to_numeric(df["H0"], errors="coerce")
+    return _model_registry().current()
 
-    # 基本檢查
-    if df["t_years"].isna().any() or df["H0"].isna().any():
-        raise ValueError("baseline 檔中的 t_years 或 H0 出現非數值/缺失，請檢查資料。")
 
-    return df
+def get_scoring_model() -> ScoringModel:
+    return get_model_version().model
 
 
-def lookup_H0(disease: str, t_years: float, baseline_df: pd.DataFrame) -> float | None:
+@st.cache_resource
+def get_result_cache() -> ProfileCache:
     """
-    取得指定疾病在 t_years 的 H0(t)。
-    若沒有剛好等於 t_years，退而求其次取 <= t_years 的最大 t_years。
+    跨 session 共用的評分結果快取：同一組輸入（心率、BMI 以模型分組計）與同一模型版本只算一次。
+    命中率見 get_result_cache().stats()。
     """
-    rows = baseline_df[(baseline_df["Disease"] == disease) & (baseline_df["t_years"] == t_years)]
-    if not rows.empty:
-        return float(rows.iloc[0]["H0"])
-
-    # 取 <= t_years 的最大值（保守做法）
-    subset = baseline_df[(baseline_df["Disease"] == disease) & (baseline_df["t_years"] <= t_years)]
-    if subset.empty:
-        return None
-    subset = subset.sort_values("t_years")
-    return float(subset.iloc[-1]["H0"])
-
-
-def cox_absolute_risk(lp: float, H0: float) -> float:
-    """
-    Cox PH 絕對風險：Risk = 1 - exp( - H0(t) * exp(lp) )
-    回傳 0~1 的機率值
-    """
-    return 1.0 - math.exp(-H0 * math.exp(lp))
-
-
+    return ProfileCache()
 
 
-
-def calculate_bmi(height, weight, height_unit, weight_unit):
-    """Calculate BMI from height and weight with unit conversion"""
-    try:
-        if height_unit == "公分":
-            height_m = height / 100
-        elif height_unit == "英尺/英寸":
-            height_m = height * 0.0254
-        else:
-            height_m = height
-        
-        if weight_unit == "磅":
-            weight_kg = weight * 0.453592
-        else:
-            weight_kg = weight
-        
-        bmi = weight_kg / (height_m ** 2)
-        return round(bmi, 1)
-    
-    except (ZeroDivisionError, ValueError):
-        return None
-
-def get_bmi_category(bmi):
-    """Categorize BMI according to the model's categories"""
-    if bmi < 18.5:
-        return "體重過輕", "#3498db"
-    elif bmi < 24:
-        return "正常體重", "#27ae60"
-    elif bmi < 27:
-        return "體重過重", "#f39c12"
-    else:
-        return "肥胖", "#e74c3c"
-
-def get_bmi_model_category(bmi):
-    """Get BMI category for model calculation"""
-    if bmi < 18.5:
-        return 'bmi_underweight'
-    elif bmi < 24:
-        return 'bmi_normal'
-    elif bmi < 27:
-        return 'bmi_overweight'
-    else:
-        return 'bmi_obese'
-
-def get_heart_rate_category(hr):
-    """Categorize heart rate according to the model categories"""
-    if hr < 60:
-        return 'HR_cat<60'
-    elif 60 <= hr < 70:
-        return 'HR_cat60-69'
-    elif 70 <= hr < 80:
-        return 'HR_cat70-79'
-    elif 80 <= hr < 90:
-        return 'HR_cat80-89'
-    else:
-        return 'HR_cat>=90'
-
-def get_age_group_for_percentile(age):
-    """Convert age to age group for percentile lookup matching the data file"""
-    if age < 40:
-        return '<40'
-    elif age < 45:
-        return '40-44'
-    elif age < 50:
-        return '45-49'
-    elif age < 55:
-        return '50-54'
-    elif age < 60:
-        return '55-59'
-    else:
-        return '>=60'
-
-def calculate_linear_predictor(disease_name, age, gender, hr, bmi, smoking_status, drinking_status, model_df):
-    """Calculate linear predictor (LP) using Cox regression coefficients"""
-    try:
-        disease_coefs = model_df[model_df['Disease'] == disease_name].copy()
-        
-        if disease_coefs.empty:
-            return None
-        
-        lp = 0.0
-        
-        # Heart Rate Category
-        hr_cat = get_heart_rate_category(hr)
-        hr_coef = disease_coefs[disease_coefs['Variable'] == hr_cat]
-        if not hr_coef.empty and hr_coef.iloc[0]['Coef'] != 'REF':
-            lp += float(hr_coef.iloc[0]['Coef'])
-        
-        # Age
-        age_coef = disease_coefs[disease_coefs['Variable'] == 'AGE']
-        if not age_coef.empty and age_coef.iloc[0]['Coef'] != 'REF':
-            lp += float(age_coef.iloc[0]['Coef']) * age
-        
-        # Gender
-        if gender == 'Female':
-            gender_coef = disease_coefs[disease_coefs['Variable'] == 'FEMALE']
-            if not gender_coef.empty and gender_coef.iloc[0]['Coef'] != 'REF':
-                lp += float(gender_coef.iloc[0]['Coef'])
-        
-        # BMI Category
-        bmi_cat = get_bmi_model_category(bmi)
-        if bmi_cat != 'bmi_normal':
-            bmi_coef = disease_coefs[disease_coefs['Variable'] == bmi_cat]
-            if not bmi_coef.empty and bmi_coef.iloc[0]['Coef'] != 'REF':
-                lp += float(bmi_coef.iloc[0]['Coef'])
-        
-        # Smoking Status
-        if smoking_status == '曾經吸菸':
-            smoke_coef = disease_coefs[disease_coefs['Variable'] == 'Ever_smoke']
-            if not smoke_coef.empty and smoke_coef.iloc[0]['Coef'] != 'REF':
-                lp += float(smoke_coef.iloc[0]['Coef'])
-        elif smoking_status == '目前吸菸':
-            smoke_coef = disease_coefs[disease_coefs['Variable'] == 'Now_smoke']
-            if not smoke_coef.empty and smoke_coef.iloc[0]['Coef'] != 'REF':
-                lp += float(smoke_coef.iloc[0]['Coef'])
-        
-        # Drinking Status
-        if drinking_status == '曾經飲酒':
-            drink_coef = disease_coefs[disease_coefs['Variable'] == 'Ever_drink']
-            if not drink_coef.empty and drink_coef.iloc[0]['Coef'] != 'REF':
-                lp += float(drink_coef.iloc[0]['Coef'])
-        elif drinking_status == '目前飲酒':
-            drink_coef = disease_coefs[disease_coefs['Variable'] == 'Now_drink']
-            if not drink_coef.empty and drink_coef.iloc[0]['Coef'] != 'REF':
-                lp += float(drink_coef.iloc[0]['Coef'])
-        
-        return lp
-    
-    except Exception as e:
-        st.error(f"計算 {disease_name} 的LP時發生錯誤: {str(e)}")
-        return None
-
-def calculate_percentile_rank(user_lp, disease_name, gender, age_group, percentile_df):
-    """Calculate user's percentile rank using actual percentile data"""
-    try:
-        demographic_data = percentile_df[
-            (percentile_df['Disease'] == disease_name) & 
-            (percentile_df['Gender'] == gender) & 
-            (percentile_df['AGE'] == age_group)
-        ]
-        
-        if demographic_data.empty:
-            return None, None
-        
-        row = demographic_data.iloc[0]
-        
-        # Percentile columns and their corresponding values
-        percentile_cols = ['1%', '3%', '5%', '10%', '15%', '20%', '30%', '40%', 
-                          '50%', '60%', '70%', '80%', '85%', '90%', '95%', '98%', '100%']
-        percentile_values = [1, 3, 5, 10, 15, 20, 30, 40, 50, 60, 70, 80, 85, 90, 95, 98, 100]
-        
-        # Find where user_lp falls
-        for i, col in enumerate(percentile_cols):
-            threshold = float(row[col])
-            if user_lp <= threshold:
-                exact_percentile = percentile_values[i]
-                
-                # Calculate more precise percentile if between thresholds
-                if i > 0:
-                    prev_threshold = float(row[percentile_cols[i-1]])
-                    prev_percentile = percentile_values[i-1]
-                    
-                    # Linear interpolation
-                    if threshold != prev_threshold:
-                        ratio = (user_lp - prev_threshold) / (threshold - prev_threshold)
-                        interpolated_percentile = prev_percentile + ratio * (exact_percentile - prev_percentile)
-                        return int(round(interpolated_percentile)), exact_percentile
-                
-                return exact_percentile, exact_percentile
-        
-        # If higher than 100th percentile
-        return 100, 100
-        
-    except Exception as e:
-        st.error(f"計算百分位數時發生錯誤: {str(e)}")
-        return None, None
-
 def get_risk_category_and_color(percentile, disease_name=''):
     """Get risk category and color based on percentile"""
     # Use consistent risk categories for all diseases including Death
@@ -649,8 +393,8 @@ def get_risk_category_and_color(percentile, disease_name=''):
     else:
         return "低風險", "low-risk-card", "#27ae60"
 
-def create_percentile_gauge(percentile, disease_name):
-    """Create a gauge chart showing percentile position"""
+def _gauge_indicator(percentile, disease_name, **kwargs):
+    """單一疾病的百分位儀表（go.Indicator）；kwargs 傳給 go.Indicator（例如 domain）。"""
     # Use consistent colors for all diseases including Death
     if percentile >= 90:
         color = "#e74c3c"
@@ -671,10 +415,9 @@ def create_percentile_gauge(percentile, disease_name):
         {'range': [90, 100], 'color': "#e17055"}
     ]
     
-    fig = go.Figure(go.Indicator(
+    return go.Indicator(
         mode = "gauge+number+delta",
         value = percentile,
-        domain = {'x': [0, 1], 'y': [0, 1]},
         title = {'text': title_text},
         delta = {'reference': 50},
         gauge = {
@@ -686,12 +429,70 @@ def create_percentile_gauge(percentile, disease_name):
                 'thickness': 0.75,
                 'value': 90
             }
-        }
-    ))
-    
+        },
+        **kwargs
+    )
+
+def create_percentile_gauge(percentile, disease_name):
+    """Create a gauge chart showing percentile position"""
+    fig = go.Figure(_gauge_indicator(percentile, disease_name, domain={'x': [0, 1], 'y': [0, 1]}))
     fig.update_layout(height=300, margin=dict(l=20, r=20, t=60, b=20))
     return fig
 
+def create_gauge_grid(gauges, cols=GAUGE_GRID_COLUMNS):
+    """所有儀表畫在同一張 subplot 圖（gauges 為 (百分位, 疾病) 的序列），只需一次 st.plotly_chart。"""
+    rows = -(-len(gauges) // cols)
+    fig = make_subplots(
+        rows=rows, cols=cols,
+        specs=[[{'type': 'indicator'}] * cols for _ in range(rows)],
+        vertical_spacing=0.25 / rows,
+    )
+    for i, (percentile, disease) in enumerate(gauges):
+        fig.add_trace(_gauge_indicator(percentile, disease), row=i // cols + 1, col=i % cols + 1)
+    fig.update_layout(height=280 * rows, margin=dict(l=20, r=20, t=60, b=20))
+    return fig
+
+_SVG_GAUGE_STEPS = ((0, 50, "#d5f4e6"), (50, 75, "#ffeaa7"), (75, 90, "#fdcb6e"), (90, 100, "#e17055"))
+
+def _svg_gauge_point(value, radius, cx=100, cy=100):
+    """半圓儀表上 value（0–100）的座標：0 在左、100 在右。"""
+    angle = math.pi * (1 - value / 100)
+    return cx + radius * math.cos(angle), cy - radius * math.sin(angle)
+
+@st.cache_data(max_entries=128, show_spinner=False)
+def create_svg_gauge(percentile: int) -> str:
+    """
+    卡片內用的半圓 SVG 儀表（單行字串，可直接嵌入 st.markdown 的 HTML）。
+    色帶與 90 百分位門檻線同 Plotly 儀表；白色指標表示百分位，數字由卡片本身顯示。
+    """
+    r = 80
+    parts = []
+    for lo, hi, color in _SVG_GAUGE_STEPS:
+        (x0, y0), (x1, y1) = _svg_gauge_point(lo, r), _svg_gauge_point(hi, r)
+        parts.append(f'<path d="M{x0:.1f} {y0:.1f}A{r} {r} 0 0 1 {x1:.1f} {y1:.1f}" stroke="{color}" stroke-width="18" fill="none"/>')
+    (tx0, ty0), (tx1, ty1) = _svg_gauge_point(90, r - 13), _svg_gauge_point(90, r + 13)
+    parts.append(f'<line x1="{tx0:.1f}" y1="{ty0:.1f}" x2="{tx1:.1f}" y2="{ty1:.1f}" stroke="red" stroke-width="4"/>')
+    nx, ny = _svg_gauge_point(percentile, r - 4)
+    parts.append(f'<line x1="100" y1="100" x2="{nx:.1f}" y2="{ny:.1f}" stroke="white" stroke-width="5" stroke-linecap="round"/>')
+    parts.append('<circle cx="100" cy="100" r="7" fill="white"/>')
+    return ('<svg viewBox="0 0 200 112" width="100%" style="max-width:220px" role="img" '
+            f'aria-label="風險百分位 {percentile}">' + "".join(parts) + '</svg>')
+
+# 儀表圖只取決於 (整數百分位 0–100, 疾病)，最多 101 × 17 種：建好的 figure 跨 rerun、session 重用。
+# 直接傳 go.Figure 給 st.plotly_chart（傳 dict 會被重新驗證一次，反而更慢）。
+@st.cache_resource(max_entries=2048, show_spinner=False)
+def get_percentile_gauge(percentile: int, disease_name: str) -> go.Figure:
+    return create_percentile_gauge(percentile, disease_name)
+
+@st.cache_resource(max_entries=256, show_spinner=False)
+def get_gauge_grid(gauges: tuple) -> go.Figure:
+    return create_gauge_grid(gauges)
+
+@st.cache_resource(max_entries=256, show_spinner=False)
+def get_risk_summary_chart(risk_counts: tuple) -> go.Figure:
+    """risk_counts 為 (風險等級, 數量) 的 tuple，順序即長條順序。"""
+    return create_risk_summary_chart(dict(risk_counts))
+
 def create_risk_summary_chart(risk_counts):
     """Create a summary chart showing risk distribution"""
     # Define colors for each risk category (simplified since Death now uses same categories)
@@ -729,24 +530,56 @@ def create_risk_summary_chart(risk_counts):
     
     return fig
 
+@st.cache_resource(max_entries=256, show_spinner=False)
+def get_risk_curve_chart(curves: tuple) -> go.Figure:
+    return create_risk_curve_chart(curves)
+
+def create_risk_curve_chart(curves):
+    """
+    累積罹病機率曲線：curves 為 ((疾病, 年數 tuple, 機率 tuple), ...)，所有疾病畫在同一張折線圖。
+    機率為 None 的年數（沒有 H0）留白。
+    """
+    fig = go.Figure()
+    for disease, years, risks in curves:
+        name = DISEASE_CHINESE_NAMES.get(disease, disease)
+        fig.add_trace(go.Scatter(
+            x=years,
+            y=[None if r is None else r * 100 for r in risks],
+            mode="lines+markers",
+            name=name,
+            hovertemplate=f"{name}<br>%{{x:g}} 年內：%{{y:.1f}}%<extra></extra>",
+        ))
+    fig.update_layout(
+        title="累積罹病機率",
+        xaxis_title="年數",
+        yaxis_title="罹病機率（%）",
+        xaxis=dict(dtick=1),
+        height=450,
+        margin=dict(l=20, r=20, t=60, b=20),
+    )
+    return fig
+
 def log_session_and_results(
     results, age, gender, bmi, current_hr, smoking_status, drinking_status, age_group,
-    consent=False
+    consent=False, manifest=None
     ):
     
-    """把一整次評估寫入 Supabase：先寫 sessions，再批次 insert 各疾病結果。"""
+    """
+    把一整次評估排入背景寫入佇列：先寫 sessions，再批次 insert 各疾病結果。
+    實際的網路寫入在背景執行緒進行，這裡不會等待資料庫。
+    manifest：算出 results 的模型版本之 manifest（預設為目前版本）。
+    """
     try:
-        # 1) 先寫入/記錄一筆 session
-        supabase.table("user_sessions").insert({
+        # 1) session 一筆
+        session = {
             "id": st.session_state["session_id"],
             "consent": bool(consent),
             "app_version": APP_VERSION,
             "client_hint": "streamlit",
-        }, returning="minimal"   # ← 關鍵：不回傳資料，避免被 RLS 的 SELECT 擋
-        ).execute()
+        }
         
         # === [新增] 讀 manifest 取得 baseline_path 與 horizon 年數，做為寫表欄位 ===
-        m_log = _load_manifest()
+        m_log = manifest if manifest is not None else _load_manifest()
         baseline_version = str(m_log.get("baseline_path", "baseline_hazard.csv"))
         try:
             horizon_years_log = int(float(m_log.get("baseline_horizon_years", 3)))
@@ -783,31 +616,31 @@ def log_session_and_results(
                 "timezone": "Asia/Taipei",
             })
 
-        if rows:
-            supabase.table("risk_events").insert(
-                rows, returning="minimal"  # ← 同理這裡也關回傳
-            ).execute()
-
-        st.toast("✅ 已匿名記錄本次評估（寫入 Supabase）", icon="✅")
+        # 3) 寫入 spool，由背景送出（user_sessions 寫入成功後才寫 risk_events）
+        if get_log_writer().submit([("user_sessions", [session]), ("risk_events", rows)]):
+            st.toast("✅ 已匿名記錄本次評估（寫入 Supabase）", icon="✅")
+        else:
+            st.warning("目前紀錄量過大，本次評估未能記錄。")
     except Exception as e:
         st.error(f"寫入 Supabase 發生錯誤：{e}")
 
 
 
 def main():
-    # Load data
-    model_df = load_model_coefficients()
-    percentile_df = load_percentile_data()
+    _setup_page()
+    if metrics.enabled():
+        start_metrics_endpoint()
     
-    # === [新增] baseline hazard 與預設時間窗（年） ===
-    baseline_df = load_baseline_hazard()
-    m = _load_manifest()
-    horizon_years = float(m.get("baseline_horizon_years", 3))
+    # Load data（係數、百分位、baseline hazard 皆已編譯進 scoring model）
+    with stage("app.model_version"):
+        model_version = get_model_version()
+    scoring_model = model_version.model
     
+    # === [新增] baseline hazard 的預設時間窗（年），由 manifest 設定 ===
+    horizon_years = scoring_model.horizon
     
-    # Get unique diseases available in both datasets
-    available_diseases = set(model_df['Disease'].unique()) & set(percentile_df['Disease'].unique())
-    diseases = list(available_diseases)
+    # Diseases available in both datasets
+    diseases = list(scoring_model.diseases)
     
     # Header
     st.markdown('<h1 class="main-header">❤️ 個人化健康風險評估平台</h1>', unsafe_allow_html=True)
@@ -830,6 +663,7 @@ def main():
                 "current_hr": 72,
                 "smoking_status": "從未吸菸",
                 "drinking_status": "從未飲酒",
+                "covariates": {},  # manifest 另外宣告的共變數
                 "category_filters": {k: True for k in DISEASE_CATEGORIES.keys()}
             }
     
@@ -903,6 +737,22 @@ def main():
                 "飲酒狀況", ["從未飲酒", "曾經飲酒", "目前飲酒"],
                 index=["從未飲酒","曾經飲酒","目前飲酒"].index(ss.committed["drinking_status"])
             )
+
+            # manifest 另外宣告的共變數（INPUT_COLUMNS 以外）依 schema 產生輸入元件
+            extra_covariates = [c for c in scoring_model.schema.covariates if c.name not in INPUT_COLUMNS]
+            covariates_tmp = {}
+            if extra_covariates:
+                st.markdown("### 其他因子")
+                saved = ss.committed.get("covariates", {})
+                for cov in extra_covariates:
+                    if cov.type == "categorical":
+                        labels = list(cov.labels)
+                        covariates_tmp[cov.name] = st.selectbox(
+                            cov.name, labels,
+                            index=labels.index(saved[cov.name]) if saved.get(cov.name) in labels else 0
+                        )
+                    else:
+                        covariates_tmp[cov.name] = st.number_input(cov.name, value=float(saved.get(cov.name, 0.0)))
     
             st.markdown("### 疾病分類")
             st.markdown("選擇要分析的疾病類型：")
@@ -940,6 +790,7 @@ def main():
                 "current_hr": current_hr,
                 "smoking_status": smoking_status,
                 "drinking_status": drinking_status,
+                "covariates": covariates_tmp,
                 "category_filters": category_filters_tmp
             })
     
@@ -958,6 +809,19 @@ def main():
     # 用「已提交」的值計算 BMI
     bmi = calculate_bmi(height, weight, height_unit, weight_unit) or 25.0
 
+    # 評分的輸入以共變數名稱為鍵，只取模型 schema 用到的欄位（manifest 增減共變數時跟著變）；
+    # 年齡另外用於百分位的比較群體
+    inputs = {
+        "age": age,
+        "gender": gender,
+        "current_hr": current_hr,
+        "bmi": bmi,
+        "smoking_status": smoking_status,
+        "drinking_status": drinking_status,
+        **ss.committed.get("covariates", {}),
+    }
+    profile = {"age": age, **{name: inputs[name] for name in scoring_model.schema.inputs if name in inputs}}
+
     
     # Determine user's demographic group
     age_group = get_age_group_for_percentile(age)
@@ -996,41 +860,24 @@ def main():
         return
     
     # Calculate percentiles for filtered diseases
+    # 所有疾病的 LP 一次矩陣乘法、百分位一次 searchsorted 算完（結果依輸入與模型版本快取），再依分類篩選
     results = []
     
-    for disease in filtered_diseases:
-        user_lp = calculate_linear_predictor(
-            disease, age, gender, current_hr, bmi, 
-            smoking_status, drinking_status, model_df
-        )
-        
-        if user_lp is not None:
-            # === [新增] 先算絕對風險（預設為三年；可由 manifest 調 horizon_years） ===
-            H0 = lookup_H0(disease, horizon_years, baseline_df)
-            abs_risk = cox_absolute_risk(user_lp, H0) if H0 is not None else None
-            
+    with stage("app.score"):
+        all_results = get_result_cache().score(scoring_model, model_version.digest, profile)
+        for result in all_results:
+            disease = result['disease']
+            if disease not in filtered_diseases:
+                continue
             
-            percentile, exact_percentile = calculate_percentile_rank(
-                user_lp, disease, gender, age_group, percentile_df
-            )
-            
-            if percentile is not None:
-                risk_category, card_class, color = get_risk_category_and_color(percentile, disease)
-                results.append({
-                    'disease': disease,
-                    'percentile': percentile,
-                    'exact_percentile': exact_percentile,
-                    'risk_category': risk_category,
-                    'card_class': card_class,
-                    'color': color,
-                    'lp': user_lp,
-                    'category': DISEASE_TO_CATEGORY.get(disease, '其他'), 
-                    
-                    # === [新增] 兩個欄位：H0 與 絕對風險 ===
-                    'H0': H0,
-                    'abs_risk_years': horizon_years,
-                    'abs_risk': abs_risk
-                })
+            risk_category, card_class, color = get_risk_category_and_color(result['percentile'], disease)
+            results.append({
+                **result,
+                'risk_category': risk_category,
+                'card_class': card_class,
+                'color': color,
+                'category': DISEASE_TO_CATEGORY.get(disease, '其他'), 
+            })
     
     if results:
         # Create risk summary statistics
@@ -1092,8 +939,9 @@ def main():
         st.markdown('</div>', unsafe_allow_html=True)
         
         # Create and display risk distribution chart
-        risk_chart = create_risk_summary_chart(risk_counts)
-        st.plotly_chart(risk_chart, use_container_width=True)
+        risk_chart = get_risk_summary_chart(tuple(risk_counts.items()))
+        with stage("app.plotly_chart.risk_summary"):
+            st.plotly_chart(risk_chart, use_container_width=True)
         
         # Sort results by percentile (highest risk first)
         results.sort(key=lambda x: x['percentile'], reverse=True)
@@ -1105,6 +953,15 @@ def main():
         categories_with_results = list(set([result['category'] for result in results]))
         categories_with_results.sort()
         
+        if GAUGE_MODE == "plotly_grid":
+            # 全部儀表一張圖（依分類、再依百分位排列，同下方卡片順序）
+            gauges = tuple((r['percentile'], r['disease'])
+                           for category in categories_with_results
+                           for r in results if r['category'] == category)
+            gauge_grid = get_gauge_grid(gauges)
+            with stage("app.plotly_chart.gauge_grid"):
+                st.plotly_chart(gauge_grid, use_container_width=True)
+        
         for category in categories_with_results:
             category_results = [r for r in results if r['category'] == category]
             
@@ -1116,8 +973,10 @@ def main():
                 for i, result in enumerate(category_results):
                     with cols[i % len(cols)]:
                         # Create gauge chart
-                        fig = create_percentile_gauge(result['percentile'], result['disease'])
-                        st.plotly_chart(fig, use_container_width=True)
+                        if GAUGE_MODE == "plotly":
+                            fig = get_percentile_gauge(result['percentile'], result['disease'])
+                            with stage("app.plotly_chart.gauge"):
+                                st.plotly_chart(fig, use_container_width=True)
                         
                         # Risk interpretation in Chinese
                         chinese_disease_name = DISEASE_CHINESE_NAMES.get(result['disease'], result['disease'])
@@ -1134,20 +993,46 @@ def main():
                             interpretation = f"較低風險（高於{result['percentile']}%的人）"
                             recommendation = "維持現有的生活方式"
                         
-                        st.markdown(f"""
-                        <div class="{result['card_class']}">
-                            <h4>{chinese_disease_name}</h4>
-                            <div class="percentile-number">{result['percentile']}</div>
-                            <p>百分位數</p>
-                            <hr style="border-color: rgba(255,255,255,0.3);">
-                            <p style="font-size: 0.9rem;">{interpretation}</p>
-                            <p style="font-size: 0.8rem;"><em>{recommendation}</em></p>
-                            {"<p style='font-size: 0.95rem; font-weight: 700;'>"
-                             f"{int(result['abs_risk_years']) if result['abs_risk_years'].is_integer() else result['abs_risk_years']}年內罹病機率：約 "
-                             f"{result['abs_risk']*100:.1f}%</p>" if result.get('abs_risk') is not None else ""}
-                            <p style="font-size: 0.7rem;">線性預測值: {result['lp']:.3f}</p>
-                        </div>
-                        """, unsafe_allow_html=True)
+                        with stage("app.result_card_html"):
+                            st.markdown(f"""
+                            <div class="{result['card_class']}">
+                                <h4>{chinese_disease_name}</h4>
+                                {create_svg_gauge(result['percentile']) if GAUGE_MODE == "svg" else ""}
+                                <div class="percentile-number">{result['percentile']}</div>
+                                <p>百分位數</p>
+                                <hr style="border-color: rgba(255,255,255,0.3);">
+                                <p style="font-size: 0.9rem;">{interpretation}</p>
+                                <p style="font-size: 0.8rem;"><em>{recommendation}</em></p>
+                                {"<p style='font-size: 0.95rem; font-weight: 700;'>"
+                                 f"{int(result['abs_risk_years']) if result['abs_risk_years'].is_integer() else result['abs_risk_years']}年內罹病機率：約 "
+                                 f"{result['abs_risk']*100:.1f}%</p>" if result.get('abs_risk') is not None else ""}
+                                <p style="font-size: 0.7rem;">線性預測值: {result['lp']:.3f}</p>
+                            </div>
+                            """, unsafe_allow_html=True)
+        
+        # 累積罹病機率曲線（選擇性顯示）：全部疾病 × 1–10 年一次算完並依輸入快取，
+        # 切換疾病或年數範圍只重畫圖
+        if st.checkbox("📉 顯示 1–10 年累積罹病機率曲線", value=False, key="show_risk_curves"):
+            curves = get_result_cache().curves(scoring_model, model_version.digest, profile)
+            curve_diseases = st.multiselect(
+                "顯示的疾病",
+                options=[r['disease'] for r in results],
+                default=[r['disease'] for r in results],
+                format_func=lambda d: DISEASE_CHINESE_NAMES.get(d, d),
+                key="risk_curve_diseases",
+            )
+            max_years = st.select_slider("顯示到第幾年", options=[int(t) for t in curves.index],
+                                         value=int(curves.index[-1]), key="risk_curve_years")
+            shown = curves.loc[:max_years, curve_diseases]
+            if curve_diseases:
+                years = tuple(float(t) for t in shown.index)
+                chart = get_risk_curve_chart(tuple(
+                    (d, years, tuple(None if math.isnan(v) else float(v) for v in shown[d])) for d in curve_diseases
+                ))
+                with stage("app.plotly_chart.risk_curves"):
+                    st.plotly_chart(chart, use_container_width=True)
+                if shown.isna().to_numpy().any():
+                    st.caption("部分年數沒有 baseline hazard（H0）資料，該段曲線留白。")
         
         # Detailed comparison table
         st.markdown("### 詳細結果表格")
@@ -1166,7 +1051,8 @@ def main():
             ],
         })
         
-        st.dataframe(comparison_df, use_container_width=True, hide_index=True)
+        with stage("app.results_table"):
+            st.dataframe(comparison_df, use_container_width=True, hide_index=True)
         
         # Summary insights
         st.markdown("### 💡 重點分析")
@@ -1197,20 +1083,25 @@ def main():
     else:
         st.error("無法計算所選分類的風險百分位數。請檢查您的人口統計組是否有可用數據。")
     
-    # 只有使用者勾選同意，才寫入
-    if consent and results:
-        log_session_and_results(
-            results=results,
-            age=age,
-            gender=gender,
-            bmi=bmi,
-            current_hr=current_hr,
-            smoking_status=smoking_status,
-            drinking_status=drinking_status,
-            age_group=age_group,
-            consent=consent
-        )
+    # 只有使用者勾選同意、且是按下「確定」的這次 rerun 才寫入；
+    # 表單外的元件（累積風險曲線）觸發的 rerun 不重複記錄同一次評估
+    if submitted and consent and results:
+        with stage("app.log_session_and_results"):
+            log_session_and_results(
+                results=results,
+                age=age,
+                gender=gender,
+                bmi=bmi,
+                current_hr=current_hr,
+                smoking_status=smoking_status,
+                drinking_status=drinking_status,
+                age_group=age_group,
+                consent=consent,
+                manifest=model_version.manifest
+            )
 
 
 if __name__ == "__main__":
-    main()
+    # 整次 rerun 的耗時（含以上各階段）
+    with stage("app.main"):
+        main()
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+評分 API 的延遲量測（本機 uvicorn + keep-alive 連線，不需網路）：
+
+    python benchmarks/bench_api.py --requests 5000 --batch 1000
+
+啟動 hrrisk.api 於隨機埠，依序送出 --requests 個 POST /score（輸入取自合成資料，
+快取會有命中也有未命中），列出 p50 / p90 / p99 / max；再量 --batch 列的 POST /score/batch。
+"""
+
+from __future__ import annotations
+
+import argparse
+import http.client
+import json
+import socket
+import threading
+import time
+from pathlib import Path
+
+from common import make_cohort
+
+import uvicorn
+
+from hrrisk.api import create_app
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _percentile(sorted_values: list[float], q: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--batch", type=int, default=1000, help="批次請求的列數（0 = 不量）")
+    parser.add_argument("--manifest", default=None, help="manifest.json 路徑（預設自動尋找）")
+    parser.add_argument("--json", default=None, help="把結果另存成 JSON")
+    args = parser.parse_args(argv)
+
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(create_app(manifest_path=args.manifest), host="127.0.0.1",
+                                           port=port, log_level="warning", access_log=False))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+
+    conn = http.client.HTTPConnection("127.0.0.1", port)
+    headers = {"Content-Type": "application/json"}
+
+    def post(path: str, payload: object) -> float:
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        t0 = time.perf_counter()
+        conn.request("POST", path, body=body, headers=headers)
+        resp = conn.getresponse()
+        resp.read()
+        elapsed = time.perf_counter() - t0
+        if resp.status != 200:
+            raise SystemExit(f"{path}：HTTP {resp.status}")
+        return elapsed
+
+    profiles = make_cohort(max(args.requests, args.batch)).to_dict("records")
+    post("/score", profiles[0])  # 暖機
+    latency = sorted(post("/score", p) for p in profiles[:args.requests])
+    report = {
+        "requests": args.requests,
+        "p50_ms": 1000 * _percentile(latency, 0.50),
+        "p90_ms": 1000 * _percentile(latency, 0.90),
+        "p99_ms": 1000 * _percentile(latency, 0.99),
+        "max_ms": 1000 * latency[-1],
+    }
+    print(f"POST /score ×{args.requests:,}  p50 {report['p50_ms']:.2f} ms  p90 {report['p90_ms']:.2f} ms  "
+          f"p99 {report['p99_ms']:.2f} ms  max {report['max_ms']:.2f} ms")
+
+    if args.batch:
+        seconds = min(post("/score/batch", {"profiles": profiles[:args.batch]}) for _ in range(3))
+        report.update(batch_rows=args.batch, batch_ms=1000 * seconds)
+        print(f"POST /score/batch ×{args.batch:,} 列  {1000 * seconds:.1f} ms")
+
+    server.should_exit = True
+    thread.join(timeout=5)
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, indent=2), encoding="utf-8")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+多行程批次評分的加速比量測：
+
+    python benchmarks/bench_parallel.py --rows 2000000 --workers 1 2 4 8 16
+    python benchmarks/bench_parallel.py --rows 2000000 --cli csv parquet
+
+以 model/manifest.json 指向的係數（目前為 coefficients_250829.csv）評分合成資料，
+每個 workers 設定跑 --repeat 次取最短時間，列出 rows/s 與相對單行程的加速比。
+預設只量記憶體內的 score_batch_parallel；--cli 則把合成資料寫成 CSV，
+端到端計時 `python -m hrrisk score`（讀檔、評分、編碼、寫檔），輸出為指定格式。
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import tempfile
+import time
+from pathlib import Path
+
+from common import make_cohort
+
+from hrrisk import cli
+from hrrisk.parallel import default_workers, score_batch_parallel
+from hrrisk.scoring import load_scoring_model
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--cli", nargs="+", choices=["csv", "parquet"], default=None,
+                        help="端到端量測命令列評分，輸出為這些格式")
+    parser.add_argument("--chunksize", type=int, default=cli.DEFAULT_CHUNKSIZE)
+    parser.add_argument("--json", default=None, help="把結果另存成 JSON")
+    args = parser.parse_args(argv)
+
+    data = make_cohort(args.rows)
+    print(f"rows={args.rows:,}  cpu_count={default_workers()}")
+
+    results = []
+    if args.cli:
+        with tempfile.TemporaryDirectory() as tmp:
+            src = Path(tmp) / "cohort.csv"
+            data.to_csv(src, index=False)
+            for fmt in args.cli:
+                dst = Path(tmp) / f"scored.{fmt}"
+                run = ["score", str(src), str(dst), "--chunksize", str(args.chunksize), "--workers"]
+                results += _sweep(args, f"cli {fmt:<7} ", lambda w: cli.main(run + [str(w)]))
+    else:
+        model = load_scoring_model()
+        results += _sweep(args, "", lambda w: score_batch_parallel(data, model, workers=w))
+
+    if args.json:
+        Path(args.json).write_text(json.dumps({"rows": args.rows, "results": results}, indent=2), encoding="utf-8")
+    return 0
+
+
+def _sweep(args: argparse.Namespace, label: str, run) -> list[dict]:
+    results = []
+    base = None
+    for w in args.workers:
+        best = min(_timed(lambda: run(w)) for _ in range(args.repeat))
+        base = base or best
+        results.append({"mode": label.strip() or "memory", "workers": w, "seconds": best,
+                        "rows_per_s": args.rows / best, "speedup": base / best})
+        print(f"{label}workers={w:>3}  {best:8.3f}s  {args.rows / best:12,.0f} rows/s  speedup x{base / best:5.2f}")
+    return results
+
+
+def _timed(fn) -> float:
+    t0 = time.perf_counter()
+    fn()
+    return time.perf_counter() - t0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""
+評分熱路徑的基準測試（不需網路）：
+
+    python benchmarks/bench_scoring.py --json before.json
+    # ... 改程式或模型 ...
+    python benchmarks/bench_scoring.py --json after.json --compare before.json
+
+量測項目：
+- 載入：load_model_coefficients / load_percentile_data / load_baseline_hazard、
+  load_scoring_model（CSV 與 compile-model 產物）
+- 單項：calculate_linear_predictor、calculate_percentile_rank、lookup_H0、cox_absolute_risk，
+  以及向量版的 H0_at（全部疾病 × 1–10 年）與 absolute_risk
+- 百分位：原檔 17 欄與 1001 欄高解析度表（由原檔內插而得）的 calculate_percentile_rank 與整批 rank
+- 單人：score_profile（全部疾病；即時計算與查表模式）
+- 批次：score_batch，--rows 指定列數（預設 1k / 100k / 1M）
+
+每項以 timeit 自動決定每輪呼叫次數（每輪至少 --min-time 秒），跑 --repeat 輪，
+記錄每次呼叫的最短與中位數時間。--compare 比對先前的 JSON，
+最短時間變慢超過 --threshold（預設 20%）的項目標為 REGRESSION，並以結束碼 1 結束。
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+import timeit
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+
+from common import ROOT, make_cohort
+
+from hrrisk import loaders
+from hrrisk.artifact import compile_model
+from hrrisk.engine import compile_coefficients
+from hrrisk.lookup import build_lookup_table
+from hrrisk.percentiles import PercentileTable, compile_percentiles
+from hrrisk.scoring import (
+    absolute_risk,
+    calculate_linear_predictor,
+    calculate_percentile_rank,
+    cox_absolute_risk,
+    load_scoring_model,
+    lookup_H0,
+    score_batch,
+    score_profile,
+)
+
+
+DEFAULT_ROWS = [1_000, 100_000, 1_000_000]
+
+# 單人評分用的固定輸入
+PROFILE = dict(age=52, gender="Female", current_hr=78, bmi=26.3, smoking_status="曾經吸菸", drinking_status="目前飲酒")
+
+
+def dense_table(table: PercentileTable, n_knots: int = 1000) -> PercentileTable:
+    """把 17 欄的百分位表線性內插成 0%…100% 共 n_knots + 1 欄（0% 取 1% 門檻），量測高解析度表的排名成本。"""
+    grid = np.linspace(0.0, 100.0, n_knots + 1)
+    pv = np.concatenate([[0.0], table.grid])
+    flat = table.values.reshape(-1, len(table.grid))
+    dense = np.array([np.interp(grid, pv, np.concatenate([row[:1], row])) for row in flat])
+    return PercentileTable(table.diseases, dense.reshape(*table.shape[:3], -1), table.present, grid=grid)
+
+
+def build_cases(rows: list[int], manifest_path: str | None, workdir: Path) -> dict[str, Callable[[], object]]:
+    """名稱 → 無參數的待測函式。資料與模型在這裡先準備好，不計入量測；暫存檔寫在 workdir。"""
+    m = loaders.load_manifest(manifest_path)
+    coef_df = loaders.load_model_coefficients(manifest=m)
+    pct_df = loaders.load_percentile_data(manifest=m)
+    baseline_df = loaders.load_baseline_hazard(manifest=m)
+    compiled = compile_coefficients(coef_df)
+    table = compile_percentiles(pct_df)
+    model = load_scoring_model(manifest=m, use_artifact=False)
+    lookup_model = load_scoring_model(manifest=m, use_artifact=False)
+    lookup_model.use_lookup(build_lookup_table(lookup_model))
+
+    # compile-model 產物寫到暫存資料夾，不動到 model/
+    artifact_manifest = dict(m, artifact_path=str(workdir / "compiled_model.bin"))
+    compile_model(manifest_path, artifact_manifest["artifact_path"])
+
+    disease = model.diseases[0]
+    age_group = "50-54"
+    lp = calculate_linear_predictor(disease, PROFILE["age"], PROFILE["gender"], PROFILE["current_hr"], PROFILE["bmi"],
+                                    PROFILE["smoking_status"], PROFILE["drinking_status"], model)
+    H0 = lookup_H0(disease, model.horizon, baseline_df)
+    horizons = np.arange(1.0, 11.0)
+    H0_grid = model.H0_at(horizons)
+    lps = model.compiled.coef[model.coef_rows] @ np.ones(len(model.compiled.columns))
+    dense = dense_table(table)
+    rng = np.random.default_rng(0)
+    rank_cells = rng.choice(np.flatnonzero(table.present.ravel()), 100_000)
+    rank_lps = table.values.reshape(-1, len(table.grid))[rank_cells, 8] + rng.normal(0, 0.5, len(rank_cells))
+
+    cases: dict[str, Callable[[], object]] = {
+        "load_model_coefficients": lambda: loaders.load_model_coefficients(manifest=m),
+        "load_percentile_data": lambda: loaders.load_percentile_data(manifest=m),
+        "load_baseline_hazard": lambda: loaders.load_baseline_hazard(manifest=m),
+        "load_scoring_model[csv]": lambda: load_scoring_model(manifest=m, use_artifact=False),
+        "load_scoring_model[artifact]": lambda: load_scoring_model(manifest=artifact_manifest),
+        "calculate_linear_predictor": lambda: calculate_linear_predictor(
+            disease, PROFILE["age"], PROFILE["gender"], PROFILE["current_hr"], PROFILE["bmi"],
+            PROFILE["smoking_status"], PROFILE["drinking_status"], model),
+        "calculate_linear_predictor[CompiledModel]": lambda: calculate_linear_predictor(
+            disease, PROFILE["age"], PROFILE["gender"], PROFILE["current_hr"], PROFILE["bmi"],
+            PROFILE["smoking_status"], PROFILE["drinking_status"], compiled),
+        "calculate_percentile_rank": lambda: calculate_percentile_rank(lp, disease, PROFILE["gender"], age_group, table),
+        "calculate_percentile_rank[1001 knots]": lambda: calculate_percentile_rank(
+            lp, disease, PROFILE["gender"], age_group, dense),
+        "PercentileTable.rank[100000]": lambda: table.rank(rank_lps, rank_cells),
+        "PercentileTable.rank[100000,1001 knots]": lambda: dense.rank(rank_lps, rank_cells),
+        "lookup_H0": lambda: lookup_H0(disease, model.horizon, baseline_df),
+        "cox_absolute_risk": lambda: cox_absolute_risk(lp, H0),
+        "H0_at[1-10y]": lambda: model.H0_at(horizons),
+        "absolute_risk[1-10y]": lambda: absolute_risk(lps[:, None], H0_grid),
+        "score_profile": lambda: score_profile(model, PROFILE),
+        "score_profile[lookup]": lambda: score_profile(lookup_model, PROFILE),
+    }
+    for n in rows:
+        data = make_cohort(n)
+        cases[f"score_batch[{n}]"] = lambda data=data: score_batch(data, model)
+        cases[f"score_batch[{n},lookup]"] = lambda data=data: score_batch(data, lookup_model)
+    return cases
+
+
+def run_case(fn: Callable[[], object], repeat: int, min_time: float) -> dict:
+    fn()  # 暖機（import、快取）
+    timer = timeit.Timer(fn)
+    number = 1
+    while True:
+        elapsed = timer.timeit(number)
+        if elapsed >= min_time or number >= 1_000_000:
+            break
+        number *= max(2, min(10, int(min_time / max(elapsed, 1e-9)) + 1))
+    per_call = [t / number for t in timer.repeat(repeat=repeat, number=number)]
+    return {
+        "best_s": min(per_call),
+        "median_s": statistics.median(per_call),
+        "number": number,
+        "repeat": repeat,
+    }
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def _fmt(seconds: float) -> str:
+    for unit, scale in (("s", 1.0), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:8.2f} {unit}"
+    return f"{seconds / 1e-9:8.0f} ns"
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """印出與 baseline 的比值；回傳變慢超過 threshold 的項目名稱。"""
+    regressions = []
+    print(f"\n與 {baseline['environment'].get('git_commit') or '先前結果'} 比較（最短時間，新/舊）：")
+    for name, r in results.items():
+        old = baseline["results"].get(name)
+        if old is None:
+            print(f"  {name:<36} （新項目）")
+            continue
+        ratio = r["best_s"] / old["best_s"]
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        elif ratio < 1 / (1 + threshold):
+            flag = "  faster"
+        print(f"  {name:<36} {_fmt(old['best_s'])} → {_fmt(r['best_s'])}  x{ratio:5.2f}{flag}")
+    return regressions
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=DEFAULT_ROWS, help="score_batch 的列數")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.2, help="每輪至少量測幾秒")
+    parser.add_argument("-k", "--filter", default=None, help="只跑名稱含此字串的項目")
+    parser.add_argument("--manifest", default=None, help="manifest.json 路徑（預設自動尋找）")
+    parser.add_argument("--json", default=None, help="把結果存成 JSON")
+    parser.add_argument("--compare", default=None, help="與先前 --json 的結果比較")
+    parser.add_argument("--threshold", type=float, default=0.2, help="變慢超過此比例視為退步")
+    args = parser.parse_args(argv)
+
+    results = {}
+    t0 = time.perf_counter()
+    with tempfile.TemporaryDirectory(prefix="hrrisk-bench-") as workdir:
+        cases = build_cases(args.rows, args.manifest, Path(workdir))
+        if args.filter:
+            cases = {k: v for k, v in cases.items() if args.filter in k}
+        for name, fn in cases.items():
+            r = run_case(fn, args.repeat, args.min_time)
+            results[name] = r
+            print(f"{name:<36} best {_fmt(r['best_s'])}  median {_fmt(r['median_s'])}  (×{r['number']})")
+    print(f"共 {len(results)} 項，{time.perf_counter() - t0:.1f} 秒")
+
+    report = {"environment": environment(), "results": results}
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
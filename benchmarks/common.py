@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+"""benchmarks/ 共用：把專案根目錄加進 sys.path，並產生合成資料。"""
+
+from __future__ import annotations
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from hrrisk.engine import DRINKING_VARIABLES, SMOKING_VARIABLES  # noqa: E402
+
+
+def make_cohort(n: int, seed: int = 0) -> pd.DataFrame:
+    """產生 n 筆涵蓋所有分組的合成健檢資料。"""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "age": rng.integers(20, 91, n),
+        "gender": rng.choice(["Male", "Female"], n),
+        "current_hr": rng.integers(40, 121, n),
+        "bmi": np.round(rng.uniform(15, 40, n), 1),
+        "smoking_status": rng.choice(list(SMOKING_VARIABLES), n),
+        "drinking_status": rng.choice(list(DRINKING_VARIABLES), n),
+    })
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""心率風險模型的評分核心（不依賴 Streamlit）。"""
+
+from .artifact import compile_model
+from .baseline import BaselineHazard, compile_baseline
+from .cache import ProfileCache
+from .categories import (
+    AGE_GROUP_BANDS,
+    BMI_BANDS,
+    HR_BANDS,
+    Bands,
+    calculate_bmi,
+    get_age_group_for_percentile,
+    get_bmi_category,
+    get_bmi_model_category,
+    get_heart_rate_category,
+)
+from .engine import (
+    CONTINUOUS_VARIABLES,
+    DRINKING_VARIABLES,
+    GENDER_VARIABLES,
+    SMOKING_VARIABLES,
+    CompiledModel,
+    compile_coefficients,
+)
+from .loaders import (
+    load_baseline_hazard,
+    load_manifest,
+    load_model_coefficients,
+    load_percentile_data,
+)
+from .lookup import LookupTable, build_lookup_table, load_lookup_table
+from .percentiles import PercentileTable, compile_percentiles
+from .registry import ModelRegistry, ModelVersion, get_registry
+from .schema import DEFAULT_SCHEMA, CovariateSchema, load_schema
+from .scoring import (
+    CURVE_HORIZONS,
+    INPUT_COLUMNS,
+    RESULT_FIELDS,
+    ScoringModel,
+    absolute_risk,
+    calculate_linear_predictor,
+    calculate_percentile_rank,
+    cox_absolute_risk,
+    load_scoring_model,
+    lookup_H0,
+    result_column,
+    risk_curves,
+    score_batch,
+    score_profile,
+)
+
+__all__ = [
+    "compile_model",
+    "BaselineHazard",
+    "compile_baseline",
+    "ProfileCache",
+    "AGE_GROUP_BANDS",
+    "BMI_BANDS",
+    "HR_BANDS",
+    "Bands",
+    "calculate_bmi",
+    "get_age_group_for_percentile",
+    "get_bmi_category",
+    "get_bmi_model_category",
+    "get_heart_rate_category",
+    "CONTINUOUS_VARIABLES",
+    "DRINKING_VARIABLES",
+    "GENDER_VARIABLES",
+    "SMOKING_VARIABLES",
+    "CompiledModel",
+    "compile_coefficients",
+    "load_baseline_hazard",
+    "load_manifest",
+    "load_model_coefficients",
+    "load_percentile_data",
+    "LookupTable",
+    "build_lookup_table",
+    "load_lookup_table",
+    "PercentileTable",
+    "compile_percentiles",
+    "ModelRegistry",
+    "ModelVersion",
+    "get_registry",
+    "DEFAULT_SCHEMA",
+    "CovariateSchema",
+    "load_schema",
+    "CURVE_HORIZONS",
+    "INPUT_COLUMNS",
+    "RESULT_FIELDS",
+    "ScoringModel",
+    "absolute_risk",
+    "calculate_linear_predictor",
+    "calculate_percentile_rank",
+    "cox_absolute_risk",
+    "load_scoring_model",
+    "lookup_H0",
+    "result_column",
+    "risk_curves",
+    "score_batch",
+    "score_profile",
+]
@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+"""python -m hrrisk ..."""
+
+from .cli import main
+
+raise SystemExit(main())
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+評分 HTTP API（ASGI，Starlette），與 Streamlit app 共用同一套評分核心，不需要 Supabase：
+
+    python -m hrrisk serve --port 8000
+    curl -X POST localhost:8000/score -d '{"age": 52, "gender": "Female", "current_hr": 78,
+        "bmi": 26.3, "smoking_status": "曾經吸菸", "drinking_status": "目前飲酒"}'
+
+- POST /score：單人，回傳每個疾病的 lp / percentile / exact_percentile / risk_category / abs_risk
+  （找不到百分位組別的疾病略過，同 score_profile）。結果依輸入與模型版本快取（ProfileCache）。
+- POST /score/batch：{"profiles": [...]}，回傳 diseases 與 lp / percentile / exact_percentile / risk_category /
+  abs_risk 各一個「人 × 疾病」的二維陣列（列順序同輸入，欄順序同 diseases）；找不到百分位組別為 null。
+- GET /health：模型版本與快取命中率。
+- GET /metrics：各階段耗時（Prometheus 文字格式，見 hrrisk.metrics）；未設定 HRRISK_METRICS 時為 404。
+
+輸入欄位與可接受的選項取自目前模型的共變數 schema（manifest 的 "covariates"），
+新增共變數後 API 直接接受新欄位。
+
+模型由 ModelRegistry 提供，模型檔更新後自動換版，回應中的 model_version 即版本雜湊的前 12 碼。
+app 啟動時（lifespan）開啟 registry 的背景監看，檢查檔案、建新版本與查表都在監看執行緒完成，
+請求中的 registry.current() 只讀取目前版本，不在事件迴圈上讀檔或編譯。
+單人評分只需數十微秒，直接在事件迴圈內完成；大批次改在執行緒池計算，不阻塞其他請求。
+需要安裝 starlette，執行 serve 另需 uvicorn。
+"""
+
+from __future__ import annotations
+
+import contextlib
+import json
+import math
+from pathlib import Path
+
+import numpy as np
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+from . import metrics
+from .cache import ProfileCache
+from .registry import ModelRegistry, get_registry
+from .schema import DEFAULT_SCHEMA, CovariateSchema
+from .scoring import RESULT_FIELDS, result_column, score_batch
+
+MAX_BATCH_ROWS = 10_000
+# 超過此列數的批次改在執行緒池計算
+THREADPOOL_ROWS = 256
+
+
+
+class InputError(ValueError):
+    """請求內容不合格式（回應 422；JSON 本身無法解析時為 400）。"""
+
+    def __init__(self, message: str, status: int = 422):
+        super().__init__(message)
+        self.status = status
+
+
+def _error(status: int, message: str) -> JSONResponse:
+    return JSONResponse({"error": message}, status_code=status)
+
+
+def validate_profile(profile, where: str = "", schema: CovariateSchema = DEFAULT_SCHEMA) -> dict:
+    """檢查單人的輸入欄位，回傳只含 schema.inputs 的 dict；不合格式時 InputError。"""
+    if not isinstance(profile, dict):
+        raise InputError(f"{where}輸入須為 JSON 物件")
+    out = {}
+    for cov in schema.covariates:
+        name = cov.name
+        if name not in profile:
+            raise InputError(f"{where}缺少欄位：{name}")
+        value = profile[name]
+        if cov.type != "categorical":
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+                raise InputError(f"{where}{name} 須為數值")
+        else:
+            try:
+                cov.code(value)  # 與評分相同的正規化（去空白、1.0 → "1"）
+            except ValueError:
+                raise InputError(f"{where}{name} 須為 {list(cov.choices)} 之一") from None
+        out[name] = value
+    return out
+
+
+async def _json_body(request: Request):
+    body = await request.body()
+    try:
+        return json.loads(body)
+    except ValueError as e:
+        raise InputError(f"JSON 格式錯誤：{e}", 400) from e
+
+
+def _batch_results(profiles: list[dict], model) -> dict[str, list]:
+    """score_batch → 每個欄位一個 列 × 疾病 的二維陣列（缺值為 None），疾病順序同 model.diseases。"""
+    columns = {c.name: np.array([p[c.name] for p in profiles],
+                                dtype=object if c.type == "categorical" else np.float64)
+               for c in model.schema.covariates}
+    df = score_batch(columns, model)
+    out = {}
+    for field in RESULT_FIELDS:
+        block = df[[result_column(d, field) for d in model.diseases]]
+        if field in ("lp", "abs_risk"):
+            values = block.to_numpy(dtype=np.float64)
+            rows = values.tolist()
+            if np.isnan(values).any():
+                rows = [[None if v != v else v for v in row] for row in rows]
+        else:
+            rows = block.to_numpy(dtype=object, na_value=None).tolist()
+        out[field] = rows
+    return out
+
+
+def create_app(registry: ModelRegistry | None = None, manifest_path: str | Path | None = None,
+               cache: ProfileCache | None = None) -> Starlette:
+    """建立 ASGI app。registry 預設為 get_registry(manifest_path)（行程內共用）。"""
+    registry = registry or get_registry(manifest_path)
+    cache = cache or ProfileCache()
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app: Starlette):
+        # 由本 app 開啟的監看在關閉時停止；registry 已在監看時沿用
+        started = not registry.watching
+        registry.watch()
+        try:
+            yield
+        finally:
+            if started:
+                await run_in_threadpool(registry.stop)
+
+    async def score(request: Request) -> JSONResponse:
+        version = registry.current()
+        try:
+            profile = validate_profile(await _json_body(request), schema=version.model.schema)
+        except InputError as e:
+            return _error(e.status, str(e))
+        with metrics.stage("api.score"):
+            results = cache.score(version.model, version.digest, profile)
+        return JSONResponse({
+            "model_version": version.version,
+            "horizon_years": version.model.horizon,
+            "results": [{"disease": r["disease"], **{field: r[field] for field in RESULT_FIELDS}} for r in results],
+        })
+
+    async def score_many(request: Request) -> JSONResponse:
+        try:
+            body = await _json_body(request)
+            profiles = body.get("profiles") if isinstance(body, dict) else None
+            if not isinstance(profiles, list):
+                raise InputError("請以 {\"profiles\": [...]} 傳入")
+            if len(profiles) > MAX_BATCH_ROWS:
+                return _error(413, f"一次最多 {MAX_BATCH_ROWS} 筆")
+            version = registry.current()
+            schema = version.model.schema
+            profiles = [validate_profile(p, f"profiles[{i}]：", schema) for i, p in enumerate(profiles)]
+        except InputError as e:
+            return _error(e.status, str(e))
+        with metrics.stage("api.score_batch"):
+            if len(profiles) > THREADPOOL_ROWS:
+                results = await run_in_threadpool(_batch_results, profiles, version.model)
+            elif profiles:
+                results = _batch_results(profiles, version.model)
+            else:
+                results = {field: [] for field in RESULT_FIELDS}
+        return JSONResponse({
+            "model_version": version.version,
+            "horizon_years": version.model.horizon,
+            "diseases": list(version.model.diseases),
+            **results,
+        })
+
+    async def health(request: Request) -> JSONResponse:
+        version = registry.current()
+        return JSONResponse({
+            "status": "ok",
+            "model_version": version.version,
+            "diseases": len(version.model.diseases),
+            "cache": cache.stats(),
+        })
+
+    async def metrics_text(request: Request) -> Response:
+        if not metrics.enabled():
+            return _error(404, "未開啟計時（設定 HRRISK_METRICS=1）")
+        return Response(metrics.METRICS.render_prometheus(), media_type=metrics.CONTENT_TYPE)
+
+    return Starlette(lifespan=lifespan, routes=[
+        Route("/score", score, methods=["POST"]),
+        Route("/score/batch", score_many, methods=["POST"]),
+        Route("/health", health, methods=["GET"]),
+        Route("/metrics", metrics_text, methods=["GET"]),
+    ])
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+編譯後的模型檔（artifact）：把 manifest 指到的係數、百分位、baseline CSV
+轉成單一二進位檔，啟動時以 mmap 直接取得陣列，不再解析 CSV（百分位檔用的是最慢的 sep=None 解析器）。
+
+    python -m hrrisk compile-model            # 輸出到 manifest 的 artifact_path（預設 compiled_model.bin）
+
+檔案格式（little-endian）：
+    MAGIC (8 bytes) | 格式版本 uint32 | header 長度 uint32 | header（UTF-8 JSON）| 陣列資料
+header 記錄來源 CSV 的 SHA-256、疾病/欄位名稱，以及每個陣列的 dtype、shape、位移與 SHA-256；
+陣列各自對齊 64 bytes，可直接以 np.frombuffer 建立零複製的唯讀視圖。
+
+load_scoring_model 會先找 artifact：不存在、格式版本不同、來源 CSV 已變動或 checksum 不符時
+改回讀 CSV，因此 artifact 過期只會變慢，不會算錯。
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .engine import CompiledModel, compile_coefficients
+from .loaders import (
+    load_baseline_hazard,
+    load_manifest,
+    load_model_coefficients,
+    load_percentile_data,
+    model_files,
+)
+from .percentiles import PercentileTable, compile_percentiles
+
+
+MAGIC = b"HRRISKM\0"
+FORMAT_VERSION = 2  # 2：加入百分位欄（grid）與高解析度表的 bins
+DEFAULT_ARTIFACT = "compiled_model.bin"
+
+_PREFIX = struct.Struct("<8sII")
+_ALIGN = 64
+
+
+class ArtifactError(ValueError):
+    """artifact 不存在、過期或損毀。"""
+
+
+def artifact_path(manifest: dict) -> Path:
+    """manifest 的 artifact_path（相對於 manifest 所在資料夾）。"""
+    return manifest["_base_dir"] / manifest.get("artifact_path", DEFAULT_ARTIFACT)
+
+
+def file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def source_digests(manifest: dict) -> dict[str, str]:
+    """各來源 CSV 的 SHA-256（MODEL_FILE_KEYS 的鍵 → hex）。"""
+    return {key: file_sha256(path) for key, path in model_files(manifest).items()}
+
+
+def _pad(n: int) -> int:
+    return -n % _ALIGN
+
+
+def write_artifact(path: str | Path, compiled: CompiledModel, percentiles: PercentileTable,
+                   baseline_df: pd.DataFrame, sources: dict[str, str]) -> Path:
+    """把已編譯的三張表寫成 artifact；先寫暫存檔再 rename，讀取端不會看到寫到一半的檔案。"""
+    path = Path(path)
+    baseline_diseases = list(dict.fromkeys(baseline_df["Disease"]))
+    # 百分位的排名索引：17 欄的原檔為 knots/counts，高解析度表為 bins（見 PercentileTable）
+    index = ({"percentile_bins": percentiles.bins} if percentiles.dense else
+             {"percentile_knots": percentiles.knots, "percentile_counts": percentiles.counts})
+    arrays = {
+        "coef": compiled.coef,
+        "percentile_values": percentiles.values,
+        "percentile_present": percentiles.present,
+        "percentile_grid": percentiles.grid,
+        **index,
+        "baseline_disease": pd.Index(baseline_diseases).get_indexer(baseline_df["Disease"]).astype(np.int32),
+        "baseline_t_years": baseline_df["t_years"].to_numpy(dtype=np.float64),
+        "baseline_H0": baseline_df["H0"].to_numpy(dtype=np.float64),
+    }
+    arrays = {name: np.ascontiguousarray(a) for name, a in arrays.items()}
+
+    specs = {}
+    offset = 0
+    for name, a in arrays.items():
+        specs[name] = {
+            "dtype": a.dtype.str,
+            "shape": list(a.shape),
+            "offset": offset,
+            "nbytes": a.nbytes,
+            "sha256": hashlib.sha256(a.tobytes()).hexdigest(),
+        }
+        offset += a.nbytes + _pad(a.nbytes)
+
+    header = json.dumps({
+        "format_version": FORMAT_VERSION,
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "sources": sources,
+        "diseases": list(compiled.diseases),
+        "columns": list(compiled.columns),
+        "percentile_diseases": list(percentiles.diseases),
+        "baseline_diseases": baseline_diseases,
+        "arrays": specs,
+    }, ensure_ascii=False).encode("utf-8")
+    # 陣列區從對齊的位置開始；header 之後補空白
+    data_start = _PREFIX.size + len(header)
+    header += b" " * _pad(data_start)
+
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        f.write(_PREFIX.pack(MAGIC, FORMAT_VERSION, len(header)))
+        f.write(header)
+        for name, a in arrays.items():
+            f.write(a.tobytes())
+            f.write(b"\0" * _pad(a.nbytes))
+    os.replace(tmp, path)
+    return path
+
+
+def read_artifact(path: str | Path, verify: bool = True) -> tuple[dict, dict[str, np.ndarray]]:
+    """
+    以 mmap 開啟 artifact，回傳 (header, {名稱: 唯讀陣列})。
+    verify=True 時逐一比對陣列的 SHA-256。格式不符或損毀時 ArtifactError。
+    """
+    path = Path(path)
+    with open(path, "rb") as f:
+        try:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError as e:  # 空檔案
+            raise ArtifactError(f"artifact 是空檔案：{path}") from e
+    if len(buf) < _PREFIX.size:
+        raise ArtifactError(f"artifact 檔頭不完整：{path}")
+    magic, version, header_len = _PREFIX.unpack_from(buf, 0)
+    if magic != MAGIC:
+        raise ArtifactError(f"不是 hrrisk artifact：{path}")
+    if version != FORMAT_VERSION:
+        raise ArtifactError(f"artifact 格式版本 {version} 不受支援（需要 {FORMAT_VERSION}）")
+    try:
+        header = json.loads(bytes(buf[_PREFIX.size:_PREFIX.size + header_len]).decode("utf-8"))
+    except ValueError as e:
+        raise ArtifactError(f"artifact header 損毀：{path}") from e
+
+    data_start = _PREFIX.size + header_len
+    arrays = {}
+    for name, spec in header["arrays"].items():
+        start = data_start + spec["offset"]
+        if start + spec["nbytes"] > len(buf):
+            raise ArtifactError(f"artifact 長度不足（{name}）：{path}")
+        a = np.frombuffer(buf, dtype=np.dtype(spec["dtype"]), count=int(np.prod(spec["shape"], dtype=np.int64)),
+                          offset=start).reshape(spec["shape"])
+        if verify and hashlib.sha256(a.tobytes()).hexdigest() != spec["sha256"]:
+            raise ArtifactError(f"artifact checksum 不符（{name}）：{path}")
+        arrays[name] = a
+    return header, arrays
+
+
+def load_artifact(manifest: dict, path: str | Path | None = None, verify: bool = True
+                  ) -> tuple[CompiledModel, PercentileTable, pd.DataFrame]:
+    """
+    讀取 manifest 對應的 artifact，回傳 (CompiledModel, PercentileTable, baseline_df)。
+    artifact 不存在、損毀，或來源 CSV 與編譯時不同（過期）時 ArtifactError。
+    """
+    path = Path(path) if path else artifact_path(manifest)
+    if not path.exists():
+        raise ArtifactError(f"artifact 不存在：{path}")
+    header, arrays = read_artifact(path, verify=verify)
+    if header.get("sources") != source_digests(manifest):
+        raise ArtifactError(f"artifact 已過期（來源 CSV 有變動），請重新執行 compile-model：{path}")
+
+    compiled = CompiledModel(header["diseases"], header["columns"], arrays["coef"])
+    percentiles = PercentileTable(header["percentile_diseases"], arrays["percentile_values"],
+                                  arrays["percentile_present"], arrays.get("percentile_knots"),
+                                  arrays.get("percentile_counts"), arrays["percentile_grid"],
+                                  arrays.get("percentile_bins"))
+    baseline_df = pd.DataFrame({
+        "Disease": np.asarray(header["baseline_diseases"], dtype=object)[arrays["baseline_disease"]],
+        "t_years": arrays["baseline_t_years"],
+        "H0": arrays["baseline_H0"],
+    })
+    return compiled, percentiles, baseline_df
+
+
+def compile_model(manifest_path: str | Path | None = None, output: str | Path | None = None) -> Path:
+    """讀 manifest 指到的 CSV、編譯後寫成 artifact；回傳輸出路徑。"""
+    m = load_manifest(manifest_path)
+    sources = source_digests(m)
+    return write_artifact(
+        Path(output) if output else artifact_path(m),
+        compile_coefficients(load_model_coefficients(manifest=m)),
+        compile_percentiles(load_percentile_data(manifest=m)),
+        load_baseline_hazard(manifest=m),
+        sources,
+    )
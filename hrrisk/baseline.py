@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Baseline hazard 編譯：把長表（Disease × t_years → H0）轉成依疾病分段、依時間排序的階梯函數，
+任意疾病 × 任意年數的 H0(t) 以一次 np.searchsorted 查出。
+
+baseline 檔可以每個疾病只有一列（例如只有 t=3），也可以是完整的 cumulative hazard 階梯函數
+（每個疾病多個 t_years）。H0(t) 取 t_years <= t 的最後一階，與 lookup_H0 相同。
+"""
+
+from __future__ import annotations
+
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+
+
+class BaselineHazard:
+    """
+    已編譯的 cumulative baseline hazard。
+    - diseases：疾病名稱（分段順序）
+    - times、values：依 (疾病, t_years) 排序後串接的時間點與 H0；
+      第 i 個疾病為 offsets[i]:offsets[i + 1]
+    各段時間點嚴格遞增、H0 非遞減。查詢時把 (疾病, t) 換成單一遞增的鍵
+    「疾病位置 × span + (t - t_min)」，所有疾病共用同一次 searchsorted，不需逐疾病迴圈。
+    """
+
+    def __init__(self, diseases: Iterable[str], times: np.ndarray, values: np.ndarray, offsets: np.ndarray):
+        self.diseases = tuple(diseases)
+        self.times = np.ascontiguousarray(times, dtype=np.float64)
+        self.values = np.ascontiguousarray(values, dtype=np.float64)
+        self.offsets = np.asarray(offsets, dtype=np.intp)
+        if len(self.offsets) != len(self.diseases) + 1 or self.times.shape != self.values.shape:
+            raise ValueError("baseline 階梯函數的分段與資料長度不符")
+        self.disease_index = {d: i for i, d in enumerate(self.diseases)}
+
+        self._t_min = float(self.times.min()) if len(self.times) else 0.0
+        t_max = float(self.times.max()) if len(self.times) else 0.0
+        # 每段佔 span 寬的區間，查詢的 t 夾在 [-0.5, span - 1] 內，不會落到別的疾病
+        self._span = t_max - self._t_min + 2.0
+        segment = np.repeat(np.arange(len(self.diseases)), np.diff(self.offsets))
+        self._keys = segment * self._span + (self.times - self._t_min)
+
+    def __len__(self) -> int:
+        return len(self.diseases)
+
+    def rows(self, diseases: Iterable[str]) -> np.ndarray:
+        """疾病名稱 → 分段位置；不在 baseline 檔中的疾病為 -1。"""
+        return np.array([self.disease_index.get(d, -1) for d in diseases], dtype=np.intp)
+
+    def at(self, rows, t) -> np.ndarray:
+        """
+        H0(t)：rows（分段位置）與 t（年）可互相廣播，回傳同形狀的 float64。
+        疾病不存在（row = -1）、t 早於該疾病第一個時間點或 t 為 NaN 時為 NaN。
+        """
+        rows, t = np.broadcast_arrays(np.asarray(rows, dtype=np.intp), np.asarray(t, dtype=np.float64))
+        ok = (rows >= 0) & ~np.isnan(t)
+        r = np.where(ok, rows, 0)
+        local = np.clip(np.nan_to_num(t - self._t_min, nan=-1.0), -0.5, self._span - 1.0)
+        i = np.searchsorted(self._keys, r * self._span + local, side="right") - 1
+        ok &= i >= self.offsets[r]
+        return np.where(ok, self.values[np.maximum(i, 0)], np.nan)
+
+    def curve(self, rows, horizons) -> np.ndarray:
+        """各疾病在多個年數的 H0：shape (len(rows), len(horizons))。"""
+        rows = np.asarray(rows, dtype=np.intp)
+        return self.at(rows[:, None], np.asarray(horizons, dtype=np.float64)[None, :])
+
+
+def compile_baseline(baseline_df: pd.DataFrame) -> BaselineHazard:
+    """
+    把 load_baseline_hazard() 的長表編譯成 BaselineHazard。
+    同一疾病的 t_years 重複、t_years 為負，或 H0 隨時間遞減（不是累積危險度）時 ValueError。
+    """
+    df = baseline_df[["Disease", "t_years", "H0"]]
+    diseases = list(dict.fromkeys(df["Disease"]))
+    d_idx = pd.Index(diseases).get_indexer(df["Disease"])
+    t = df["t_years"].to_numpy(dtype=np.float64)
+    h = df["H0"].to_numpy(dtype=np.float64)
+    if (t < 0).any():
+        raise ValueError("baseline 檔中的 t_years 不可為負。")
+
+    order = np.lexsort((t, d_idx))
+    d_idx, t, h = d_idx[order], t[order], h[order]
+    same = d_idx[1:] == d_idx[:-1]
+    if (same & (t[1:] == t[:-1])).any():
+        bad = sorted({diseases[d] for d in d_idx[1:][same & (t[1:] == t[:-1])]})
+        raise ValueError(f"baseline 檔中以下疾病的 t_years 重複：{bad}")
+    if (same & (h[1:] < h[:-1])).any():
+        bad = sorted({diseases[d] for d in d_idx[1:][same & (h[1:] < h[:-1])]})
+        raise ValueError(f"baseline 檔中以下疾病的 H0 隨時間遞減（應為累積危險度）：{bad}")
+
+    offsets = np.searchsorted(d_idx, np.arange(len(diseases) + 1))
+    return BaselineHazard(diseases, t, h, offsets)
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+單人評分結果的 LRU 快取：同一組輸入（含模型版本）只算一次，跨 rerun 與 session 共用。
+
+    cache = ProfileCache(maxsize=4096)
+    profile = {"age": 52, "gender": "Female", "current_hr": 78, "bmi": 26.3,
+               "smoking_status": "曾經吸菸", "drinking_status": "目前飲酒"}
+    results = cache.score(model, version, profile)
+    curves = cache.curves(model, version, profile)
+
+模型只看各共變數的代碼，因此 key 用模型 schema 的代碼（schema.by_name[name].code）而不是原始數值：
+(schema.inputs 各自的代碼, 模型版本)。分組依 manifest 的切點，預設切點下心率 72 與 75 共用同一筆結果；
+manifest 增減共變數時 key 跟著 schema 走。schema 沒有 age 時另外併入年齡（百分位組別要用）。
+快取的是全部疾病的結果；依分類篩選在取出之後才做，切換分類不會重算。
+累積風險曲線（risk_curves，全部疾病 × 年數）另外快取，key 再加上年數；切換疾病或顯示的年數範圍都不會重算。
+"""
+
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable, Mapping
+
+import pandas as pd
+
+from .schema import CovariateSchema
+from .scoring import CURVE_HORIZONS, ScoringModel, risk_curves, score_profile
+
+DEFAULT_MAXSIZE = 4096
+
+
+def profile_key(schema: CovariateSchema, profile: Mapping, version: Hashable) -> tuple:
+    """正規化後的快取 key：schema.inputs 各自的代碼（同 score_profile 實際使用的值）。缺輸入時 ValueError。"""
+    missing = [name for name in schema.inputs if name not in profile]
+    if missing:
+        raise ValueError(f"缺少輸入：{missing}")
+    codes = tuple(schema.by_name[name].code(profile[name]) for name in schema.inputs)
+    if "age" not in schema.by_name:
+        if "age" not in profile:
+            raise ValueError("缺少輸入：['age']")
+        codes += (float(profile["age"]),)
+    return (codes, version)
+
+
+class ProfileCache:
+    """
+    有上限的 LRU 快取（執行緒安全）。stats() 回傳 hits / misses / size / maxsize / hit_ratio。
+    取出的是結果的拷貝，呼叫端修改 dict / DataFrame 不會影響快取內容。
+    """
+
+    def __init__(self, maxsize: int = DEFAULT_MAXSIZE):
+        if maxsize < 1:
+            raise ValueError("maxsize 必須至少為 1")
+        self.maxsize = maxsize
+        self._data: OrderedDict[tuple, object] = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def score(self, model: ScoringModel, version: Hashable, profile: Mapping) -> list[dict]:
+        """同 score_profile，但先查快取。version 應隨模型內容改變（例如 ModelVersion.digest）。"""
+        key = profile_key(model.schema, profile, version)
+        results = self._get_or_compute(key, lambda: tuple(score_profile(model, profile)))
+        return [dict(r) for r in results]
+
+    def curves(self, model: ScoringModel, version: Hashable, profile: Mapping,
+               horizons=CURVE_HORIZONS) -> pd.DataFrame:
+        """同 risk_curves（年數 × 疾病的累積風險），但先查快取。"""
+        horizons = tuple(float(t) for t in horizons)
+        key = ("curves", horizons) + profile_key(model.schema, profile, version)
+        curves = self._get_or_compute(key, lambda: risk_curves(model, profile, horizons))
+        return curves.copy()
+
+    def _get_or_compute(self, key: tuple, compute: Callable[[], object]):
+        with self._lock:
+            cached = self._data.get(key)
+            if cached is not None:
+                self._data.move_to_end(key)
+                self._hits += 1
+                return cached
+            self._misses += 1
+
+        # 在鎖外計算；同一 key 同時未命中時各算一次，結果相同
+        value = compute()
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict[str, float]:
+        with self._lock:
+            hits, misses, size = self._hits, self._misses, len(self._data)
+        total = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "size": size,
+            "maxsize": self.maxsize,
+            "hit_ratio": hits / total if total else 0.0,
+        }
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+輸入分組：BMI 計算、心率/BMI 模型分組、百分位年齡組。
+
+所有分組都由下方 BANDS 的切點定義（左閉右開）：
+- Bands.codes(陣列)：np.digitize 一次分組，回傳整數代碼（labels 的位置），可直接當索引用
+- Bands.code(值) / Bands.label(值)：單一數值，bisect 查同一組切點
+get_heart_rate_category 等純量函式只是 Bands.label 的包裝，畫面與批次評分的分組不會不一致。
+NaN 落在最後一組（同原本 if/elif 的 else）。
+"""
+
+from __future__ import annotations
+
+from bisect import bisect_right
+from typing import Sequence
+
+import numpy as np
+
+
+class Bands:
+    """一組切點與各組名稱：len(labels) == len(cuts) + 1。"""
+
+    def __init__(self, name: str, cuts: Sequence[float], labels: Sequence[str]):
+        if len(labels) != len(cuts) + 1:
+            raise ValueError(f"{name}：{len(cuts)} 個切點需要 {len(cuts) + 1} 個組別名稱")
+        if list(cuts) != sorted(cuts):
+            raise ValueError(f"{name}：切點須為遞增")
+        self.name = name
+        self.cuts = tuple(cuts)
+        self.labels = tuple(labels)
+        self._cuts = np.asarray(self.cuts, dtype=np.float64)
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    def codes(self, values) -> np.ndarray:
+        """陣列 → 組別代碼（intp，0..len(cuts)）。"""
+        return np.digitize(np.asarray(values, dtype=np.float64), self._cuts, right=False)
+
+    def code(self, value) -> int:
+        """單一數值 → 組別代碼；與 codes() 結果相同。"""
+        return bisect_right(self.cuts, value)
+
+    def label(self, value) -> str:
+        return self.labels[bisect_right(self.cuts, value)]
+
+    def __repr__(self) -> str:
+        return f"Bands({self.name!r}, cuts={list(self.cuts)})"
+
+
+# ---- 唯一的切點定義 ----
+HR_BANDS = Bands("current_hr", (60, 70, 80, 90),
+                 ('HR_cat<60', 'HR_cat60-69', 'HR_cat70-79', 'HR_cat80-89', 'HR_cat>=90'))
+# 模型分組與畫面顯示共用同一組 BMI 切點
+BMI_BANDS = Bands("bmi", (18.5, 24, 27), ('bmi_underweight', 'bmi_normal', 'bmi_overweight', 'bmi_obese'))
+BMI_DISPLAY_LABELS = ("體重過輕", "正常體重", "體重過重", "肥胖")
+BMI_DISPLAY_COLORS = ("#3498db", "#27ae60", "#f39c12", "#e74c3c")
+AGE_GROUP_BANDS = Bands("age", (40, 45, 50, 55, 60), ('<40', '40-44', '45-49', '50-54', '55-59', '>=60'))
+
+BANDS = {b.name: b for b in (HR_BANDS, BMI_BANDS, AGE_GROUP_BANDS)}
+
+
+def calculate_bmi(height, weight, height_unit, weight_unit):
+    """Calculate BMI from height and weight with unit conversion"""
+    try:
+        if height_unit == "公分":
+            height_m = height / 100
+        elif height_unit == "英尺/英寸":
+            height_m = height * 0.0254
+        else:
+            height_m = height
+        
+        if weight_unit == "磅":
+            weight_kg = weight * 0.453592
+        else:
+            weight_kg = weight
+        
+        bmi = weight_kg / (height_m ** 2)
+        return round(bmi, 1)
+    
+    except (ZeroDivisionError, ValueError):
+        return None
+
+
+def get_bmi_category(bmi):
+    """Categorize BMI according to the model's categories"""
+    code = BMI_BANDS.code(bmi)
+    return BMI_DISPLAY_LABELS[code], BMI_DISPLAY_COLORS[code]
+
+
+def get_bmi_model_category(bmi):
+    """Get BMI category for model calculation"""
+    return BMI_BANDS.label(bmi)
+
+
+def get_heart_rate_category(hr):
+    """Categorize heart rate according to the model categories"""
+    return HR_BANDS.label(hr)
+
+
+def get_age_group_for_percentile(age):
+    """Convert age to age group for percentile lookup matching the data file"""
+    return AGE_GROUP_BANDS.label(age)
@@ -0,0 +1,344 @@
+# -*- coding: utf-8 -*-
+"""
+命令列批次評分：
+
+    python -m hrrisk score in.csv out.parquet --chunksize 200000
+    python -m hrrisk build-lookup lookup.npz
+    python -m hrrisk compile-model
+    python -m hrrisk score in.csv out.parquet --lookup lookup.npz
+    python -m hrrisk serve --port 8000
+    python -m hrrisk build-percentiles cohort.parquet model/percentiles/percentiles_251017.csv
+
+輸入逐塊讀取、逐塊評分、逐塊寫出，記憶體用量只與 chunksize 有關，與檔案大小無關。
+支援 CSV（輸出可為 .gz / .bz2 / .xz 壓縮）與 Parquet；Parquet 需要安裝 pyarrow。
+--workers N 時評分與編碼（CSV 文字、Parquet 的 Arrow 轉換）都在 worker 內完成，
+父行程只依序寫出編碼好的結果；Parquet 的壓縮與寫檔仍在父行程逐塊進行。
+"""
+
+from __future__ import annotations
+
+import argparse
+import bz2
+import gzip
+import lzma
+import sys
+from pathlib import Path
+from typing import Iterator
+
+import pandas as pd
+
+from .artifact import compile_model
+from .loaders import find_manifest, load_manifest
+from .lookup import build_lookup_table, load_lookup_table
+from .parallel import default_workers, score_chunks_parallel
+from .quantiles import build_percentiles, point_manifest, write_percentiles
+from .scoring import INPUT_COLUMNS, ScoringModel, load_scoring_model, score_batch
+
+
+DEFAULT_CHUNKSIZE = 100_000
+
+_PARQUET_SUFFIXES = {".parquet", ".pq"}
+_CSV_OPENERS = {".gz": gzip.open, ".bz2": bz2.open, ".xz": lzma.open}
+
+
+def _format_of(path: Path, fmt: str | None) -> str:
+    if fmt:
+        return fmt
+    suffixes = [s.lower() for s in path.suffixes]
+    return "parquet" if any(s in _PARQUET_SUFFIXES for s in suffixes) else "csv"
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:  # pragma: no cover - 依環境而定
+        raise SystemExit("讀寫 Parquet 需要 pyarrow：pip install pyarrow") from e
+    return pa, pq
+
+
+def iter_chunks(path: str | Path, chunksize: int = DEFAULT_CHUNKSIZE,
+                fmt: str | None = None, sep: str = ",", dtype: dict | None = None) -> Iterator[pd.DataFrame]:
+    """逐塊讀取輸入檔；每塊最多 chunksize 列。dtype 只用於 CSV（同 pandas.read_csv）。"""
+    path = Path(path)
+    if _format_of(path, fmt) == "parquet":
+        _, pq = _require_pyarrow()
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, sep=sep, chunksize=chunksize, dtype=dtype)
+
+
+def parquet_output_schema(model: ScoringModel, path: str | Path, fmt: str | None = None, sep: str = ",",
+                          keep: list[str] | None = None, horizon: float | None = None) -> tuple["pa.Schema", dict | None]:
+    """
+    Parquet 輸出的固定 schema，不由第一塊的內容推斷（整塊缺值或整數欄位後來出現缺值時型別會不同）。
+    評分欄位的型別由模型決定；保留的輸入欄位在 Parquet 輸入時沿用輸入檔的型別，CSV 輸入時模型的數值
+    共變數為 float64，其他欄位一律以原始文字讀入並寫成 string。
+    回傳 (schema, 讀 CSV 時給 iter_chunks 的 dtype)。
+    """
+    pa, pq = _require_pyarrow()
+    path = Path(path)
+    dtype = None
+    if _format_of(path, fmt) == "parquet":
+        source = pq.ParquetFile(path).schema_arrow
+        columns = source.names
+    else:
+        columns = list(pd.read_csv(path, sep=sep, nrows=0).columns)
+        numeric = {c.name for c in model.schema.covariates if c.type != "categorical"}
+        dtype = {c: str for c in columns if c not in numeric}
+        source = pa.schema([(c, pa.float64() if c in numeric else pa.string()) for c in columns])
+    names = columns if keep is None else keep
+    missing = [c for c in names if c not in columns]
+    if missing:
+        raise SystemExit(f"{path}：沒有欄位 {', '.join(missing)}")
+
+    passthrough = pa.schema([source.field(c) for c in names])
+    results = score_chunk(pd.DataFrame(columns=list(model.schema.inputs)), model, [], horizon)
+    fields = list(passthrough) + list(pa.Schema.from_pandas(results, preserve_index=False))
+    # pandas metadata 讓 read_parquet 還原 Int64、string 等型別
+    probe = pd.concat([passthrough.empty_table().to_pandas(), results], axis=1)
+    metadata = pa.Schema.from_pandas(probe, preserve_index=False).metadata
+    return pa.schema(fields, metadata=metadata), dtype
+
+
+def encode_chunk(df: pd.DataFrame, fmt: str, sep: str = ",", schema=None) -> tuple[list[str], int, object]:
+    """
+    把一塊結果編碼成寫檔用的形式：(欄名, 列數, 內容)。CSV 的內容為不含表頭的 UTF-8 bytes，
+    Parquet 為 pyarrow Table（給了 schema 時轉成該 schema）。多行程評分時在 worker 內呼叫，
+    父行程不必再做 to_csv 或型別轉換。
+    """
+    if fmt == "parquet":
+        pa, _ = _require_pyarrow()
+        payload = pa.Table.from_pandas(df, preserve_index=False)
+        if schema is not None:
+            payload = _cast_table(payload, schema)
+    else:
+        payload = df.to_csv(sep=sep, index=False, header=False).encode("utf-8")
+    return list(df.columns), len(df), payload
+
+
+def _cast_table(table, schema):
+    try:
+        return table.select(schema.names).cast(schema)
+    except (KeyError, ValueError, TypeError) as e:  # pyarrow 的 ArrowInvalid 等皆為 ValueError 子類別
+        raise SystemExit(f"無法轉成輸出的 Parquet schema：{e}") from e
+
+
+class ChunkWriter:
+    """逐塊附加寫出 CSV 或 Parquet；Parquet 未指定 schema 時由第一塊決定欄位與型別。"""
+
+    def __init__(self, path: str | Path, fmt: str | None = None, sep: str = ",", schema=None):
+        self.path = Path(path)
+        self.fmt = _format_of(self.path, fmt)
+        self.sep = sep
+        self.rows = 0
+        self._writer = None
+        self._schema = schema
+        self._file = None
+
+    def write(self, df: pd.DataFrame) -> None:
+        self.write_encoded(*encode_chunk(df, self.fmt, self.sep, self._schema))
+
+    def write_encoded(self, columns: list[str], rows: int, payload) -> None:
+        """寫出 encode_chunk 的結果。"""
+        if self.fmt == "parquet":
+            _, pq = _require_pyarrow()
+            if self._schema is None:
+                self._schema = payload.schema
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(self.path, self._schema)
+            if not payload.schema.equals(self._schema):
+                payload = _cast_table(payload, self._schema)
+            self._writer.write_table(payload)
+        else:
+            if self._file is None:
+                self._file = self._open_csv()
+                header = pd.DataFrame(columns=columns).to_csv(sep=self.sep, index=False)
+                self._file.write(header.encode("utf-8"))
+            self._file.write(payload)
+        self.rows += rows
+
+    def _open_csv(self):
+        suffix = self.path.suffix.lower()
+        if suffix in _CSV_OPENERS:
+            return _CSV_OPENERS[suffix](self.path, "wb")
+        if suffix in (".zip", ".zst", ".tar"):
+            raise SystemExit(f"CSV 輸出只支援 {'/'.join(_CSV_OPENERS)} 壓縮：{self.path}")
+        return open(self.path, "wb")
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self) -> "ChunkWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def score_chunk(chunk: pd.DataFrame, model: ScoringModel, keep: list[str] | None = None,
+                horizon: float | None = None) -> pd.DataFrame:
+    """評分一塊輸入，並把 keep 指定的輸入欄位（預設全部）接在結果前面。"""
+    results = score_batch(chunk, model, horizon)
+    # 風險等級固定為字串型別，避免整塊皆缺值時 Parquet 推斷成 null 型別
+    for col in results.columns:
+        if col.endswith("|risk_category"):
+            results[col] = results[col].astype("string")
+    passthrough = chunk if keep is None else chunk[keep]
+    return pd.concat([passthrough.reset_index(drop=True), results.reset_index(drop=True)], axis=1)
+
+
+def score_and_encode(chunk: pd.DataFrame, model: ScoringModel, keep: list[str] | None, horizon: float | None,
+                     fmt: str, sep: str, schema=None) -> tuple[list[str], int, object]:
+    """score_chunk 後直接 encode_chunk（在 worker 內執行，回傳給父行程的是編碼好的內容）。"""
+    return encode_chunk(score_chunk(chunk, model, keep, horizon), fmt, sep, schema)
+
+
+def run_score(args: argparse.Namespace) -> int:
+    model = load_scoring_model(args.manifest)
+    if args.lookup:
+        try:
+            model.use_lookup(load_lookup_table(args.lookup, model))
+        except ValueError as e:
+            raise SystemExit(f"{args.lookup}：{e}") from e
+    keep = [c.strip() for c in args.keep.split(",") if c.strip()] if args.keep is not None else None
+
+    schema = dtype = None
+    if _format_of(Path(args.output), args.output_format) == "parquet":
+        schema, dtype = parquet_output_schema(model, args.input, args.input_format, args.sep, keep, args.horizon)
+    chunks = iter_chunks(args.input, args.chunksize, args.input_format, args.sep, dtype)
+    writer = ChunkWriter(args.output, args.output_format, args.sep, schema)
+    encode_args = (keep, args.horizon, writer.fmt, args.sep, schema)
+    if args.workers > 1:
+        # 各塊平行評分並編碼，父行程依輸入順序寫出
+        encoded = score_chunks_parallel(chunks, model, args.workers, score_and_encode, encode_args)
+    else:
+        encoded = (score_and_encode(chunk, model, *encode_args) for chunk in chunks)
+
+    with writer:
+        for columns, rows, payload in encoded:
+            writer.write_encoded(columns, rows, payload)
+            if args.verbose:
+                print(f"已評分 {writer.rows:,} 筆", file=sys.stderr)
+
+    print(f"完成：{writer.rows:,} 筆 → {args.output}", file=sys.stderr)
+    return 0
+
+
+def run_build_lookup(args: argparse.Namespace) -> int:
+    model = load_scoring_model(args.manifest)
+    try:
+        table = build_lookup_table(model)
+    except ValueError as e:
+        raise SystemExit(str(e)) from e
+    table.save(args.output)
+    print(f"完成：{table.lp.shape[0]:,} 種組合 × {len(table.diseases)} 個疾病"
+          f"（{table.nbytes / 1e6:.1f} MB）→ {args.output}", file=sys.stderr)
+    return 0
+
+
+def run_build_percentiles(args: argparse.Namespace) -> int:
+    manifest_file = find_manifest(args.manifest)
+    manifest = load_manifest(manifest_file)
+    if args.knots is not None and args.knots < 1:
+        raise SystemExit("--knots 需至少為 1")
+    chunks = iter_chunks(args.input, args.chunksize, args.input_format, args.sep)
+    table = build_percentiles(chunks, manifest, args.workers, args.knots)
+    decimals = args.decimals if args.decimals is not None else (3 if args.knots is None else 6)
+    path = write_percentiles(table, args.output, decimals)
+    print(f"完成：{table['Disease'].nunique()} 個疾病、{len(table):,} 格 → {path}", file=sys.stderr)
+    if not args.no_manifest:
+        rel = point_manifest(manifest_file, path)
+        print(f"已更新 {manifest_file}：pct_path = {rel}", file=sys.stderr)
+    return 0
+
+
+def run_compile_model(args: argparse.Namespace) -> int:
+    path = compile_model(args.manifest, args.output)
+    print(f"完成：{path}（{path.stat().st_size / 1e3:.1f} kB）", file=sys.stderr)
+    return 0
+
+
+def run_serve(args: argparse.Namespace) -> int:
+    try:
+        import uvicorn
+        from .api import create_app
+    except ImportError as e:  # pragma: no cover - 依環境而定
+        raise SystemExit("評分 API 需要 starlette 與 uvicorn：pip install starlette uvicorn") from e
+    uvicorn.run(create_app(manifest_path=args.manifest), host=args.host, port=args.port,
+                log_level=args.log_level, access_log=False)
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m hrrisk", description="心率風險模型命令列工具")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("score", help="逐塊批次評分 CSV/Parquet 檔")
+    p.add_argument("input", help=f"輸入檔，需含欄位：{', '.join(INPUT_COLUMNS)}")
+    p.add_argument("output", help="輸出檔（.csv 或 .parquet）")
+    p.add_argument("--manifest", default=None, help="manifest.json 路徑（預設自動尋找）")
+    p.add_argument("--chunksize", type=int, default=DEFAULT_CHUNKSIZE, help="每塊列數（決定記憶體用量）")
+    p.add_argument("--keep", default=None,
+                   help="要保留到輸出的輸入欄位，以逗號分隔；預設保留全部，給空字串則不保留")
+    p.add_argument("--input-format", choices=["csv", "parquet"], default=None, help="預設依副檔名判斷")
+    p.add_argument("--output-format", choices=["csv", "parquet"], default=None, help="預設依副檔名判斷")
+    p.add_argument("--sep", default=",", help="CSV 分隔符")
+    p.add_argument("--workers", type=int, default=1,
+                   help=f"評分行程數（0 = 全部核心，本機為 {default_workers()}）")
+    p.add_argument("--lookup", default=None, help="build-lookup 產生的查表；表內的組合直接查表")
+    p.add_argument("--horizon", type=float, default=None,
+                   help="絕對風險的年數（預設為 manifest 的 baseline_horizon_years）")
+    p.add_argument("-v", "--verbose", action="store_true", help="每塊完成時顯示進度")
+    p.set_defaults(func=run_score)
+
+    p = sub.add_parser("build-lookup", help="預先計算所有輸入組合的評分查表（.npz）")
+    p.add_argument("output", help="輸出檔（.npz）")
+    p.add_argument("--manifest", default=None, help="manifest.json 路徑（預設自動尋找）")
+    p.set_defaults(func=run_build_lookup)
+
+    p = sub.add_parser("build-percentiles", help="由世代資料以目前係數重建百分位表，並更新 manifest 的 pct_path")
+    p.add_argument("input", help=f"世代資料（CSV/Parquet），需含欄位：{', '.join(INPUT_COLUMNS)}")
+    p.add_argument("output", help="輸出的百分位檔（Tab 分隔，同 percentiles_YYMMDD.csv）")
+    p.add_argument("--manifest", default=None, help="manifest.json 路徑（預設自動尋找）")
+    p.add_argument("--chunksize", type=int, default=DEFAULT_CHUNKSIZE, help="每塊列數（決定記憶體用量）")
+    p.add_argument("--input-format", choices=["csv", "parquet"], default=None, help="預設依副檔名判斷")
+    p.add_argument("--sep", default=",", help="CSV 分隔符")
+    p.add_argument("--workers", type=int, default=1,
+                   help=f"行程數（0 = 全部核心，本機為 {default_workers()}）")
+    p.add_argument("--knots", type=int, default=None,
+                   help="改輸出 0%%…100%% 等距 knots + 1 欄的高解析度表（例如 1000）；預設為原檔的 17 欄")
+    p.add_argument("--decimals", type=int, default=None, help="分位數的小數位數（預設 3，--knots 時 6）")
+    p.add_argument("--no-manifest", action="store_true", help="只寫檔，不更新 manifest.json")
+    p.set_defaults(func=run_build_percentiles)
+
+    p = sub.add_parser("compile-model", help="把 manifest 的 CSV 編譯成啟動時直接 mmap 的模型檔")
+    p.add_argument("--manifest", default=None, help="manifest.json 路徑（預設自動尋找）")
+    p.add_argument("-o", "--output", default=None,
+                   help="輸出檔（預設為 manifest 的 artifact_path，或 manifest 旁的 compiled_model.bin）")
+    p.set_defaults(func=run_compile_model)
+
+    p = sub.add_parser("serve", help="啟動評分 HTTP API（POST /score、/score/batch）")
+    p.add_argument("--manifest", default=None, help="manifest.json 路徑（預設自動尋找）")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8000)
+    p.add_argument("--log-level", default="warning")
+    p.set_defaults(func=run_serve)
+    return parser
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = build_parser().parse_args(argv)
+    if getattr(args, "chunksize", 1) <= 0:
+        raise SystemExit("--chunksize 必須為正整數")
+    if getattr(args, "workers", 1) == 0:
+        args.workers = default_workers()
+    if getattr(args, "workers", 1) < 0:
+        raise SystemExit("--workers 不可為負數")
+    return args.func(args)
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+係數矩陣引擎：把 Cox 係數表編譯成「疾病 × 設計欄位」的 float 矩陣，
+一次矩陣乘法即可算出所有疾病的線性預測值（LP）。
+
+本模組不依賴 Streamlit，可由 app、批次評分或測試直接匯入。
+"""
+
+from __future__ import annotations
+
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+
+
+# 連續型變數（其餘變數皆視為 0/1 指示變數）
+CONTINUOUS_VARIABLES = ("AGE",)
+
+# UI 選項 → 係數表中的變數名稱
+SMOKING_VARIABLES = {
+    "從未吸菸": "Never_smoke",
+    "曾經吸菸": "Ever_smoke",
+    "目前吸菸": "Now_smoke",
+}
+DRINKING_VARIABLES = {
+    "從未飲酒": "Never_drink",
+    "曾經飲酒": "Ever_drink",
+    "目前飲酒": "Now_drink",
+}
+GENDER_VARIABLES = {
+    "Male": "MALE",
+    "Female": "FEMALE",
+}
+
+
+class CompiledModel:
+    """
+    已編譯的係數模型。
+    - diseases：疾病名稱（矩陣列順序）
+    - columns：設計欄位名稱（矩陣欄順序）
+    - coef：shape (n_diseases, n_columns) 的 float 矩陣，'REF' 一律為 0
+    """
+
+    def __init__(self, diseases: Iterable[str], columns: Iterable[str], coef: np.ndarray):
+        self.diseases = tuple(diseases)
+        self.columns = tuple(columns)
+        self.coef = np.ascontiguousarray(coef, dtype=np.float64)
+        if self.coef.shape != (len(self.diseases), len(self.columns)):
+            raise ValueError(
+                f"係數矩陣形狀 {self.coef.shape} 與疾病數/欄位數 "
+                f"({len(self.diseases)}, {len(self.columns)}) 不符"
+            )
+        self.disease_index = {d: i for i, d in enumerate(self.diseases)}
+        self.column_index = {c: j for j, c in enumerate(self.columns)}
+
+    def design_vector(self, age: float, indicators: Iterable[str]) -> np.ndarray:
+        """
+        組出單人的設計向量：連續變數填入數值，指示變數填 1。
+        係數表中不存在的變數名稱直接略過（等同係數為 0）。
+        """
+        x = np.zeros(len(self.columns), dtype=np.float64)
+        j = self.column_index.get("AGE")
+        if j is not None:
+            x[j] = float(age)
+        for name in indicators:
+            j = self.column_index.get(name)
+            if j is not None:
+                x[j] = 1.0
+        return x
+
+    def linear_predictors(self, x: np.ndarray) -> np.ndarray:
+        """所有疾病的 LP：coef @ x，回傳 shape (n_diseases,)（或 (n_diseases, N) 若 x 為矩陣）。"""
+        return self.coef @ x
+
+    def linear_predictor(self, disease: str, x: np.ndarray) -> float | None:
+        """單一疾病的 LP；疾病不在係數表中時回傳 None。"""
+        i = self.disease_index.get(disease)
+        if i is None:
+            return None
+        return float(self.coef[i] @ x)
+
+
+def compile_coefficients(model_df: pd.DataFrame) -> CompiledModel:
+    """
+    把 load_model_coefficients() 的長表（Disease, Variable, Coef）編譯成 CompiledModel。
+    疾病與欄位順序沿用檔案中第一次出現的順序；'REF' 與缺漏的組合皆為 0。
+    """
+    df = model_df[["Disease", "Variable", "Coef"]].astype(str)
+    # 同一 (Disease, Variable) 重複出現時，與舊邏輯一致取第一筆
+    df = df.drop_duplicates(["Disease", "Variable"], keep="first")
+    diseases = list(dict.fromkeys(df["Disease"]))
+    columns = list(dict.fromkeys(df["Variable"]))
+
+    is_ref = df["Coef"].str.upper() == "REF"
+    values = pd.to_numeric(df["Coef"].where(~is_ref), errors="coerce")
+    bad = values.isna() & ~is_ref
+    if bad.any():
+        sample = df.loc[bad, ["Disease", "Variable", "Coef"]].head(3).to_dict("records")
+        raise ValueError(f"係數檔含非數值的 Coef：{sample}")
+
+    d_idx = pd.Index(diseases).get_indexer(df["Disease"])
+    c_idx = pd.Index(columns).get_indexer(df["Variable"])
+    coef = np.zeros((len(diseases), len(columns)), dtype=np.float64)
+    coef[d_idx, c_idx] = values.fillna(0.0).to_numpy(dtype=np.float64)
+    return CompiledModel(diseases, columns, coef)
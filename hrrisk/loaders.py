@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+讀取 manifest.json 與模型檔（係數、百分位、baseline hazard）。
+不依賴 Streamlit；app 端再包一層 st.cache_data。
+"""
+
+from __future__ import annotations
+
+import json
+import re
+from pathlib import Path
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+
+
+# ---- 自動尋找 manifest.json ----
+_ROOT = Path(__file__).resolve().parent.parent
+MANIFEST_CANDIDATES = [
+    _ROOT / "heart-rate-risk-model" / "model" / "manifest.json",
+    _ROOT / "model" / "manifest.json",
+    _ROOT / "manifest.json",
+]
+
+# 你的疾病名稱對照（沿用你原本的 mapping）
+DISEASE_MAP = {
+    'DEATH': 'Death',
+    't2d': 'Type 2 Diabetes',
+    'af': 'Atrial Fibrillation',
+    'anxiety': 'Anxiety',
+    'ckd': 'Chronic Kidney Disease',
+    'gerd': 'Gastroesophageal Reflux Disease',
+    'heart_failure': 'Heart Failure',
+    'anemias': 'Anemias',
+    'asthma': 'Asthma',
+    'atherosclerosis': 'Atherosclerosis',
+    'cardiac_arrhythmia': 'Cardiac Arrhythmia',
+    'dementia': 'Dementia',
+    'depression': 'Depression',
+    'hypertension': 'Hypertension',
+    'ischemic_heart_disease': 'Ischemic Heart Disease',
+    'ischemic_stroke': 'Ischemic Stroke',
+    'migraine': 'Migraine',
+}
+
+# 百分位欄位與其對應的百分位數值
+PERCENTILE_COLUMNS = ['1%', '3%', '5%', '10%', '15%', '20%', '30%', '40%', '50%',
+                      '60%', '70%', '80%', '85%', '90%', '95%', '98%', '100%']
+PERCENTILE_VALUES = [1, 3, 5, 10, 15, 20, 30, 40, 50, 60, 70, 80, 85, 90, 95, 98, 100]
+
+_PERCENT_COLUMN = re.compile(r"^\d+(?:\.\d+)?%$")
+
+
+def percentile_columns(columns: Iterable[str]) -> tuple[list[str], np.ndarray]:
+    """
+    百分位檔中「N%」形式的欄位（依數值排序）與其百分位數值。
+    原檔為 PERCENTILE_COLUMNS 的 17 欄；高解析度的檔案可有任意多欄（例如 0%、0.1%…100%）。
+    """
+    cols = [c for c in columns if _PERCENT_COLUMN.match(str(c))]
+    values = np.array([float(c[:-1]) for c in cols], dtype=np.float64)
+    order = np.argsort(values, kind="stable")
+    return [cols[i] for i in order], values[order]
+
+
+def percentile_grid(n_knots: int) -> tuple[list[str], np.ndarray]:
+    """0%…100% 等距的 n_knots + 1 個百分位（欄位名稱, 數值），例如 1000 → 0%、0.1%…100%。"""
+    values = np.linspace(0.0, 100.0, n_knots + 1)
+    return [f"{v:.10g}%" for v in values], values
+
+
+def load_manifest(path: str | Path | None = None,
+                  candidates: Iterable[Path] | None = None) -> dict:
+    """
+    讀 manifest.json；未指定 path 時依序尋找 candidates。
+    回傳的 dict 會多一個 '_base_dir'（manifest 所在資料夾），後續路徑一律相對於它。
+    """
+    p = find_manifest(path, candidates)
+    data = json.loads(p.read_text(encoding="utf-8"))
+    data["_base_dir"] = p.parent
+    return data
+
+
+def find_manifest(path: str | Path | None = None, candidates: Iterable[Path] | None = None) -> Path:
+    """
+    load_manifest 會讀的那個 manifest.json 的路徑（app、命令列與 API 共用同一份 MANIFEST_CANDIDATES）；
+    都不存在時 FileNotFoundError。
+    """
+    paths = [Path(path)] if path else list(candidates or MANIFEST_CANDIDATES)
+    for p in paths:
+        if p.exists():
+            return p
+    raise FileNotFoundError(
+        "找不到 manifest.json，請將它放在 "
+        "heart-rate-risk-model/model/ 或 model/ 或專案根目錄。"
+    )
+
+
+# 組成模型的檔案：manifest 鍵 → 預設檔名（None 表示必填）
+MODEL_FILE_KEYS = {
+    "coef_path": None,
+    "pct_path": None,
+    "baseline_path": "baseline_hazard.csv",
+}
+
+
+def _resolve(path: str | Path | None, manifest: dict | None, key: str, default: str | None = None) -> Path:
+    if path:
+        return Path(path)
+    m = manifest if manifest is not None else load_manifest()
+    return m["_base_dir"] / (m.get(key, default) if default is not None else m[key])
+
+
+def model_files(manifest: dict) -> dict[str, Path]:
+    """manifest 指到的模型檔（MODEL_FILE_KEYS 的鍵 → 絕對路徑）。"""
+    return {key: _resolve(None, manifest, key, default) for key, default in MODEL_FILE_KEYS.items()}
+
+
+def _normalize_disease(s: pd.Series) -> pd.Series:
+    s = s.astype(str).str.strip()
+    return s.map(DISEASE_MAP).fillna(s)
+
+
+def load_model_coefficients(path: str | Path | None = None, manifest: dict | None = None) -> pd.DataFrame:
+    """
+    從 CSV 讀 Cox 係數表（保留 'REF' 字樣）。
+    優先使用參數 path；否則依 manifest.json 的 coef_path。
+    """
+    file = _resolve(path, manifest, "coef_path")
+    if not file.exists():
+        raise FileNotFoundError(f"係數檔不存在：{file}")
+
+    # 用 dtype=str 保留 'REF'
+    df = pd.read_csv(file, dtype=str)
+    df.columns = df.columns.str.strip()
+
+    # 基本欄位檢查
+    required = {"Disease", "Variable", "Coef"}
+    if not required.issubset(df.columns):
+        missing = required - set(df.columns)
+        raise ValueError(f"係數檔缺少欄位：{missing}")
+
+    # 去空白、標準化疾病名稱
+    for c in ["Disease", "Variable", "Coef"]:
+        df[c] = df[c].astype(str).str.strip()
+
+    df["Disease"] = _normalize_disease(df["Disease"])
+    return df
+
+
+def load_percentile_data(path: str | Path | None = None, manifest: dict | None = None) -> pd.DataFrame:
+    """
+    從 CSV 讀風險百分位表。
+    使用 sep=None + engine='python' 自動偵測分隔符（逗號/分號/Tab 都可）。
+    """
+    file = _resolve(path, manifest, "pct_path")
+    if not file.exists():
+        raise FileNotFoundError(f"百分位檔不存在：{file}")
+
+    # 自動偵測分隔符
+    df = pd.read_csv(file, sep=None, engine="python")
+    df.columns = df.columns.str.strip()
+
+    # 期望欄位：Disease、SEX、AGE 與至少兩個「N%」欄（原檔為 PERCENTILE_COLUMNS）
+    must_have = {"Disease", "SEX", "AGE"}
+    missing = must_have - set(df.columns)
+    columns, values = percentile_columns(df.columns)
+    if missing or len(columns) < 2:
+        raise ValueError(f"百分位檔缺少欄位：{missing or set(PERCENTILE_COLUMNS)}")
+    if len(set(values)) != len(values) or values[0] < 0 or values[-1] > 100:
+        raise ValueError(f"百分位欄位重複或超出 0–100%：{columns}")
+
+    # 清理與轉碼（高解析度表有上千欄，一次換掉所有百分位欄，避免逐欄插入把 DataFrame 切碎）
+    numeric = df[columns].apply(pd.to_numeric, errors='coerce')
+    df = pd.concat([df.drop(columns=columns), numeric], axis=1)
+    df["Disease"] = _normalize_disease(df["Disease"])
+    df["AGE"] = df["AGE"].astype(str).str.strip()
+    df["SEX"] = pd.to_numeric(df["SEX"], errors="coerce")
+    df["Gender"] = df["SEX"].map({1: "Male", 2: "Female"})
+
+    return df
+
+
+def load_baseline_hazard(path: str | Path | None = None, manifest: dict | None = None) -> pd.DataFrame:
+    """
+    從 CSV 讀每個疾病的 cumulative baseline hazard。
+    期望欄位：Disease, t_years, H0
+    - Disease：疾病英文名，與 DISEASE_MAP 映射一致
+    - t_years：時間（年），例如 3 表示三年
+    - H0：對應 t_years 的累積基準危險度 H0(t)
+    """
+    file = _resolve(path, manifest, "baseline_path", "baseline_hazard.csv")
+    if not file.exists():
+        raise FileNotFoundError(f"baseline 檔不存在：{file}")
+
+    df = pd.read_csv(file)
+    required = {"Disease", "t_years", "H0"}
+    missing = required - set(df.columns)
+    if missing:
+        raise ValueError(f"baseline 檔缺少欄位：{missing}")
+
+    # 清理與標準化
+    df["Disease"] = _normalize_disease(df["Disease"])
+    df["t_years"] = pd.to_numeric(df["t_years"], errors="coerce")
+    df["H0"] = pd.to_numeric(df["H0"], errors="coerce")
+
+    # 基本檢查
+    if df["t_years"].isna().any() or df["H0"].isna().any():
+        raise ValueError("baseline 檔中的 t_years 或 H0 出現非數值/缺失，請檢查資料。")
+
+    return df
+
+
+def horizon_years(manifest: dict) -> float:
+    """manifest 的 baseline_horizon_years（預設三年）。"""
+    try:
+        return float(manifest.get("baseline_horizon_years", 3))
+    except (TypeError, ValueError):
+        return 3.0
@@ -0,0 +1,429 @@
+# -*- coding: utf-8 -*-
+"""
+非同步寫入 Supabase：評估結果放進有上限的佇列後立即返回，由背景執行緒依序寫入，
+資料庫變慢或暫時失效時不會卡住 Streamlit 的畫面。
+
+    writer = BackgroundWriter(RestSink(url, anon_key))
+    writer.submit([("user_sessions", [session]), ("risk_events", rows)])
+
+- 一筆工作（job）是依序執行的多個 insert；前一步成功才做下一步（先 user_sessions 再 risk_events），
+  重試時從失敗的那一步接續，不會重複寫入已成功的步驟。
+- 失敗以指數退避（含抖動）重試，最多 max_retries 次；PermanentError（例如 4xx）不重試。
+- 佇列滿時依 overflow 處理："drop_newest"（丟掉新的，預設）、"drop_oldest"（丟掉最舊的）、
+  "block"（最多等 block_timeout 秒，逾時丟掉新的）。
+- 微批次：背景執行緒把多筆工作合併成一次 bulk insert，累積到 batch_rows 列或第一筆已等了
+  batch_interval 秒就送出。合併後每個資料表各一次 insert，順序依工作中首次出現的順序
+  （整批的 user_sessions 都寫入後才寫 risk_events）；合併批次遇到永久錯誤時拆回逐筆重送，
+  一筆壞資料不會拖累同批的其他人。
+"""
+
+from __future__ import annotations
+
+import http.client
+import json
+import logging
+import queue
+import random
+import select
+import threading
+import time
+import urllib.parse
+from typing import Callable, Iterable, Sequence
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_POLICIES = ("drop_newest", "drop_oldest", "block")
+
+# 一步 insert：(資料表, 多列資料)
+Step = tuple[str, list[dict]]
+
+
+class PermanentError(Exception):
+    """重試也不會成功的寫入錯誤（資料格式、權限等）。"""
+
+
+class Sink:
+    """寫入目的地：insert(table, rows) 成功即返回，失敗則拋出例外。"""
+
+    def insert(self, table: str, rows: list[dict]) -> None:
+        raise NotImplementedError
+
+
+class RestSink(Sink):
+    """
+    直接呼叫 PostgREST（Supabase 的 /rest/v1）的最小實作，只用標準函式庫。
+    url 為專案網址（例如 https://xxx.supabase.co），也可指向本機的替身伺服器（見 hrrisk.reststub）。
+
+    連線以 HTTP/1.1 keep-alive 重複使用：閒置的連線放回池中（最多 pool_size 條），
+    每次 insert 不必重新做 TCP／TLS 握手。insert 不是冪等的，只在確定請求沒有送達時換連線重送：
+    取出閒置連線時先檢查是否已被伺服器關閉，送出途中斷線也換新重送；請求已完整送出後才斷線
+    （伺服器可能已寫入）則直接拋出 ConnectionError，是否重試交給 BackgroundWriter。
+    timeout 為每次連線與讀取的逾時秒數。stats() 回傳 requests / connections / reused / stale：
+    請求數、新建的連線數、重複使用連線的請求數、因連線已失效而捨棄的次數。
+    """
+
+    def __init__(self, url: str, api_key: str, timeout: float = 10.0, pool_size: int = 4):
+        self.url = url.rstrip("/")
+        self.api_key = api_key
+        self.timeout = timeout
+        self.pool_size = pool_size
+        parts = urllib.parse.urlsplit(self.url)
+        if parts.scheme not in ("http", "https"):
+            raise ValueError(f"不支援的網址：{url!r}")
+        self._scheme = parts.scheme
+        self._host = parts.hostname
+        self._port = parts.port
+        self._base = parts.path
+        self._idle: list[http.client.HTTPConnection] = []
+        self._lock = threading.Lock()
+        self._counts = {"requests": 0, "connections": 0, "reused": 0, "stale": 0}
+
+    def _headers(self) -> dict[str, str]:
+        return {
+            "apikey": self.api_key,
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+            "Prefer": "return=minimal",
+        }
+
+    # ---- 連線池 ----
+    def _acquire(self) -> tuple[http.client.HTTPConnection, bool]:
+        """取出一條仍可用的閒置連線，沒有就新建；回傳 (連線, 是否為重複使用)。"""
+        with self._lock:
+            while self._idle:
+                conn = self._idle.pop()
+                if not _closed_by_peer(conn):
+                    return conn, True
+                conn.close()
+                self._counts["stale"] += 1
+            self._counts["connections"] += 1
+        if self._scheme == "https":
+            conn = http.client.HTTPSConnection(self._host, self._port, timeout=self.timeout)
+        else:
+            conn = http.client.HTTPConnection(self._host, self._port, timeout=self.timeout)
+        return conn, False
+
+    def _release(self, conn: http.client.HTTPConnection) -> None:
+        with self._lock:
+            if len(self._idle) < self.pool_size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def _post(self, path: str, body: bytes) -> tuple[int, bytes]:
+        while True:
+            conn, reused = self._acquire()
+            try:
+                conn.request("POST", path, body=body, headers=self._headers())
+            except (ConnectionResetError, BrokenPipeError):
+                conn.close()
+                if not reused:
+                    raise
+                # 送出途中發現閒置連線已被關閉：請求沒有完整送達，換一條重送
+                self._count("stale")
+                continue
+            except BaseException:
+                conn.close()
+                raise
+            try:
+                resp = conn.getresponse()
+                data = resp.read()
+            except BaseException:
+                # 請求已完整送出，伺服器可能已經寫入：不在這裡重送
+                conn.close()
+                raise
+            with self._lock:
+                self._counts["requests"] += 1
+                self._counts["reused"] += reused
+            if resp.will_close:
+                conn.close()
+            else:
+                self._release(conn)
+            return resp.status, data
+
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self._counts[key] += 1
+
+    def stats(self) -> dict[str, float]:
+        with self._lock:
+            counts: dict[str, float] = dict(self._counts)
+            counts["idle"] = len(self._idle)
+        counts["reuse_ratio"] = counts["reused"] / counts["requests"] if counts["requests"] else 0.0
+        return counts
+
+    def close(self) -> None:
+        """關閉所有閒置連線。"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    def insert(self, table: str, rows: list[dict]) -> None:
+        body = json.dumps(rows, ensure_ascii=False).encode("utf-8")
+        status, data = self._post(f"{self._base}/rest/v1/{table}", body)
+        if status >= 300:
+            detail = data[:500].decode("utf-8", "replace")
+            if 400 <= status < 500 and status not in (408, 429):
+                raise PermanentError(f"{table}: HTTP {status} {detail}")
+            raise ConnectionError(f"{table}: HTTP {status} {detail}")
+
+
+def _closed_by_peer(conn: http.client.HTTPConnection) -> bool:
+    """閒置連線是否已被對方關閉：閒置時不該有資料可讀，可讀即表示收到 EOF（或連線已失效）。"""
+    if conn.sock is None:
+        return True
+    try:
+        readable, _, _ = select.select([conn.sock], [], [], 0)
+    except (OSError, ValueError):
+        return True
+    return bool(readable)
+
+
+class _Job:
+    __slots__ = ("steps", "done", "attempts", "enqueued_at", "parts", "id")
+
+    def __init__(self, steps: Sequence[Step], enqueued_at: float | None = None, id: int | None = None):
+        self.steps = [(table, list(rows)) for table, rows in steps]
+        self.done = 0
+        self.attempts = 0
+        self.enqueued_at = time.monotonic() if enqueued_at is None else enqueued_at
+        self.parts: list[_Job] = [self]
+        self.id = id  # 持久化佇列（hrrisk.spool）中的編號
+
+    @property
+    def rows(self) -> int:
+        return sum(len(rows) for _, rows in self.steps)
+
+
+def _merge(jobs: list[_Job]) -> _Job:
+    """多筆工作 → 每個資料表一步的合併工作（資料表依首次出現的順序）。"""
+    if len(jobs) == 1:
+        return jobs[0]
+    merged: dict[str, list[dict]] = {}
+    for job in jobs:
+        for table, rows in job.steps:
+            merged.setdefault(table, []).extend(rows)
+    batch = _Job(list(merged.items()), min(job.enqueued_at for job in jobs))
+    batch.parts = jobs
+    return batch
+
+
+class BackgroundWriter:
+    """
+    單一背景執行緒 + 有上限的佇列。submit() 不做任何網路 I/O。
+    batch_rows / batch_interval 為微批次的列數與時間門檻（batch_rows=1 即逐筆寫入）。
+    stats() 回傳：
+    - submitted / written / dropped / failed / retries / queued：工作（一次評估）的計數
+    - batches / rows：已送出的批次數與列數
+    - insert_ms_avg / insert_ms_max：每批 insert 的耗時；delay_ms_max：從 submit 到寫入完成的最長時間
+    """
+
+    def __init__(self, sink: Sink, maxsize: int = 1000, overflow: str = "drop_newest",
+                 max_retries: int = 5, backoff: float = 0.5, max_backoff: float = 30.0,
+                 block_timeout: float = 0.1, batch_rows: int = 500, batch_interval: float = 2.0,
+                 on_failure: Callable[[Sequence[Step], Exception], None] | None = None,
+                 name: str = "hrrisk-log-writer"):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"overflow 必須是 {OVERFLOW_POLICIES} 之一：{overflow!r}")
+        self.sink = sink
+        self.overflow = overflow
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.block_timeout = block_timeout
+        self.batch_rows = max(1, batch_rows)
+        self.batch_interval = batch_interval
+        self.on_failure = on_failure
+
+        self._queue: queue.Queue[_Job] = queue.Queue(maxsize)
+        self._lock = threading.Lock()
+        self._counts = {"submitted": 0, "written": 0, "dropped": 0, "failed": 0, "retries": 0,
+                        "batches": 0, "rows": 0}
+        self._insert_seconds = 0.0
+        self._insert_calls = 0
+        self._insert_max = 0.0
+        self._delay_max = 0.0
+        self._stop = threading.Event()
+        self._flush_now = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    # ---- 生產端 ----
+    def submit(self, steps: Iterable[Step]) -> bool:
+        """把一筆工作放進佇列並立即返回；因佇列已滿而丟棄時回傳 False。"""
+        if self._stop.is_set():
+            raise RuntimeError("BackgroundWriter 已關閉")
+        self._count("submitted")
+        return self._put(_Job(steps))
+
+    # ---- 佇列操作（hrrisk.spool 以磁碟上的佇列覆寫）----
+    def _put(self, job: _Job) -> bool:
+        try:
+            if self.overflow == "block":
+                self._queue.put(job, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(job)
+            return True
+        except queue.Full:
+            pass
+
+        if self.overflow == "drop_oldest":
+            try:
+                self._queue.get_nowait()
+                self._queue.task_done()
+                self._count("dropped")
+                self._queue.put_nowait(job)
+                return True
+            except (queue.Empty, queue.Full):
+                pass
+        self._count("dropped")
+        return False
+
+    def _get(self, timeout: float) -> _Job | None:
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def _get_nowait(self) -> _Job | None:
+        try:
+            return self._queue.get_nowait()
+        except queue.Empty:
+            return None
+
+    def _finish(self, jobs: list[_Job]) -> None:
+        for _ in jobs:
+            self._queue.task_done()
+
+    def _pending(self) -> int:
+        """尚未寫完的工作數（含處理中）。"""
+        return self._queue.unfinished_tasks
+
+    def _step_done(self, job: _Job) -> None:
+        """job 的一步 insert 成功（job.done 已前進）。"""
+
+    def _settle(self, jobs: list[_Job], error: Exception | None) -> None:
+        """工作的最終結果：error 為 None 表示寫入完成，否則為放棄的原因。"""
+        if error is None:
+            self._count("written", len(jobs))
+            with self._lock:
+                self._delay_max = max(self._delay_max, time.monotonic() - min(j.enqueued_at for j in jobs))
+            return
+        self._count("failed", len(jobs))
+        logger.warning("寫入失敗，放棄 %d 筆：%s", len(jobs), error)
+        if self.on_failure is not None:
+            for job in jobs:
+                self.on_failure(job.steps[job.done:], error)
+
+    # ---- 消費端 ----
+    def _run(self) -> None:
+        while True:
+            job = self._get(timeout=0.1)
+            if job is None:
+                if self._stop.is_set():
+                    return
+                continue
+            jobs = self._gather(job)
+            try:
+                self._process(_merge(jobs))
+            finally:
+                self._finish(jobs)
+
+    def _gather(self, first: _Job) -> list[_Job]:
+        """
+        從 first 開始收集工作，直到列數達 batch_rows 或 first 已等了 batch_interval 秒。
+        佇列中已在等待的工作直接取用；佇列空了才等待新的工作。
+        """
+        jobs = [first]
+        rows = first.rows
+        deadline = first.enqueued_at + self.batch_interval
+        while rows < self.batch_rows:
+            job = self._get_nowait()
+            if job is None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._flush_now.is_set() or self._stop.is_set():
+                    break
+                job = self._get(timeout=min(remaining, 0.05))
+                if job is None:
+                    continue
+            jobs.append(job)
+            rows += job.rows
+        return jobs
+
+    def _process(self, job: _Job) -> None:
+        while job.done < len(job.steps):
+            table, rows = job.steps[job.done]
+            try:
+                if rows:
+                    t0 = time.monotonic()
+                    self.sink.insert(table, rows)
+                    self._record_insert(len(rows), time.monotonic() - t0)
+                job.done += 1
+                self._step_done(job)
+            except Exception as e:  # 網路、逾時、5xx…
+                job.attempts += 1
+                if isinstance(e, PermanentError) and len(job.parts) > 1:
+                    # 合併批次中可能只有一筆有問題：已完成的資料表略過，其餘逐筆重送
+                    written = {t for t, _ in job.steps[:job.done]}
+                    for part in job.parts:
+                        part.steps = [(t, r) for t, r in part.steps if t not in written]
+                        part.done = 0
+                        self._process(part)
+                    return
+                if isinstance(e, PermanentError) or job.attempts > self.max_retries or self._stop.is_set():
+                    # 合併批次已完成的資料表，對每一筆也都完成了
+                    written = {t for t, _ in job.steps[:job.done]}
+                    for part in job.parts:
+                        part.done = sum(1 for t, _ in part.steps if t in written)
+                    self._settle(job.parts, e)
+                    return
+                self._count("retries")
+                self._stop.wait(self._delay(job.attempts))
+        self._settle(job.parts, None)
+
+    def _record_insert(self, rows: int, seconds: float) -> None:
+        with self._lock:
+            self._counts["batches"] += 1
+            self._counts["rows"] += rows
+            self._insert_calls += 1
+            self._insert_seconds += seconds
+            self._insert_max = max(self._insert_max, seconds)
+
+    def _delay(self, attempt: int) -> float:
+        # 指數退避 + full jitter
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1)))
+
+    def _count(self, key: str, n: int = 1) -> None:
+        with self._lock:
+            self._counts[key] += n
+
+    # ---- 管理 ----
+    def stats(self) -> dict[str, float]:
+        with self._lock:
+            counts: dict[str, float] = dict(self._counts)
+            counts["insert_ms_avg"] = 1000 * self._insert_seconds / self._insert_calls if self._insert_calls else 0.0
+            counts["insert_ms_max"] = 1000 * self._insert_max
+            counts["delay_ms_max"] = 1000 * self._delay_max
+        counts["queued"] = self._pending()
+        return counts
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """不等批次的時間門檻，立即送出並等到佇列清空（含重試中的工作）；逾時回傳 False。"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        self._flush_now.set()
+        try:
+            while self._pending():
+                if deadline is not None and time.monotonic() >= deadline:
+                    return False
+                time.sleep(0.01)
+            return True
+        finally:
+            self._flush_now.clear()
+
+    def close(self, timeout: float | None = 5.0) -> bool:
+        """停止收件，最多等 timeout 秒把佇列寫完；回傳是否全部寫完。重試中的工作會立即放棄。"""
+        drained = self.flush(timeout)
+        self._stop.set()
+        self._thread.join(timeout=1.0)
+        return drained
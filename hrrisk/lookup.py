@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+全組合查表：模型輸入幾乎都是分組變數（預設 schema 為心率 5 組 × BMI 4 組 × 性別 2 × 吸菸 3 × 飲酒 3），
+加上 app 滑桿的整數年齡 20–90，所有可能的輸入組合只有 71 × 360 = 25,560 種。
+組合範圍由模型的共變數 schema 決定：age 之外的共變數都必須是 categorical / banded。
+事先把每種組合 × 每個疾病的 LP、百分位與絕對風險算好存成一張表，
+評分時把輸入換成打包後的整數鍵，直接以陣列索引讀出。
+
+    python -m hrrisk build-lookup lookup.npz
+
+表內記錄建表時模型的指紋（係數、百分位門檻、H0、horizon、schema 的雜湊），
+載入時與目前模型比對，避免用過期的表。
+表外的輸入（非整數或超出範圍的年齡、無法辨識的選項）照常即時計算。
+"""
+
+from __future__ import annotations
+
+import hashlib
+from pathlib import Path
+from typing import Mapping
+
+import numpy as np
+
+from .schema import CovariateSchema
+from .scoring import ScoringModel, outcome_arrays
+
+
+AGE_MIN = 20
+AGE_MAX = 90
+
+FORMAT_VERSION = 3
+
+
+def key_layout(schema: CovariateSchema) -> tuple[tuple[str, ...], tuple[int, ...]]:
+    """
+    打包順序（由高位到低位）：年齡，再依 schema 順序排列的分組共變數；回傳 (分組共變數名稱, key 形狀)。
+    schema 除 age 之外還有連續變數、或沒有 gender 時無法列舉，ValueError。
+    """
+    if [c.name for c in schema.continuous] != ["age"] or "gender" not in schema.by_name:
+        raise ValueError(f"查表需要 age 為唯一的連續共變數且含 gender：{schema!r}")
+    names = tuple(c.name for c in schema.categorical)
+    return names, (AGE_MAX - AGE_MIN + 1, *(len(schema.by_name[n].variables) for n in names))
+
+
+def pack_keys(age: np.ndarray, codes: Mapping[str, np.ndarray], inputs: tuple[str, ...],
+              key_shape: tuple[int, ...]) -> np.ndarray:
+    """依 key_layout 把 (年齡, 各分組代碼) 打包成整數鍵；表外的列為 -1。"""
+    age = np.asarray(age, dtype=np.float64)
+    with np.errstate(invalid="ignore"):
+        ok = (age >= AGE_MIN) & (age <= AGE_MAX) & (age == np.floor(age))
+    packed = [np.where(ok, age, AGE_MIN).astype(np.int64) - AGE_MIN]
+    for name in inputs:
+        c = np.asarray(codes[name], dtype=np.int64)
+        ok &= c >= 0
+        packed.append(np.where(c >= 0, c, 0))
+    return np.where(ok, np.ravel_multi_index(packed, key_shape), -1)
+
+
+def key_grid(inputs: tuple[str, ...], key_shape: tuple[int, ...]) -> dict[str, np.ndarray]:
+    """全部鍵（0..n_keys-1）對應的輸入：age 為數值，其餘為代碼；可直接交給 DesignBuilder.predict。"""
+    grid = np.indices(key_shape).reshape(len(key_shape), -1)
+    return {"age": (grid[0] + AGE_MIN).astype(np.float64), **dict(zip(inputs, grid[1:]))}
+
+
+def model_fingerprint(model: ScoringModel) -> str:
+    """評分結果所依賴的全部數值的 SHA-256；任何一項改變，指紋即不同。"""
+    h = hashlib.sha256()
+    h.update("\0".join(model.diseases).encode("utf-8"))
+    h.update("\0".join(model.compiled.columns).encode("utf-8"))
+    h.update(np.ascontiguousarray(model.compiled.coef[model.coef_rows]).tobytes())
+    h.update(np.ascontiguousarray(model.percentiles.values[model.percentile_rows]).tobytes())
+    h.update(np.ascontiguousarray(model.percentiles.present[model.percentile_rows]).tobytes())
+    h.update(model.percentiles.grid.tobytes())
+    h.update(model.H0.tobytes())
+    h.update(np.float64(model.horizon).tobytes())
+    h.update(model.schema.digest.encode("ascii"))
+    return h.hexdigest()
+
+
+class LookupTable:
+    """
+    預先算好的評分表，第 key 列對應 np.ravel_multi_index((年齡, *代碼), key_shape) 的組合，
+    inputs 為代碼對應的分組共變數名稱（見 key_layout）。
+    - lp、abs_risk：float64，shape (n_keys, n_diseases)
+    - percentile、exact_percentile：int8，找不到百分位組別為 -1
+    """
+
+    def __init__(self, diseases, fingerprint: str, lp: np.ndarray, percentile: np.ndarray,
+                 exact_percentile: np.ndarray, abs_risk: np.ndarray, inputs, key_shape):
+        self.diseases = tuple(diseases)
+        self.fingerprint = str(fingerprint)
+        self.lp = lp
+        self.percentile = percentile
+        self.exact_percentile = exact_percentile
+        self.abs_risk = abs_risk
+        self.inputs = tuple(str(n) for n in inputs)
+        self.key_shape = tuple(int(k) for k in key_shape)
+        if len(self.key_shape) != len(self.inputs) + 1:
+            raise ValueError(f"查表 key_shape {self.key_shape} 與輸入 {self.inputs} 不符")
+        expected = (int(np.prod(self.key_shape)), len(self.diseases))
+        for name in ("lp", "percentile", "exact_percentile", "abs_risk"):
+            if getattr(self, name).shape != expected:
+                raise ValueError(f"查表 {name} 的形狀 {getattr(self, name).shape} 與預期 {expected} 不符")
+
+    @property
+    def nbytes(self) -> int:
+        return self.lp.nbytes + self.percentile.nbytes + self.exact_percentile.nbytes + self.abs_risk.nbytes
+
+    def check(self, model: ScoringModel) -> None:
+        """確認此表由同一份模型建立；不符時 ValueError。"""
+        if self.diseases != model.diseases or self.fingerprint != model_fingerprint(model):
+            raise ValueError("查表與目前載入的模型不一致，請重新執行 build-lookup。")
+
+    def keys(self, age: np.ndarray, codes: Mapping[str, np.ndarray]) -> np.ndarray:
+        """
+        各列的打包整數鍵（codes 為 DesignBuilder.codes 的結果）；
+        表外的列（非整數/超出範圍年齡、未知選項）為 -1。
+        """
+        return pack_keys(age, codes, self.inputs, self.key_shape)
+
+    def take(self, key: np.ndarray, n: int, rows: np.ndarray
+             ) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        配置 (n, n_diseases) 的 (LP, percentile, exact_percentile, abs_risk)，
+        把 key 對應的列填到 rows 選到的位置（百分位轉為 int64，與 score_arrays 相同）；其餘位置未初始化。
+        """
+        d = len(self.diseases)
+        out = (np.empty((n, d), dtype=np.float64), np.empty((n, d), dtype=np.int64),
+               np.empty((n, d), dtype=np.int64), np.empty((n, d), dtype=np.float64))
+        for dst, src in zip(out, (self.lp, self.percentile, self.exact_percentile, self.abs_risk)):
+            dst[rows] = src[key]
+        return out
+
+    def profile(self, schema: CovariateSchema, profile: Mapping
+                ) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray] | None:
+        """單人輸入（以共變數名稱為鍵，同 score_profile）對應的一列；不在表內時回傳 None。"""
+        try:
+            codes = tuple(schema.by_name[name].code(profile[name]) for name in self.inputs)
+            age = float(profile["age"])
+        except (KeyError, ValueError, TypeError):
+            return None
+        if min(codes) < 0 or not (AGE_MIN <= age <= AGE_MAX and age.is_integer()):
+            return None
+        key = np.ravel_multi_index((int(age) - AGE_MIN, *codes), self.key_shape)
+        return (self.lp[key], self.percentile[key].astype(np.int64),
+                self.exact_percentile[key].astype(np.int64), self.abs_risk[key])
+
+    def save(self, path: str | Path) -> None:
+        """存成未壓縮的 .npz（載入時不需解壓）。"""
+        np.savez(
+            path,
+            format_version=np.int64(FORMAT_VERSION),
+            key_shape=np.array(self.key_shape, dtype=np.int64),
+            inputs=np.array(self.inputs),
+            age_min=np.int64(AGE_MIN),
+            diseases=np.array(self.diseases),
+            fingerprint=np.array(self.fingerprint),
+            lp=self.lp,
+            percentile=self.percentile,
+            exact_percentile=self.exact_percentile,
+            abs_risk=self.abs_risk,
+        )
+
+
+def build_lookup_table(model: ScoringModel) -> LookupTable:
+    """
+    列舉 key_layout(model.schema) 的所有組合後評分，建成 LookupTable。
+    LP 以 DesignBuilder.predict 計算，加總順序與即時計算的單人、批次評分相同，
+    開不開查表結果都逐位元相同。
+    """
+    inputs, key_shape = key_layout(model.schema)
+    codes = key_grid(inputs, key_shape)
+    age = codes["age"]
+    LP = model.design.predict(model.compiled.coef[model.coef_rows], codes)
+    pct, exact, abs_risk = outcome_arrays(model, LP, age, model.sex_codes(codes))
+    return LookupTable(model.diseases, model_fingerprint(model), LP,
+                       pct.astype(np.int8), exact.astype(np.int8), abs_risk, inputs, key_shape)
+
+
+def load_lookup_table(path: str | Path, model: ScoringModel | None = None) -> LookupTable:
+    """
+    讀取 build-lookup 產生的 .npz。
+    格式版本或打包方式與目前程式不同時 ValueError；給 model 時一併檢查是否為同一份模型。
+    """
+    with np.load(path, allow_pickle=False) as z:
+        if int(z["format_version"]) != FORMAT_VERSION:
+            raise ValueError(f"查表格式版本 {int(z['format_version'])} 不受支援（需要 {FORMAT_VERSION}）")
+        if int(z["age_min"]) != AGE_MIN or int(z["key_shape"][0]) != AGE_MAX - AGE_MIN + 1:
+            raise ValueError("查表的年齡範圍與目前程式不同，請重新執行 build-lookup。")
+        table = LookupTable(
+            [str(d) for d in z["diseases"]], str(z["fingerprint"]),
+            z["lp"], z["percentile"], z["exact_percentile"], z["abs_risk"],
+            [str(n) for n in z["inputs"]], z["key_shape"],
+        )
+    if model is not None:
+        table.check(model)
+    return table
+
+
+def load_or_build_lookup(model: ScoringModel, path: str | Path | None = None) -> LookupTable:
+    """有 path 且為同一份模型建立的表就載入；檔案不存在或已過期則當場重建（約零點幾秒）。"""
+    if path is not None and Path(path).exists():
+        try:
+            return load_lookup_table(path, model)
+        except ValueError:
+            pass
+    return build_lookup_table(model)
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+分段計時：記錄一次 rerun / 請求中各階段（讀 manifest、各 loader、評分、每張 st.plotly_chart、
+卡片 HTML、寫入紀錄等）的耗時，以行程內的滾動直方圖保存，輸出成 Prometheus 文字格式：
+
+    HRRISK_METRICS=1 HRRISK_METRICS_PORT=9464 streamlit run app_test.py
+    curl localhost:9464/metrics
+
+    with stage("score"):
+        ...
+
+- 預設關閉：stage() 回傳共用的空 context manager，不讀時鐘、不上鎖。
+- 開啟時每段只多兩次 perf_counter 與一次上鎖的計數（約 1–2 µs），一次 rerun 數十段也遠低於 1%。
+- 每段一個 RollingHistogram：累計的 bucket / sum / count（Prometheus histogram），
+  以及最近 window 秒的滾動視窗（依時間分成 slots 格輪替），輸出為 p50 / p90 / p99 的 summary。
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterable
+
+# bucket 上界（秒），同 Prometheus 的 le；最後另有 +Inf
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DEFAULT_WINDOW = 300.0
+DEFAULT_SLOTS = 10
+QUANTILES = (0.5, 0.9, 0.99)
+
+METRIC_NAME = "hrrisk_stage_duration_seconds"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class RollingHistogram:
+    """
+    固定 bucket 的耗時直方圖。
+    - counts / total：自行程啟動以來的累計（各 bucket 非累加，輸出時才累加成 le）
+    - 滾動視窗：window 秒分成 slots 格，每格記自己的 bucket 計數與總和；寫入時遇到過期的格子先清空
+    """
+
+    def __init__(self, buckets: Iterable[float] = DEFAULT_BUCKETS, window: float = DEFAULT_WINDOW,
+                 slots: int = DEFAULT_SLOTS):
+        self.buckets = tuple(buckets)
+        self.window = float(window)
+        self._slot_seconds = self.window / slots
+        n = len(self.buckets) + 1
+        self.counts = [0] * n
+        self.total = 0.0
+        self._slot_ids = [-1] * slots
+        self._slot_counts = [[0] * n for _ in range(slots)]
+        self._slot_totals = [0.0] * slots
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float, now: float | None = None) -> None:
+        i = bisect_left(self.buckets, seconds)
+        slot_id = int((time.monotonic() if now is None else now) // self._slot_seconds)
+        s = slot_id % len(self._slot_ids)
+        with self._lock:
+            if self._slot_ids[s] != slot_id:
+                self._slot_ids[s] = slot_id
+                self._slot_counts[s] = [0] * len(self.counts)
+                self._slot_totals[s] = 0.0
+            self._slot_counts[s][i] += 1
+            self._slot_totals[s] += seconds
+            self.counts[i] += 1
+            self.total += seconds
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def snapshot(self) -> tuple[list[int], float]:
+        """(累計的各 bucket 計數, 累計總秒數)。"""
+        with self._lock:
+            return list(self.counts), self.total
+
+    def recent(self, now: float | None = None) -> tuple[list[int], float]:
+        """最近 window 秒內的 (各 bucket 計數, 總秒數)。"""
+        current = int((time.monotonic() if now is None else now) // self._slot_seconds)
+        oldest = current - len(self._slot_ids) + 1
+        counts = [0] * len(self.counts)
+        total = 0.0
+        with self._lock:
+            for slot_id, slot_counts, slot_total in zip(self._slot_ids, self._slot_counts, self._slot_totals):
+                if oldest <= slot_id <= current:
+                    counts = [a + b for a, b in zip(counts, slot_counts)]
+                    total += slot_total
+        return counts, total
+
+    def quantile(self, q: float, counts: list[int]) -> float:
+        """由 bucket 計數估計分位數（bucket 內線性內插，同 PromQL histogram_quantile）；沒有資料為 NaN。"""
+        n = sum(counts)
+        if n == 0:
+            return float("nan")
+        rank = q * n
+        seen = 0
+        for i, c in enumerate(counts):
+            if c and seen + c >= rank:
+                if i == len(self.buckets):  # +Inf bucket：回報最後一個有限上界
+                    return self.buckets[-1]
+                lo = self.buckets[i - 1] if i > 0 else 0.0
+                return lo + (self.buckets[i] - lo) * (rank - seen) / c
+            seen += c
+        return self.buckets[-1]
+
+
+class _Stage:
+    """計時一段程式並記入 histogram（with 區塊內發生例外也照樣記錄）。"""
+
+    __slots__ = ("_hist", "_start")
+
+    def __init__(self, hist: RollingHistogram):
+        self._hist = hist
+
+    def __enter__(self) -> "_Stage":
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._hist.observe(time.perf_counter() - self._start)
+
+
+class StageMetrics:
+    """階段名稱 → RollingHistogram。"""
+
+    def __init__(self, buckets: Iterable[float] = DEFAULT_BUCKETS, window: float = DEFAULT_WINDOW,
+                 slots: int = DEFAULT_SLOTS):
+        self._args = (tuple(buckets), window, slots)
+        self._stages: dict[str, RollingHistogram] = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name: str) -> RollingHistogram:
+        hist = self._stages.get(name)
+        if hist is None:
+            with self._lock:
+                hist = self._stages.setdefault(name, RollingHistogram(*self._args))
+        return hist
+
+    def stage(self, name: str) -> _Stage:
+        return _Stage(self.histogram(name))
+
+    def observe(self, name: str, seconds: float) -> None:
+        self.histogram(name).observe(seconds)
+
+    @property
+    def stages(self) -> list[str]:
+        return sorted(self._stages)
+
+    def render_prometheus(self, now: float | None = None) -> str:
+        """Prometheus 文字格式：累計的 histogram 與最近 window 秒的 summary（p50 / p90 / p99）。"""
+        lines = [f"# HELP {METRIC_NAME} 各階段耗時（自行程啟動以來）",
+                 f"# TYPE {METRIC_NAME} histogram"]
+        hists = [(name, self._stages[name]) for name in self.stages]
+        for name, hist in hists:
+            counts, total = hist.snapshot()
+            label = _label(name)
+            cumulative = 0
+            for bound, c in zip(hist.buckets, counts):
+                cumulative += c
+                lines.append(f'{METRIC_NAME}_bucket{{stage="{label}",le="{bound:g}"}} {cumulative}')
+            cumulative += counts[-1]
+            lines.append(f'{METRIC_NAME}_bucket{{stage="{label}",le="+Inf"}} {cumulative}')
+            lines.append(f'{METRIC_NAME}_sum{{stage="{label}"}} {total!r}')
+            lines.append(f'{METRIC_NAME}_count{{stage="{label}"}} {cumulative}')
+
+        recent = f"{METRIC_NAME}_recent"
+        window = hists[0][1].window if hists else DEFAULT_WINDOW
+        lines += [f"# HELP {recent} 各階段耗時（最近 {window:g} 秒，由 bucket 估計的分位數）",
+                  f"# TYPE {recent} summary"]
+        for name, hist in hists:
+            counts, total = hist.recent(now)
+            label = _label(name)
+            for q in QUANTILES:
+                lines.append(f'{recent}{{stage="{label}",quantile="{q:g}"}} {hist.quantile(q, counts)!r}')
+            lines.append(f'{recent}_sum{{stage="{label}"}} {total!r}')
+            lines.append(f'{recent}_count{{stage="{label}"}} {sum(counts)}')
+        return "\n".join(lines) + "\n"
+
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _env_enabled() -> bool:
+    return os.environ.get("HRRISK_METRICS", "").strip().lower() not in ("", "0", "false", "no", "off")
+
+
+# 行程內共用的計時表；是否開啟由環境變數 HRRISK_METRICS 決定（也可用 set_enabled 切換）
+METRICS = StageMetrics()
+_enabled = _env_enabled()
+_DISABLED = nullcontext()
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def set_enabled(value: bool) -> None:
+    global _enabled
+    _enabled = bool(value)
+
+
+def stage(name: str):
+    """with stage("名稱"): ... 計時該段；關閉時回傳共用的空 context manager。"""
+    return METRICS.stage(name) if _enabled else _DISABLED
+
+
+def serve_metrics(port: int, host: str = "127.0.0.1", metrics: StageMetrics = METRICS) -> ThreadingHTTPServer:
+    """
+    在背景執行緒提供 GET /metrics（Prometheus 文字格式），回傳 server（shutdown() 停止）。
+    預設只綁 127.0.0.1：只有本機（或同機的 Prometheus / sidecar）讀得到，不對外公開。
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args) -> None:  # 不把每次抓取寫到 stderr
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="hrrisk-metrics", daemon=True).start()
+    return server
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+多行程批次評分：把輸入切成分片交給 process pool，結果依輸入順序合併。
+
+模型（係數矩陣、百分位張量、H0）經由 pool initializer 交給每個 worker 一次：
+fork 平台上直接繼承父行程記憶體（copy-on-write，不序列化）；
+spawn 平台上每個 worker 只反序列化一次，而不是每個分片都重送。
+"""
+
+from __future__ import annotations
+
+import multiprocessing as mp
+import os
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Callable, Iterable, Iterator
+
+import numpy as np
+import pandas as pd
+
+from .scoring import ScoringModel, load_scoring_model, score_batch
+
+
+# worker 端的模型（或 map_chunks_parallel 的 state，由 _init_worker 設定）
+_MODEL: ScoringModel | None = None
+
+
+def _init_worker(model: ScoringModel) -> None:
+    global _MODEL
+    _MODEL = model
+
+
+def _score_shard(func: Callable[..., object], shard: pd.DataFrame, args: tuple) -> object:
+    return func(shard, _MODEL, *args)
+
+
+def _mp_context():
+    # Linux 用 fork 讓 worker 直接共用父行程已載入的模型陣列
+    methods = mp.get_all_start_methods()
+    return mp.get_context("fork" if "fork" in methods else None)
+
+
+def default_workers() -> int:
+    return os.cpu_count() or 1
+
+
+def score_chunks_parallel(chunks: Iterable[pd.DataFrame], model: ScoringModel, workers: int,
+                          func: Callable[..., pd.DataFrame] = score_batch, args: tuple = (),
+                          max_inflight: int | None = None) -> Iterator[pd.DataFrame]:
+    """
+    以 workers 個行程對每塊呼叫 func(chunk, model, *args)，依輸入順序逐塊產出結果。
+    func 須為模組層級函式（以名稱傳給 worker）。
+    同時在途的分片最多 max_inflight（預設 workers * 2）塊，記憶體用量維持有界。
+    """
+    return map_chunks_parallel(chunks, model, workers, func, args, max_inflight)
+
+
+def map_chunks_parallel(chunks: Iterable[pd.DataFrame], state: object, workers: int,
+                        func: Callable[..., object], args: tuple = (),
+                        max_inflight: int | None = None) -> Iterator[object]:
+    """
+    score_chunks_parallel 的一般形式：state 可以是任何物件（同模型一樣只交給每個 worker 一次），
+    每塊呼叫 func(chunk, state, *args)，依輸入順序逐塊產出 func 的回傳值。
+    """
+    max_inflight = max_inflight or workers * 2
+    pending: deque[Future] = deque()
+    with ProcessPoolExecutor(max_workers=workers, mp_context=_mp_context(),
+                             initializer=_init_worker, initargs=(state,)) as pool:
+        for chunk in chunks:
+            pending.append(pool.submit(_score_shard, func, chunk, args))
+            if len(pending) >= max_inflight:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def score_batch_parallel(data: pd.DataFrame, model: ScoringModel | None = None,
+                         workers: int | None = None, shards: int | None = None) -> pd.DataFrame:
+    """
+    score_batch 的多行程版本：把 data 切成 shards 片（預設 workers * 4）平行評分後依序合併。
+    回傳與 score_batch(data) 相同的欄位與索引。
+    """
+    model = model or load_scoring_model()
+    workers = workers or default_workers()
+    if workers <= 1 or len(data) == 0:
+        return score_batch(data, model)
+
+    n_shards = max(1, min(len(data), shards or workers * 4))
+    bounds = np.linspace(0, len(data), n_shards + 1).astype(int)
+    pieces = (data.iloc[a:b] for a, b in zip(bounds[:-1], bounds[1:]))
+    return pd.concat(list(score_chunks_parallel(pieces, model, workers)))
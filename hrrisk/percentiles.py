@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""
+百分位表編譯：把長表（Disease × SEX × AGE × k 個分位點）轉成
+(disease, sex, age_group, k) 的 float 張量，整批排名不需逐格迴圈。
+
+原檔 k = 17（1%、3%…100%）；百分位檔也可以是高解析度的 CDF 表（例如 0%、0.1%…100% 共 1001 欄，
+見 `python -m hrrisk build-percentiles --knots 1000`），排名規則相同，只是門檻更密：
+低於第一個門檻為該門檻的百分位（有 0% 欄時即 0），高於 100% 門檻為 100，其間線性內插。
+"""
+
+from __future__ import annotations
+
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+
+from .categories import AGE_GROUP_BANDS
+from .loaders import PERCENTILE_VALUES, percentile_columns
+
+
+SEX_LABELS = ("Male", "Female")
+AGE_GROUP_LABELS = AGE_GROUP_BANDS.labels
+
+# 門檻數不超過此值時用 counts 表（格子數 × 不重複門檻數，隨門檻數平方成長），否則用均勻分箱索引
+COUNTS_MAX_KNOTS = 32
+# 筆數 × 箱寬不超過此值時整箱比對，否則逐步二分
+_WINDOW_MAX = 4096
+
+
+class PercentileTable:
+    """
+    已編譯的百分位表。
+    - values：shape (n_diseases, 2, 6, k)，缺的組別整格為 NaN
+    - present：shape (n_diseases, 2, 6)，該組別是否存在
+    - grid：k 個門檻對應的百分位（預設 PERCENTILE_VALUES）
+    每一格的門檻須為非遞減；排名的核心是「該格有幾個門檻 < lp」（= 第一個 lp <= 門檻的位置）：
+    - k <= COUNTS_MAX_KNOTS：LP 先以 searchsorted 換成「在所有門檻值中的整數名次」q，
+      再查預先算好的 counts[cell, q]
+    - 更密的表：每格把 [第一個門檻, 最後一個門檻] 等分成 k 個箱，bins[cell, b] 為箱號 < b 的門檻數；
+      LP 以同一公式算出箱號後（O(1)），只在該箱的門檻間二分（步數由最擠的箱決定，通常 3–5 步）
+    兩種方式的比較結果都與逐欄 `lp <= 門檻` 完全相同。
+    knots/counts/bins 可直接傳入先前算好的結果（見 hrrisk.artifact），省去重算。
+    """
+
+    def __init__(self, diseases: Iterable[str], values: np.ndarray, present: np.ndarray,
+                 knots: np.ndarray | None = None, counts: np.ndarray | None = None,
+                 grid: np.ndarray | None = None, bins: np.ndarray | None = None):
+        self.diseases = tuple(diseases)
+        self.values = np.ascontiguousarray(values, dtype=np.float64)
+        self.present = np.asarray(present, dtype=bool)
+        self.grid = np.asarray(PERCENTILE_VALUES if grid is None else grid, dtype=np.float64)
+        self.disease_index = {d: i for i, d in enumerate(self.diseases)}
+        self.sex_index = {s: i for i, s in enumerate(SEX_LABELS)}
+        self.age_group_index = {a: i for i, a in enumerate(AGE_GROUP_LABELS)}
+
+        k = len(self.grid)
+        if self.values.shape[-1] != k:
+            raise ValueError(f"百分位門檻數 {self.values.shape[-1]} 與百分位欄數 {k} 不符")
+        flat = self.values.reshape(-1, k)
+        self._flat = flat.ravel()
+        self._pv = self.grid
+        self._knots = self._counts = self._bins = None
+        if k > COUNTS_MAX_KNOTS:
+            self._compile_bins(flat, bins)
+            return
+        if knots is None or counts is None:
+            # 所有門檻值的排序唯一集合，以及每個門檻在其中的名次
+            knots = np.unique(flat[self.present.ravel()])
+            ranks = np.searchsorted(knots, np.nan_to_num(flat, nan=np.inf))
+            # counts[cell, q] = 該格名次 < q 的門檻數（= 第一個 lp <= 門檻 的位置）
+            q = np.arange(len(knots) + 1)
+            counts = (ranks[:, None, :] < q[None, :, None]).sum(axis=2, dtype=np.int8)
+        self._knots = knots
+        self._counts = counts
+
+    def _compile_bins(self, flat: np.ndarray, bins: np.ndarray | None) -> None:
+        n_cells, k = flat.shape
+        # 缺的格子（NaN）給一段不會被查到的假值，讓箱號計算保持有限
+        lo = np.nan_to_num(flat[:, 0])
+        span = np.nan_to_num(flat[:, -1]) - lo
+        self._lo = lo
+        self._scale = np.where(span > 0, k / np.where(span > 0, span, 1.0), 0.0)
+        if bins is None:
+            b = self._bin(np.nan_to_num(flat), np.arange(n_cells)[:, None])
+            # 各格的箱號非遞減：以 (格子, 箱號) 的整數鍵做一次 searchsorted 得到每箱的起點
+            keys = (np.arange(n_cells)[:, None] * k + b).ravel()
+            edges = np.arange(n_cells)[:, None] * k + np.arange(k + 1)[None, :]
+            start = np.searchsorted(keys, edges.ravel()).reshape(n_cells, k + 1)
+            bins = (start - np.arange(n_cells)[:, None] * k).astype(np.min_scalar_type(k))
+        self._bins = bins
+        self._bins_flat = bins.ravel()
+        # 最擠的一箱有 w 個門檻：二分需 bit_length(w) 步。
+        # 整箱比對時每格後面補 w 個 +inf：箱號較大的門檻必定 > lp，比對結果自然為 False，不需另做遮罩
+        self._width = int(np.diff(bins.astype(np.int64), axis=1).max(initial=0))
+        self._steps = self._width.bit_length()
+        self._window = np.arange(self._width)
+        self._stride = k + self._width
+        self._padded = np.hstack([flat, np.full((n_cells, self._width), np.inf)]).ravel()
+
+    def _bin(self, lp: np.ndarray, cell: np.ndarray) -> np.ndarray:
+        """箱號 floor((lp - lo) * scale)，夾在 [0, k - 1]（NaN 為 0）；對 lp 單調，門檻與查詢用同一公式。"""
+        t = np.floor((lp - self._lo[cell]) * self._scale[cell])
+        return np.fmin(np.fmax(t, 0), len(self._pv) - 1).astype(np.intp)
+
+    def _count_below(self, lp: np.ndarray, c: np.ndarray) -> np.ndarray:
+        """每個 (lp, 格子) 中門檻 < lp 的個數；lp 為 NaN 時為 k（與 searchsorted 把 NaN 排在最後相同）。"""
+        k = len(self._pv)
+        if self._bins is None:
+            # q = 小於 lp 的門檻值個數，故「lp <= 門檻」⇔「門檻名次 >= q」
+            q = np.searchsorted(self._knots, lp, side="left")
+            return self._counts[c, q].astype(np.int64)
+        at = c * (k + 1) + self._bin(lp, c)
+        lo = self._bins_flat[at].astype(np.intp)
+        if lp.size * self._width <= _WINDOW_MAX:
+            # 小批（例如單人評分的 17 個疾病）：一次比對整箱，省去逐步二分的多次呼叫
+            below = self._padded[(c * self._stride + lo)[..., None] + self._window] < lp[..., None]
+            return np.where(np.isnan(lp), k, lo + np.count_nonzero(below, axis=-1))
+        hi = self._bins_flat[at + 1].astype(np.intp)
+        base = c * k
+        for _ in range(self._steps):
+            active = lo < hi
+            mid = (lo + hi) // 2
+            less = self._flat[base + np.minimum(mid, k - 1)] < lp
+            lo = np.where(active & less, mid + 1, lo)
+            hi = np.where(active & ~less, mid, hi)
+        return np.where(np.isnan(lp), k, lo)
+
+    @property
+    def shape(self) -> tuple[int, ...]:
+        return self.values.shape
+
+    @property
+    def dense(self) -> bool:
+        """是否為高解析度表（以均勻分箱索引排名）。"""
+        return self._bins is not None
+
+    @property
+    def knots(self) -> np.ndarray | None:
+        return self._knots
+
+    @property
+    def counts(self) -> np.ndarray | None:
+        return self._counts
+
+    @property
+    def bins(self) -> np.ndarray | None:
+        return self._bins
+
+    def cell_index(self, disease_idx, sex_idx, age_idx) -> np.ndarray:
+        """(疾病, 性別, 年齡組) 代碼 → 扁平格子索引；任一代碼為 -1 或格子不存在時為 -1。"""
+        d = np.asarray(disease_idx, dtype=np.int64)
+        s = np.asarray(sex_idx, dtype=np.int64)
+        a = np.asarray(age_idx, dtype=np.int64)
+        _, n_sex, n_age, _ = self.values.shape
+        ok = (d >= 0) & (s >= 0) & (a >= 0)
+        cell = np.where(ok, (d * n_sex + s) * n_age + a, 0)
+        return np.where(ok & self.present.ravel()[cell], cell, -1)
+
+    def rank(self, lp, cell) -> tuple[np.ndarray, np.ndarray]:
+        """
+        calculate_percentile_rank 的向量版本：lp 與 cell 為同形狀陣列。
+        回傳 (內插百分位, 所在百分位門檻)，皆為 int64（門檻的百分位非整數時四捨五入）；cell < 0 的位置為 -1。
+        - 找第一個 lp <= 門檻的位置；高於最後一個門檻則取最後一個門檻的百分位（100）
+        - 與前一門檻不同時做線性內插並四捨五入；門檻相同或位於第一格則取門檻值
+        """
+        lp = np.asarray(lp, dtype=np.float64)
+        cell = np.asarray(cell, dtype=np.int64)
+        k = len(self._pv)
+        valid = cell >= 0
+        c = np.where(valid, cell, 0)
+
+        i = self._count_below(lp, c)
+        above = i >= k
+        i = np.minimum(i, k - 1)
+        exact = self._pv[i]
+        prev = np.maximum(i - 1, 0)
+        lo = self._flat[c * k + prev]
+        hi = self._flat[c * k + i]
+        interp = (i > 0) & (hi != lo) & ~above
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ratio = (lp - lo) / (hi - lo)
+            pct = np.where(interp, np.round(self._pv[prev] + ratio * (exact - self._pv[prev])), exact)
+
+        pct = np.where(valid, pct, -1).astype(np.int64)
+        exact = np.where(valid, np.round(exact), -1).astype(np.int64)
+        return pct, exact
+
+    def rank_one(self, lp: float, disease: str, gender: str, age_group: str) -> tuple[int | None, int | None]:
+        """單一 LP 的百分位；找不到組別時回傳 (None, None)。"""
+        cell = self.cell_index(
+            self.disease_index.get(disease, -1),
+            self.sex_index.get(gender, -1),
+            self.age_group_index.get(age_group, -1),
+        )
+        pct, exact = self.rank(np.array([lp]), np.array([cell]))
+        if pct[0] < 0:
+            return None, None
+        return int(pct[0]), int(exact[0])
+
+
+def compile_percentiles(percentile_df: pd.DataFrame) -> PercentileTable:
+    """
+    把 load_percentile_data() 的長表編譯成 PercentileTable；百分位欄為表中所有「N%」欄。
+    同一 (Disease, Gender, AGE) 重複出現時取第一筆；性別或年齡組無法辨識的列略過。
+    """
+    df = percentile_df.drop_duplicates(["Disease", "Gender", "AGE"], keep="first")
+    diseases = list(dict.fromkeys(df["Disease"]))
+    d_idx = pd.Index(diseases).get_indexer(df["Disease"])
+    s_idx = pd.Index(SEX_LABELS).get_indexer(df["Gender"])
+    a_idx = pd.Index(AGE_GROUP_LABELS).get_indexer(df["AGE"])
+    ok = (s_idx >= 0) & (a_idx >= 0)
+
+    columns, grid = percentile_columns(df.columns)
+    k = len(columns)
+    thresholds = df[columns].to_numpy(dtype=np.float64)[ok]
+    if np.isnan(thresholds).any():
+        raise ValueError("百分位檔中出現非數值/缺失的門檻，請檢查資料。")
+    if (np.diff(thresholds, axis=1) < 0).any():
+        bad = df.loc[ok].loc[(np.diff(thresholds, axis=1) < 0).any(axis=1), ["Disease", "Gender", "AGE"]]
+        raise ValueError(f"百分位門檻必須遞增：{bad.head(3).to_dict('records')}")
+
+    values = np.full((len(diseases), len(SEX_LABELS), len(AGE_GROUP_LABELS), k), np.nan)
+    present = np.zeros(values.shape[:3], dtype=bool)
+    values[d_idx[ok], s_idx[ok], a_idx[ok]] = thresholds
+    present[d_idx[ok], s_idx[ok], a_idx[ok]] = True
+    return PercentileTable(diseases, values, present, grid=grid)
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""
+由世代資料重建百分位表（與 percentiles_YYMMDD.csv 相同格式）：
+
+    python -m hrrisk build-percentiles cohort.parquet model/percentiles/percentiles_251017.csv --workers 0
+
+以目前 manifest 的係數與共變數 schema 計算每人每個疾病的 LP（DesignBuilder.predict，與評分的加總順序相同，
+門檻與評分時比較的 LP 逐位元一致），依 (疾病, SEX, AGE 組) 分格，
+求 PERCENTILE_VALUES（1%、3%…100%）的精確分位數（同 np.quantile 預設的 linear 內插），
+寫成 Tab 分隔的 Disease / SEX / AGE / 1%…100% 表，並把 manifest.json 的 pct_path 指到新檔。
+--knots 1000 則改為 0%、0.1%…100% 共 1001 欄的高解析度 CDF 表（見 hrrisk.percentiles）。
+
+不需把上千萬人的 LP 留在記憶體：整數年齡 20–90 且選項都可辨識的列，LP 只由全組合查表的鍵決定
+（見 hrrisk.lookup，預設 25,560 種），逐塊只累計每個鍵的人數（np.bincount）；
+其餘的列（非整數年齡、schema 另有連續共變數）才保留 LP 值；選項無法辨識的列同 score_batch 不計入。
+各塊在多個行程平行處理，最後依疾病以執行緒平行求分位數（帶權重的排序，結果與逐人展開後相同）。
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+
+from .categories import AGE_GROUP_BANDS
+from .engine import compile_coefficients
+from .loaders import DISEASE_MAP, PERCENTILE_COLUMNS, PERCENTILE_VALUES, load_model_coefficients, percentile_grid
+from .lookup import key_grid, key_layout, pack_keys
+from .parallel import map_chunks_parallel
+from .percentiles import AGE_GROUP_LABELS, SEX_LABELS
+from .schema import load_schema
+from .scoring import sex_code_map
+
+# 寫檔時 SEX 欄的代碼（同原檔：1 = Male、2 = Female）
+SEX_CODES = (1, 2)
+
+
+class CohortAccumulator:
+    """
+    逐塊累計世代資料（交給 worker 的唯讀狀態）。
+    - key_lp：(n_keys, n_diseases)，每個查表鍵的 LP；schema 無法列舉時為 None
+    - key_cell：每個鍵所在的格子（sex * n_age_groups + age_group）
+    partial(chunk) 回傳 (各鍵人數, 表外列的 LP, 表外列的格子)。
+    """
+
+    def __init__(self, manifest: dict):
+        compiled = compile_coefficients(load_model_coefficients(manifest=manifest))
+        schema = load_schema(manifest)
+        self.diseases = compiled.diseases
+        self.design = schema.compile(compiled)
+        self.coef = compiled.coef
+        self._sex_of = sex_code_map(schema)
+        try:
+            self.inputs, self.key_shape = key_layout(schema)
+        except ValueError:
+            self.inputs, self.key_shape = None, None
+            self.key_lp = self.key_cell = None
+            return
+        codes = key_grid(self.inputs, self.key_shape)
+        self.key_lp = self.design.predict(self.coef, codes)
+        self.key_cell = self.cells(codes["age"], self._sex_of[codes["gender"]])
+
+    @property
+    def n_cells(self) -> int:
+        return len(SEX_LABELS) * len(AGE_GROUP_LABELS)
+
+    def cells(self, age: np.ndarray, sex_code: np.ndarray) -> np.ndarray:
+        """(年齡, 性別代碼) → 格子；性別無法對應或年齡缺值為 -1。"""
+        age_code = AGE_GROUP_BANDS.codes(age)
+        ok = (sex_code >= 0) & ~np.isnan(age)
+        return np.where(ok, sex_code * len(AGE_GROUP_LABELS) + age_code, -1)
+
+    def partial(self, chunk: pd.DataFrame) -> tuple[np.ndarray | None, np.ndarray, np.ndarray]:
+        codes = self.design.codes(chunk)
+        age = np.asarray(codes["age"], dtype=np.float64)
+        sex = self._sex_of[codes["gender"]] if "gender" in codes else np.full(len(age), -1)
+        counts = None
+        rest = np.ones(len(age), dtype=bool)
+        if self.key_lp is not None:
+            key = pack_keys(age, codes, self.inputs, self.key_shape)
+            rest = key < 0
+            counts = np.bincount(key[~rest], minlength=len(self.key_lp))
+        cell = self.cells(age[rest], sex[rest])
+        placed = (cell >= 0) & ~self.design.unknown(codes)[rest]
+        rows = np.flatnonzero(rest)[placed]
+        lp = self.design.predict(self.coef, {k: c[rows] for k, c in codes.items()})
+        return counts, lp, cell[placed]
+
+
+def _partial(chunk: pd.DataFrame, acc: CohortAccumulator):
+    return acc.partial(chunk)
+
+
+def weighted_quantiles(values: np.ndarray, weights: np.ndarray, probs: np.ndarray) -> np.ndarray:
+    """
+    帶整數權重（人數）的分位數，等同 np.quantile(np.repeat(values, weights), probs)（linear 內插），
+    但只排序不重複的值。
+    """
+    order = np.argsort(values, kind="stable")
+    v = values[order]
+    cum = np.cumsum(weights[order])
+    n = cum[-1]
+    # 與 numpy 相同的虛擬索引與內插公式，結果逐位元一致
+    h = (n - 1) * probs
+    lo = np.floor(h)
+    gamma = h - lo
+    lo = lo.astype(np.int64)
+    hi = np.minimum(lo + 1, n - 1)
+    a = v[np.searchsorted(cum, lo, side="right")]
+    b = v[np.searchsorted(cum, hi, side="right")]
+    diff = b - a
+    out = a + diff * gamma
+    return np.where(gamma >= 0.5, b - diff * (1 - gamma), out)
+
+
+def build_percentiles(chunks: Iterable[pd.DataFrame], manifest: dict, workers: int = 1,
+                      knots: int | None = None) -> pd.DataFrame:
+    """
+    讀完 chunks 後回傳百分位長表（欄位同原檔：Disease, SEX, AGE, 1%…100%）。
+    knots 給定時改為 0%…100% 等距的 knots + 1 欄（percentile_grid）。
+    疾病順序同係數表，沒有任何人的格子不輸出。
+    """
+    columns, grid = (PERCENTILE_COLUMNS, np.asarray(PERCENTILE_VALUES, dtype=np.float64)) if knots is None \
+        else percentile_grid(knots)
+    acc = CohortAccumulator(manifest)
+    if workers > 1:
+        parts = map_chunks_parallel(chunks, acc, workers, _partial)
+    else:
+        parts = (acc.partial(chunk) for chunk in chunks)
+
+    counts = np.zeros(len(acc.key_lp), dtype=np.int64) if acc.key_lp is not None else None
+    extra_lp, extra_cell = [], []
+    for c, lp, cell in parts:
+        if counts is not None:
+            counts += c
+        if len(cell):
+            extra_lp.append(lp)
+            extra_cell.append(cell)
+    n_d = len(acc.diseases)
+    extra_lp = np.concatenate(extra_lp) if extra_lp else np.empty((0, n_d))
+    extra_cell = np.concatenate(extra_cell) if extra_cell else np.empty(0, dtype=np.int64)
+
+    # 每格：有人的鍵、表外的列
+    groups = []
+    for cell in range(acc.n_cells):
+        keys = (np.flatnonzero((acc.key_cell == cell) & (counts > 0)) if counts is not None
+                else np.empty(0, dtype=np.int64))
+        rows = np.flatnonzero(extra_cell == cell)
+        if len(keys) or len(rows):
+            weights = np.concatenate([counts[keys] if counts is not None else [], np.ones(len(rows))])
+            groups.append((cell, keys, rows, weights.astype(np.int64)))
+    probs = grid / 100
+
+    def one_disease(d: int) -> list[np.ndarray]:
+        out = []
+        for _, keys, rows, weights in groups:
+            values = np.concatenate([acc.key_lp[keys, d] if len(keys) else [], extra_lp[rows, d]])
+            out.append(weighted_quantiles(values, weights, probs))
+        return out
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        per_disease = list(pool.map(one_disease, range(n_d)))
+
+    codes = {name: code for code, name in DISEASE_MAP.items()}
+    n_age = len(AGE_GROUP_LABELS)
+    records = []
+    for d, disease in enumerate(acc.diseases):
+        for (cell, *_), q in zip(groups, per_disease[d]):
+            records.append([codes.get(disease, disease), SEX_CODES[cell // n_age], AGE_GROUP_LABELS[cell % n_age],
+                            *q])
+    return pd.DataFrame(records, columns=["Disease", "SEX", "AGE", *columns])
+
+
+def write_percentiles(df: pd.DataFrame, path: str | Path, decimals: int = 3) -> Path:
+    """寫成 Tab 分隔檔（同原檔，分位數取 decimals 位小數）。先寫暫存檔再改名，讀取端不會讀到一半。"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    df.to_csv(tmp, sep="\t", index=False, float_format=f"%.{decimals}f", lineterminator="\n")
+    os.replace(tmp, path)
+    return path
+
+
+def point_manifest(manifest_path: str | Path, pct_file: str | Path) -> str:
+    """
+    把 manifest.json 的 pct_path 改為 pct_file（相對於 manifest 所在資料夾），其餘內容與排版不動。
+    整檔替換（os.replace），模型熱更新的監看執行緒不會讀到寫一半的 manifest。回傳新的 pct_path。
+    """
+    manifest_path = Path(manifest_path)
+    rel = Path(os.path.relpath(Path(pct_file).resolve(), manifest_path.resolve().parent)).as_posix()
+    text = manifest_path.read_text(encoding="utf-8")
+    pattern = re.compile(r'("pct_path"\s*:\s*)"(?:[^"\\]|\\.)*"')
+    if pattern.search(text):
+        text = pattern.sub(lambda m: m.group(1) + json.dumps(rel, ensure_ascii=False), text, count=1)
+    else:
+        data = json.loads(text)
+        data["pct_path"] = rel
+        text = json.dumps(data, ensure_ascii=False, indent=2) + "\n"
+    tmp = manifest_path.with_name(manifest_path.name + ".tmp")
+    tmp.write_text(text, encoding="utf-8")
+    os.replace(tmp, manifest_path)
+    return rel
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+"""
+行程層級的模型註冊表：manifest 只讀一次，編譯好的模型以「模型檔內容雜湊」為版本鍵快取，
+並監看 manifest 與係數/百分位/baseline 檔，內容改變時在背景建好新版本後一次換上，不需重啟服務。
+
+    registry = get_registry()
+    version = registry.current()      # 一次請求內固定使用同一個版本
+    score_profile(version.model, profile)
+
+換版是單一參照的指派：正在處理的請求繼續用手上的舊版本，之後的請求拿到新版本。
+新檔案讀取或編譯失敗（例如檔案還沒寫完）時保留舊版本，記在 last_error，檔案再變動時重試。
+全組合查表（lookup=True）在監看執行緒內建好才換版；在建構或請求中的檢查建出的版本則先以即時計算
+提供，查表由背景執行緒載入或重建後再啟用（version.lookup_ready），不佔用請求的時間。
+"""
+
+from __future__ import annotations
+
+import hashlib
+import threading
+import time
+from pathlib import Path
+from typing import Iterable
+
+from .loaders import find_manifest, load_manifest, model_files
+from .lookup import load_or_build_lookup
+from .metrics import stage
+from .scoring import ScoringModel, load_scoring_model
+
+
+DEFAULT_CHECK_INTERVAL = 2.0
+
+# 保留的舊版本數（檔案改回前一版時直接沿用，不重新編譯）
+DEFAULT_KEEP_VERSIONS = 2
+
+
+def _stat_signature(paths: Iterable[Path]) -> tuple:
+    """檔案的 (路徑, mtime_ns, 大小)；不存在的檔案記為 None。只用來判斷「可能變了」。"""
+    sig = []
+    for p in paths:
+        try:
+            st = p.stat()
+            sig.append((str(p), st.st_mtime_ns, st.st_size))
+        except OSError:
+            sig.append((str(p), None, None))
+    return tuple(sig)
+
+
+def content_digest(paths: Iterable[Path]) -> str:
+    """依序串接各檔內容的 SHA-256，作為模型版本鍵。"""
+    h = hashlib.sha256()
+    for p in paths:
+        h.update(p.name.encode("utf-8") + b"\0")
+        h.update(p.read_bytes())
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+class ModelVersion:
+    """一個已載入的模型版本：manifest、編譯好的 ScoringModel、內容雜湊與來源檔案。"""
+
+    def __init__(self, digest: str, manifest: dict, model: ScoringModel, files: dict[str, Path]):
+        self.digest = digest
+        self.manifest = manifest
+        self.model = model
+        self.files = files
+        self.loaded_at = time.time()
+        # 查表已啟用（或確定不用）時設定；查表失敗的例外記在 lookup_error，評分照常即時計算
+        self.lookup_ready = threading.Event()
+        self.lookup_error: Exception | None = None
+
+    @property
+    def version(self) -> str:
+        """短版本代碼（內容雜湊前 12 碼）。"""
+        return self.digest[:12]
+
+    def __repr__(self) -> str:
+        return f"ModelVersion({self.version}, diseases={len(self.model.diseases)})"
+
+
+class ModelRegistry:
+    """
+    manifest 與模型檔的單一來源。
+    - current()：回傳目前版本；距上次檢查超過 check_interval 秒時順便檢查檔案（只 stat，變了才讀檔雜湊）
+    - refresh()：立即檢查，內容改變則建新版本並換上；回傳是否換版
+    - watch()：啟動背景執行緒定期 refresh，請求路徑完全不碰檔案系統
+    lookup=True 時每個版本都啟用全組合查表（manifest 的 lookup_path，過期則重建），建表不在請求路徑上。
+    """
+
+    def __init__(self, manifest_path: str | Path | None = None, candidates: Iterable[Path] | None = None,
+                 check_interval: float | None = DEFAULT_CHECK_INTERVAL, lookup: bool = True,
+                 keep_versions: int = DEFAULT_KEEP_VERSIONS):
+        self.manifest_path = find_manifest(manifest_path, candidates).resolve()
+        self.check_interval = check_interval
+        self.lookup = lookup
+        self.keep_versions = max(1, keep_versions)
+        self.last_error: Exception | None = None
+        self.swaps = 0
+
+        self._lock = threading.Lock()
+        self._versions: dict[str, ModelVersion] = {}
+        self._current: ModelVersion | None = None
+        self._signature: tuple | None = None
+        self._checked_at = 0.0
+        self._watcher: threading.Thread | None = None
+        self._stop = threading.Event()
+
+        self.refresh()
+        if self.last_error is not None:
+            raise self.last_error
+
+    # ---- 讀取 ----
+    def current(self) -> ModelVersion:
+        if self.check_interval is not None and self._watcher is None:
+            now = time.monotonic()
+            if now - self._checked_at >= self.check_interval:
+                self.refresh(blocking=False)
+        return self._current
+
+    @property
+    def model(self) -> ScoringModel:
+        return self.current().model
+
+    @property
+    def manifest(self) -> dict:
+        return self.current().manifest
+
+    @property
+    def version(self) -> str:
+        return self.current().version
+
+    # ---- 檢查與換版 ----
+    def _watched_paths(self, manifest: dict | None) -> list[Path]:
+        paths = [self.manifest_path]
+        if manifest is not None:
+            paths += list(model_files(manifest).values())
+        return paths
+
+    def refresh(self, blocking: bool = True) -> bool:
+        """
+        檢查 manifest 與模型檔；內容有變就載入新版本並換上，回傳是否換版。
+        blocking=False 時若已有其他執行緒在檢查，直接返回 False。
+        """
+        if not self._lock.acquire(blocking=blocking):
+            return False
+        try:
+            self._checked_at = time.monotonic()
+            current = self._current
+            signature = _stat_signature(self._watched_paths(current.manifest if current else None))
+            if current is not None and signature == self._signature:
+                return False
+
+            try:
+                with stage("load_manifest"):
+                    manifest = load_manifest(self.manifest_path)
+                files = model_files(manifest)
+                # 先 stat 再讀內容：讀檔期間若又被改寫，下次檢查的 stat 會不同而再讀一次
+                signature = _stat_signature(self._watched_paths(manifest))
+                digest = content_digest([self.manifest_path, *files.values()])
+                version = self._versions.get(digest)
+                if version is None:
+                    with stage("build_model"):
+                        version = self._build(digest, manifest, files)
+            except Exception as e:  # 檔案寫到一半、格式錯誤等：保留舊版本
+                self.last_error = e
+                self._signature = signature
+                return False
+
+            self.last_error = None
+            self._signature = signature
+            self._versions.pop(digest, None)
+            self._versions[digest] = version
+            while len(self._versions) > self.keep_versions:
+                self._versions.pop(next(iter(self._versions)))
+            if current is version:
+                return False
+            self._current = version
+            if current is not None:
+                self.swaps += 1
+            return True
+        finally:
+            self._lock.release()
+
+    def _build(self, digest: str, manifest: dict, files: dict[str, Path]) -> ModelVersion:
+        version = ModelVersion(digest, manifest, load_scoring_model(manifest=manifest), files)
+        if not self.lookup:
+            version.lookup_ready.set()
+        elif self._watcher is not None and threading.current_thread() is self._watcher:
+            self._attach_lookup(version)
+        else:
+            threading.Thread(target=self._attach_lookup, args=(version,),
+                             name=f"hrrisk-lookup-{version.version}", daemon=True).start()
+        return version
+
+    @staticmethod
+    def _attach_lookup(version: ModelVersion) -> None:
+        """載入 manifest 的 lookup_path（過期則重建）並啟用；model.lookup 是單一參照，評分中途換上也安全。"""
+        manifest = version.manifest
+        lookup_path = manifest["_base_dir"] / manifest["lookup_path"] if manifest.get("lookup_path") else None
+        try:
+            with stage("load_lookup"):
+                version.model.use_lookup(load_or_build_lookup(version.model, lookup_path))
+        except ValueError:
+            pass  # schema 有 age 以外的連續共變數，無法列舉組合：一律即時計算
+        except Exception as e:  # 寫不進去、記憶體不足等：不影響這個版本，只是不查表
+            version.lookup_error = e
+        finally:
+            version.lookup_ready.set()
+
+    # ---- 背景監看 ----
+    @property
+    def watching(self) -> bool:
+        return self._watcher is not None
+
+    def watch(self, interval: float | None = None) -> None:
+        """啟動背景監看執行緒（daemon）；重複呼叫無作用。"""
+        if self._watcher is not None:
+            return
+        interval = interval or self.check_interval or DEFAULT_CHECK_INTERVAL
+        self._stop.clear()
+
+        def _run() -> None:
+            while not self._stop.wait(interval):
+                self.refresh()
+
+        self._watcher = threading.Thread(target=_run, name="hrrisk-model-watcher", daemon=True)
+        self._watcher.start()
+
+    def stop(self) -> None:
+        if self._watcher is not None:
+            self._stop.set()
+            self._watcher.join()
+            self._watcher = None
+
+
+_REGISTRIES: dict[Path, ModelRegistry] = {}
+_REGISTRIES_LOCK = threading.Lock()
+
+
+def get_registry(manifest_path: str | Path | None = None, candidates: Iterable[Path] | None = None,
+                 **kwargs) -> ModelRegistry:
+    """行程內共用的 ModelRegistry（每個 manifest 一個）；kwargs 只在第一次建立時生效。"""
+    path = find_manifest(manifest_path, candidates).resolve()
+    registry = _REGISTRIES.get(path)
+    if registry is None:
+        with _REGISTRIES_LOCK:
+            registry = _REGISTRIES.get(path)
+            if registry is None:
+                registry = _REGISTRIES[path] = ModelRegistry(path, **kwargs)
+    return registry
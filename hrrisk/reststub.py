@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+本機的 Supabase REST（PostgREST）替身，用來在不連網的情況下測試寫入路徑：
+
+    with StubRestServer(fail_first=3) as server:
+        writer = BackgroundWriter(RestSink(server.url, "test-key"))
+        ...
+        server.rows("risk_events")
+
+只實作 POST /rest/v1/<table>（JSON 陣列或單一物件），收到的資料依到達順序記在 inserts。
+可模擬前 N 次失敗（status）、固定延遲（delay），以及 reject(table, row) 為真時整批回 400
+（PostgREST 的 bulk insert 為單一交易，一列有錯整批都不寫入）。
+連線層可模擬寫入後不回應就斷線（drop_first，回應遺失），以及回應後不告知就關閉連線
+（idle_close，等同 keep-alive 逾時）。
+"""
+
+from __future__ import annotations
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+
+
+class StubRestServer:
+    def __init__(self, fail_first: int = 0, status: int = 503, delay: float = 0.0,
+                 api_key: str | None = None, reject: Callable[[str, dict], bool] | None = None,
+                 drop_first: int = 0, idle_close: bool = False, host: str = "127.0.0.1", port: int = 0):
+        self.fail_first = fail_first
+        self.drop_first = drop_first
+        self.idle_close = idle_close
+        self.reject = reject
+        self.status = status
+        self.delay = delay
+        self.api_key = api_key
+        self.requests = 0
+        self.inserts: list[tuple[str, list[dict]]] = []
+        self._lock = threading.Lock()
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):  # 不輸出存取紀錄
+                pass
+
+            def _reply(self, status: int, body: bytes = b"") -> None:
+                self.send_response(status)
+                self.send_header("Content-Length", str(len(body)))
+                if body:
+                    self.send_header("Content-Type", "application/json")
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                payload = self.rfile.read(length)
+                with stub._lock:
+                    stub.requests += 1
+                    failing = stub.fail_first > 0
+                    if failing:
+                        stub.fail_first -= 1
+                if stub.delay:
+                    time.sleep(stub.delay)
+                if not self.path.startswith("/rest/v1/"):
+                    return self._reply(404, b'{"message": "not found"}')
+                if stub.api_key is not None and self.headers.get("apikey") != stub.api_key:
+                    return self._reply(401, b'{"message": "invalid api key"}')
+                if failing:
+                    return self._reply(stub.status, b'{"message": "stub failure"}')
+                try:
+                    rows = json.loads(payload or b"[]")
+                except ValueError:
+                    return self._reply(400, b'{"message": "invalid json"}')
+                if isinstance(rows, dict):
+                    rows = [rows]
+                table = self.path[len("/rest/v1/"):].split("?", 1)[0]
+                if stub.reject is not None and any(stub.reject(table, r) for r in rows):
+                    return self._reply(400, b'{"message": "rejected row"}')
+                with stub._lock:
+                    stub.inserts.append((table, rows))
+                    dropping = stub.drop_first > 0
+                    if dropping:
+                        stub.drop_first -= 1
+                if dropping:
+                    self.close_connection = True
+                    return
+                self._reply(201)
+                if stub.idle_close:
+                    self.close_connection = True
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def rows(self, table: str) -> list[dict]:
+        """某資料表收到的所有列（依到達順序）。"""
+        with self._lock:
+            return [r for t, rows in self.inserts if t == table for r in rows]
+
+    def start(self) -> "StubRestServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="hrrisk-rest-stub", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "StubRestServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
@@ -0,0 +1,351 @@
+# -*- coding: utf-8 -*-
+"""
+共變數 schema：宣告每個輸入欄位如何變成設計矩陣的欄位，取代程式中寫死的變數名稱與中文選項對照。
+manifest.json 的 "covariates" 可覆寫預設值（預設即目前係數檔使用的六個輸入）：
+
+    "covariates": [
+      {"name": "age", "type": "continuous", "variable": "AGE"},
+      {"name": "gender", "type": "categorical", "levels": {"Male": "MALE", "Female": "FEMALE"},
+       "reference": "MALE", "aliases": {"1": "Male", "2": "Female"}},
+      {"name": "current_hr", "type": "banded", "bands": "current_hr", "reference": "HR_cat60-69"},
+      {"name": "smoking_status", "type": "categorical",
+       "levels": {"從未吸菸": "Never_smoke", "曾經吸菸": "Ever_smoke", "目前吸菸": "Now_smoke"},
+       "reference": "Never_smoke"},
+      ...
+    ]
+
+- continuous：數值直接填入 variable 欄。
+- categorical：levels 為「輸入（畫面上的選項）→ 係數表變數」，依序編為代碼 0..k-1；aliases 為其他寫法。
+  輸入先去除前後空白，整數值的浮點數（CSV 讀成 1.0 的 gender）視為整數；無法辨識的選項
+  單人評分時 ValueError，批次的代碼為 -1（score_batch 該列結果為缺值），不當作參考組計算。
+- banded：數值依 cuts 左閉右開分組（同 hrrisk.categories.Bands），levels 為各組的變數名稱；
+  "bands" 可改為引用 hrrisk.categories.BANDS 中的分組（current_hr / bmi），切點只定義在一處。
+- reference：參考組（係數表中為 REF，係數必須為 0）。
+
+CovariateSchema.compile(compiled) 產生 DesignBuilder：每個代碼對應的欄位索引預先算好，
+整批（matrix / predict）與單人（vector / predict_one）都只做索引填值。
+係數表出現 schema 未宣告的變數時 ValueError，新增共變數只需在係數檔與 manifest 加上定義，不必改程式。
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+from typing import Iterable, Mapping, Sequence
+
+import numpy as np
+import pandas as pd
+
+from .categories import BANDS, Bands
+from .engine import DRINKING_VARIABLES, GENDER_VARIABLES, SMOKING_VARIABLES, CompiledModel
+
+COVARIATE_TYPES = ("continuous", "categorical", "banded")
+
+
+class Covariate:
+    """一個輸入欄位。variables 為它可能填入的設計變數（categorical/banded 依代碼順序）。"""
+
+    type = ""
+
+    def __init__(self, name: str, variables: Sequence[str], reference: str | None = None):
+        self.name = name
+        self.variables = tuple(variables)
+        if reference is not None and reference not in self.variables:
+            raise ValueError(f"共變數 {name}：reference {reference!r} 不在 levels 中")
+        self.reference = reference
+
+    def codes(self, values) -> np.ndarray:
+        raise NotImplementedError
+
+    def code(self, value):
+        raise NotImplementedError
+
+    def spec(self) -> dict:
+        raise NotImplementedError
+
+
+class ContinuousCovariate(Covariate):
+    type = "continuous"
+
+    def __init__(self, name: str, variable: str):
+        super().__init__(name, [variable])
+        self.variable = variable
+
+    def codes(self, values) -> np.ndarray:
+        return np.asarray(values, dtype=np.float64)
+
+    def code(self, value) -> float:
+        return float(value)
+
+    def spec(self) -> dict:
+        return {"name": self.name, "type": self.type, "variable": self.variable}
+
+
+def _level_key(value) -> str:
+    """類別輸入 → 對照用的字串：去除前後空白，整數值的浮點數視為整數（1.0 → "1"）。"""
+    if isinstance(value, (float, np.floating)) and float(value).is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+class CategoricalCovariate(Covariate):
+    """文字選項 → 代碼（levels 的位置）。單一輸入無法辨識時 ValueError，整批則為 -1。"""
+
+    type = "categorical"
+
+    def __init__(self, name: str, levels: Mapping[str, str], reference: str | None = None,
+                 aliases: Mapping[str, str] | None = None):
+        super().__init__(name, list(levels.values()), reference)
+        self.levels = dict(levels)
+        self.labels = tuple(self.levels)
+        self.aliases = dict(aliases or {})
+        self._index = {label: i for i, label in enumerate(self.labels)}
+        for alias, label in self.aliases.items():
+            if label not in self._index:
+                raise ValueError(f"共變數 {name}：alias {alias!r} 指向不存在的選項 {label!r}")
+            self._index.setdefault(alias, self._index[label])
+
+    @property
+    def choices(self) -> tuple[str, ...]:
+        """可接受的輸入（選項與 aliases）。"""
+        return tuple(self._index)
+
+    def codes(self, values) -> np.ndarray:
+        # 先對「不重複值」做對照再展開，N 很大時也只比對少數幾個字串
+        cat = pd.Categorical(np.asarray(values))
+        mapped = [self._index.get(_level_key(c), -1) for c in cat.categories]
+        mapped.append(-1)  # cat.codes == -1（缺值）
+        return np.asarray(mapped, dtype=np.int64)[cat.codes]
+
+    def code(self, value) -> int:
+        code = self._index.get(_level_key(value))
+        if code is None:
+            raise ValueError(f"共變數 {self.name}：無法辨識的選項 {value!r}（可用 {list(self.choices)}）")
+        return code
+
+    def spec(self) -> dict:
+        out = {"name": self.name, "type": self.type, "levels": self.levels, "reference": self.reference}
+        if self.aliases:
+            out["aliases"] = self.aliases
+        return out
+
+
+class BandedCovariate(Covariate):
+    """數值依切點分組，代碼為組別位置（NaN 落在最後一組）。"""
+
+    type = "banded"
+
+    def __init__(self, name: str, cuts: Sequence[float], levels: Sequence[str], reference: str | None = None):
+        self.bands = Bands(name, cuts, levels)
+        super().__init__(name, self.bands.labels, reference)
+
+    def codes(self, values) -> np.ndarray:
+        return self.bands.codes(values)
+
+    def code(self, value) -> int:
+        return self.bands.code(float(value))
+
+    def spec(self) -> dict:
+        return {"name": self.name, "type": self.type, "cuts": list(self.bands.cuts),
+                "levels": list(self.bands.labels), "reference": self.reference}
+
+
+def covariate_from_spec(spec: Mapping) -> Covariate:
+    kind = spec.get("type")
+    name = spec.get("name")
+    if not name or kind not in COVARIATE_TYPES:
+        raise ValueError(f"共變數定義需有 name 與 type（{'/'.join(COVARIATE_TYPES)}）：{dict(spec)}")
+    if kind == "continuous":
+        return ContinuousCovariate(name, spec["variable"])
+    if kind == "categorical":
+        return CategoricalCovariate(name, spec["levels"], spec.get("reference"), spec.get("aliases"))
+    if "bands" in spec:
+        if "cuts" in spec or "levels" in spec:
+            raise ValueError(f"共變數 {name}：bands 與 cuts/levels 只能擇一")
+        bands = BANDS.get(spec["bands"])
+        if bands is None:
+            raise ValueError(f"共變數 {name}：未知的分組 {spec['bands']!r}（可用 {list(BANDS)}）")
+        return BandedCovariate(name, bands.cuts, bands.labels, spec.get("reference"))
+    return BandedCovariate(name, spec["cuts"], spec["levels"], spec.get("reference"))
+
+
+class CovariateSchema:
+    """依序排列的共變數；inputs 為輸入欄位名稱。"""
+
+    def __init__(self, covariates: Iterable[Covariate]):
+        self.covariates = tuple(covariates)
+        self.inputs = tuple(c.name for c in self.covariates)
+        if len(set(self.inputs)) != len(self.inputs):
+            raise ValueError(f"共變數名稱重複：{list(self.inputs)}")
+        seen: dict[str, str] = {}
+        for c in self.covariates:
+            for v in c.variables:
+                if v in seen:
+                    raise ValueError(f"變數 {v} 同時屬於 {seen[v]} 與 {c.name}")
+                seen[v] = c.name
+        self.by_name = {c.name: c for c in self.covariates}
+        self.digest = hashlib.sha256(
+            json.dumps(self.spec(), ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+    @classmethod
+    def from_spec(cls, specs: Iterable[Mapping]) -> "CovariateSchema":
+        return cls(covariate_from_spec(s) for s in specs)
+
+    def spec(self) -> list[dict]:
+        return [c.spec() for c in self.covariates]
+
+    @property
+    def categorical(self) -> tuple[Covariate, ...]:
+        """categorical 與 banded 共變數（有限個代碼）。"""
+        return tuple(c for c in self.covariates if c.type != "continuous")
+
+    @property
+    def continuous(self) -> tuple[ContinuousCovariate, ...]:
+        return tuple(c for c in self.covariates if c.type == "continuous")
+
+    def compile(self, compiled: CompiledModel) -> "DesignBuilder":
+        return DesignBuilder(self, compiled)
+
+    def __repr__(self) -> str:
+        return f"CovariateSchema({list(self.inputs)})"
+
+
+class DesignBuilder:
+    """
+    某份係數矩陣專用的設計矩陣產生器（由 CovariateSchema.compile 建立）。
+    係數表中沒有的變數（例如參考組未列出）視為係數 0，直接略過。
+    """
+
+    def __init__(self, schema: CovariateSchema, compiled: CompiledModel):
+        declared = {v for c in schema.covariates for v in c.variables}
+        unknown = [col for col in compiled.columns if col not in declared]
+        if unknown:
+            raise ValueError(f"係數表含 schema 未宣告的變數：{unknown}（請在 manifest 的 covariates 補上）")
+        for c in schema.covariates:
+            j = compiled.column_index.get(c.reference) if c.reference else None
+            if j is not None and np.any(compiled.coef[:, j] != 0):
+                raise ValueError(f"共變數 {c.name} 的參考組 {c.reference} 係數不為 0")
+
+        self.schema = schema
+        self.n_columns = len(compiled.columns)
+        # continuous：(名稱, 欄位)；categorical：(名稱, 代碼 → 欄位，最後一格給代碼 -1)
+        self._continuous = [(c.name, compiled.column_index[c.variable]) for c in schema.continuous
+                            if c.variable in compiled.column_index]
+        self._indicators = [
+            (c.name, np.array([compiled.column_index.get(v, -1) for v in c.variables] + [-1], dtype=np.intp))
+            for c in schema.categorical
+        ]
+        # LP 的累加順序：各共變數依它在係數表中的第一個欄位排序（同一共變數的欄位相鄰時即係數表的欄位順序，
+        # 預設係數檔為心率、年齡、性別、BMI、吸菸、飲酒，與原本逐項相加的順序相同）
+        first = {name: j for name, j in self._continuous}
+        first.update({name: int(columns[columns >= 0].min()) for name, columns in self._indicators
+                      if (columns >= 0).any()})
+        self._terms = sorted(first, key=first.get)
+        self._continuous_columns = dict(self._continuous)
+        self._indicator_columns = dict(self._indicators)
+
+    def codes(self, data) -> dict[str, np.ndarray]:
+        """DataFrame 或 {欄位: 陣列} → 各共變數的代碼（continuous 為數值）。缺欄位時 ValueError。"""
+        out = {}
+        for c in self.schema.covariates:
+            if c.name not in data:
+                raise ValueError(f"批次輸入缺少欄位：{c.name}")
+            out[c.name] = c.codes(np.asarray(data[c.name]))
+        return out
+
+    def unknown(self, codes: Mapping[str, np.ndarray]) -> np.ndarray:
+        """(N,) bool：任一類別輸入無法辨識（代碼 -1）的列。"""
+        n = len(codes[self.schema.inputs[0]])
+        bad = np.zeros(n, dtype=bool)
+        for c in self.schema.covariates:
+            if c.type == "categorical":
+                bad |= codes[c.name] < 0
+        return bad
+
+    def matrix(self, codes: Mapping[str, np.ndarray]) -> np.ndarray:
+        """(N, n_columns) 的設計矩陣：continuous 填數值，其餘為 one-hot（代碼 -1 不加係數）。"""
+        n = len(codes[self.schema.inputs[0]])
+        X = np.zeros((n, self.n_columns), dtype=np.float64)
+        for name, j in self._continuous:
+            X[:, j] = codes[name]
+        rows = np.arange(n)
+        for name, columns in self._indicators:
+            cols = columns[codes[name]]
+            ok = cols >= 0
+            X[rows[ok], cols[ok]] = 1.0
+        return X
+
+    def predict(self, coef: np.ndarray, codes: Mapping[str, np.ndarray]) -> np.ndarray:
+        """
+        (N, n_diseases) 的 LP，coef 為 (n_diseases, n_columns)。不經設計矩陣與矩陣乘法：
+        依固定順序逐個共變數加上它的係數（continuous 乘上數值），與 predict_one 的加總順序相同，
+        整批、單人與查表的 LP 逐位元一致（X @ coef.T 的加總順序依 BLAS 而定，末位可能差一個 ulp，
+        LP 剛好落在百分位門檻上時名次就會不同）。
+        """
+        n = len(codes[self.schema.inputs[0]])
+        table = np.vstack([coef.T, np.zeros(len(coef))])  # 欄位 → 各疾病係數；最後一列給 -1（不加係數）
+        LP = np.zeros((n, len(coef)), dtype=np.float64)
+        for name in self._terms:
+            j = self._continuous_columns.get(name)
+            if j is not None:
+                LP += np.asarray(codes[name], dtype=np.float64)[:, None] * coef[:, j]
+            else:
+                LP += table[self._indicator_columns[name][codes[name]]]
+        return LP
+
+    def predict_one(self, coef: np.ndarray, profile: Mapping) -> np.ndarray:
+        """單人的 (n_diseases,) LP（純量查表），加總順序同 predict；缺輸入時 ValueError。"""
+        by_name = self.schema.by_name
+        missing = [name for name in self.schema.inputs if name not in profile]
+        if missing:
+            raise ValueError(f"缺少輸入：{missing}")
+        columns, values = [], []
+        for name in self._terms:
+            j = self._continuous_columns.get(name)
+            if j is not None:
+                columns.append(j)
+                values.append(by_name[name].code(profile[name]))
+            else:
+                j = self._indicator_columns[name][by_name[name].code(profile[name])]
+                if j >= 0:
+                    columns.append(j)
+                    values.append(1.0)
+        if not columns:
+            return np.zeros(len(coef), dtype=np.float64)
+        # accumulate 由左到右逐項相加（乘 1.0 不改變數值），與 predict 逐個共變數累加的結果相同
+        return np.add.accumulate(coef[:, columns] * values, axis=1)[:, -1]
+
+    def vector(self, profile: Mapping) -> np.ndarray:
+        """單人的設計向量（純量查表，不建陣列）；profile 以輸入欄位名稱為鍵，缺輸入時 ValueError。"""
+        by_name = self.schema.by_name
+        missing = [name for name in self.schema.inputs if name not in profile]
+        if missing:
+            raise ValueError(f"缺少輸入：{missing}")
+        x = np.zeros(self.n_columns, dtype=np.float64)
+        for name, j in self._continuous:
+            x[j] = by_name[name].code(profile[name])
+        for name, columns in self._indicators:
+            j = columns[by_name[name].code(profile[name])]
+            if j >= 0:
+                x[j] = 1.0
+        return x
+
+
+# 預設 schema：目前係數檔（coefficients_250829.csv）使用的輸入
+DEFAULT_COVARIATES = [
+    {"name": "age", "type": "continuous", "variable": "AGE"},
+    {"name": "gender", "type": "categorical", "levels": dict(GENDER_VARIABLES), "reference": "MALE",
+     "aliases": {"1": "Male", "2": "Female"}},
+    {"name": "current_hr", "type": "banded", "bands": "current_hr", "reference": "HR_cat60-69"},
+    {"name": "bmi", "type": "banded", "bands": "bmi", "reference": "bmi_normal"},
+    {"name": "smoking_status", "type": "categorical", "levels": dict(SMOKING_VARIABLES), "reference": "Never_smoke"},
+    {"name": "drinking_status", "type": "categorical", "levels": dict(DRINKING_VARIABLES),
+     "reference": "Never_drink"},
+]
+DEFAULT_SCHEMA = CovariateSchema.from_spec(DEFAULT_COVARIATES)
+
+
+def load_schema(manifest: Mapping | None) -> CovariateSchema:
+    """manifest 的 "covariates"；未宣告時為 DEFAULT_SCHEMA。"""
+    specs = (manifest or {}).get("covariates")
+    return DEFAULT_SCHEMA if specs is None else CovariateSchema.from_spec(specs)
@@ -0,0 +1,423 @@
+# -*- coding: utf-8 -*-
+"""
+評分核心：單人（score_profile）與批次（score_batch）皆算出每個疾病的
+LP、百分位、風險等級與絕對風險。全部以 NumPy 向量運算完成，不依賴 Streamlit。
+"""
+
+from __future__ import annotations
+
+import math
+import weakref
+from pathlib import Path
+from typing import TYPE_CHECKING, Mapping
+
+import numpy as np
+import pandas as pd
+
+from .artifact import ArtifactError, load_artifact
+from .baseline import BaselineHazard, compile_baseline
+from .categories import AGE_GROUP_BANDS
+from .engine import CompiledModel, compile_coefficients
+from .loaders import (
+    horizon_years,
+    load_baseline_hazard,
+    load_manifest,
+    load_model_coefficients,
+    load_percentile_data,
+)
+from .metrics import stage
+from .percentiles import SEX_LABELS, PercentileTable, compile_percentiles
+from .schema import DEFAULT_SCHEMA, CovariateSchema, DesignBuilder, load_schema
+
+if TYPE_CHECKING:
+    from .lookup import LookupTable
+
+
+# 批次輸入欄位（與 Supabase risk_events 的欄位名稱一致）；manifest 宣告 covariates 時以 model.schema.inputs 為準
+INPUT_COLUMNS = DEFAULT_SCHEMA.inputs
+
+# 每個疾病輸出的欄位
+RESULT_FIELDS = ("lp", "percentile", "exact_percentile", "risk_category", "abs_risk")
+
+# 百分位 → 風險等級（由高到低判斷）
+RISK_LEVELS = [
+    (90, "高風險"),
+    (75, "中高風險"),
+    (50, "平均風險"),
+    (0, "低風險"),
+]
+
+# 累積風險曲線的預設年數（risk_curves）
+CURVE_HORIZONS = tuple(float(t) for t in range(1, 11))
+
+
+def result_column(disease: str, field: str) -> str:
+    """score_batch 輸出欄位名稱，例如 'Heart Failure|lp'。"""
+    return f"{disease}|{field}"
+
+
+def lookup_H0(disease: str, t_years: float, baseline_df: pd.DataFrame) -> float | None:
+    """
+    取得指定疾病在 t_years 的 H0(t)。
+    若沒有剛好等於 t_years，退而求其次取 <= t_years 的最大 t_years。
+    每次呼叫都會篩選整張表；大量查詢請用 compile_baseline() 的 BaselineHazard.at。
+    """
+    rows = baseline_df[(baseline_df["Disease"] == disease) & (baseline_df["t_years"] == t_years)]
+    if not rows.empty:
+        return float(rows.iloc[0]["H0"])
+
+    # 取 <= t_years 的最大值（保守做法）
+    subset = baseline_df[(baseline_df["Disease"] == disease) & (baseline_df["t_years"] <= t_years)]
+    if subset.empty:
+        return None
+    subset = subset.sort_values("t_years")
+    return float(subset.iloc[-1]["H0"])
+
+
+def cox_absolute_risk(lp: float, H0: float) -> float:
+    """
+    Cox PH 絕對風險：Risk = 1 - exp( - H0(t) * exp(lp) )
+    回傳 0~1 的機率值
+    """
+    return 1.0 - math.exp(-H0 * math.exp(lp))
+
+
+def absolute_risk(lp, H0) -> np.ndarray:
+    """
+    cox_absolute_risk 的向量版本：lp 與 H0 可互相廣播（例如 (N, 疾病) 的 LP 對 (疾病,) 的 H0，
+    或 (疾病, 1) 的 LP 對 (疾病, 年數) 的 H0 曲線）。以 expm1 計算，H0 很小時也不失精度；H0 為 NaN 處為 NaN。
+    """
+    return -np.expm1(-np.asarray(H0, dtype=np.float64) * np.exp(np.asarray(lp, dtype=np.float64)))
+
+
+class ScoringModel:
+    """
+    一次載入、可重複使用的評分模型：
+    已編譯的係數矩陣、已編譯的百分位張量、已編譯的 baseline 階梯函數（baseline）與各疾病在 horizon 的 H0，
+    以及由共變數 schema 產生的設計矩陣產生器（design）。
+    """
+
+    def __init__(self, compiled: CompiledModel, percentiles: PercentileTable,
+                 baseline_df: pd.DataFrame, horizon: float = 3.0, schema: CovariateSchema | None = None):
+        self.compiled = compiled
+        self.schema = schema or DEFAULT_SCHEMA
+        self.design: DesignBuilder = self.schema.compile(compiled)
+        self._sex_of = sex_code_map(self.schema)
+        self.percentiles = percentiles
+        self.baseline_df = baseline_df
+        self.horizon = float(horizon)
+        # 只評分「係數表與百分位表都有」的疾病（與 app 的 available_diseases 一致）
+        available = set(self.percentiles.diseases)
+        self.diseases = tuple(d for d in compiled.diseases if d in available)
+        self.coef_rows = np.array([compiled.disease_index[d] for d in self.diseases], dtype=np.intp)
+        self.percentile_rows = np.array([self.percentiles.disease_index[d] for d in self.diseases], dtype=np.intp)
+        self.baseline: BaselineHazard = compile_baseline(baseline_df)
+        self.baseline_rows = self.baseline.rows(self.diseases)
+        self.H0 = self.H0_at(self.horizon)
+        # 預先算好的全組合查表（use_lookup 設定）；None 表示一律即時計算
+        self.lookup: LookupTable | None = None
+
+    def H0_at(self, horizon) -> np.ndarray:
+        """
+        各疾病（model.diseases 順序）在 horizon 年的 H0；沒有 baseline 的疾病為 NaN。
+        horizon 為純量時 shape (n_diseases,)，為陣列時 (n_diseases, *horizon.shape)。
+        """
+        horizon = np.asarray(horizon, dtype=np.float64)
+        return self.baseline.at(self.baseline_rows.reshape(-1, *(1,) * horizon.ndim), horizon)
+
+    def sex_codes(self, codes: Mapping[str, np.ndarray]) -> np.ndarray:
+        """design.codes 的結果 → 百分位表的性別代碼（SEX_LABELS 的位置，無法對應為 -1）。"""
+        if "gender" not in codes:
+            return np.full(len(codes[self.schema.inputs[0]]), -1, dtype=np.int64)
+        return self._sex_of[codes["gender"]]
+
+    def sex_code(self, profile: Mapping) -> int:
+        """單人輸入的性別 → 百分位表的性別代碼（同 sex_codes，gender 依 schema 的選項與 aliases 對照）。"""
+        gender = self.schema.by_name.get("gender")
+        if gender is None or "gender" not in profile:
+            return -1
+        return int(self._sex_of[gender.code(profile["gender"])])
+
+    def use_lookup(self, lookup: "LookupTable | None") -> None:
+        """啟用查表模式；表須由同一份模型建立（否則 ValueError）。傳 None 關閉。"""
+        if lookup is not None:
+            lookup.check(self)
+        self.lookup = lookup
+
+
+def sex_code_map(schema: CovariateSchema) -> np.ndarray:
+    """gender 共變數的代碼 → SEX_LABELS 的位置（以 [代碼] 索引）；最後一格給代碼 -1，無法對應為 -1。"""
+    gender = schema.by_name.get("gender")
+    labels = gender.labels if gender is not None and gender.type == "categorical" else ()
+    return np.array([SEX_LABELS.index(g) if g in SEX_LABELS else -1 for g in labels] + [-1], dtype=np.int64)
+
+
+def load_scoring_model(manifest_path: str | Path | None = None, manifest: dict | None = None,
+                       use_artifact: bool = True) -> ScoringModel:
+    """
+    依 manifest.json（或已讀入的 manifest）載入係數、百分位與 baseline hazard，組成 ScoringModel。
+    有最新的 compile-model 產物時直接 mmap 讀取；不存在或過期才解析 CSV。
+    共變數 schema 取自 manifest 的 "covariates"（未宣告時為預設的六個輸入）。
+    各 loader 的耗時記在 hrrisk.metrics（HRRISK_METRICS 開啟時）。
+    """
+    m = manifest
+    if m is None:
+        with stage("load_manifest"):
+            m = load_manifest(manifest_path)
+    schema = load_schema(m)
+    if use_artifact:
+        try:
+            with stage("load_artifact"):
+                parts = load_artifact(m)
+            return ScoringModel(*parts, horizon_years(m), schema)
+        except ArtifactError:
+            pass
+    with stage("load_model_coefficients"):
+        coef_df = load_model_coefficients(manifest=m)
+    with stage("load_percentile_data"):
+        percentile_df = load_percentile_data(manifest=m)
+    with stage("load_baseline_hazard"):
+        baseline_df = load_baseline_hazard(manifest=m)
+    return ScoringModel(
+        compile_coefficients(coef_df),
+        compile_percentiles(percentile_df),
+        baseline_df,
+        horizon_years(m),
+        schema,
+    )
+
+
+def _profile(age, gender, hr, bmi, smoking_status, drinking_status) -> dict:
+    """預設 schema 的六個輸入 → 以共變數名稱為鍵的 dict（同 score_profile 的 profile）。"""
+    return {"age": age, "gender": gender, "current_hr": hr, "bmi": bmi,
+            "smoking_status": smoking_status, "drinking_status": drinking_status}
+
+
+# 未經 ScoringModel 傳入的 CompiledModel → 預設 schema 的 DesignBuilder（每份係數只編譯一次）
+_DEFAULT_DESIGNS: weakref.WeakKeyDictionary[CompiledModel, DesignBuilder] = weakref.WeakKeyDictionary()
+
+
+def _design_of(model: ScoringModel | CompiledModel | pd.DataFrame) -> tuple[CompiledModel, DesignBuilder]:
+    """ScoringModel 直接用它的 design（manifest 的 schema）；CompiledModel 與原始係數表用預設 schema。"""
+    if isinstance(model, ScoringModel):
+        return model.compiled, model.design
+    compiled = model if isinstance(model, CompiledModel) else compile_coefficients(model)
+    design = _DEFAULT_DESIGNS.get(compiled)
+    if design is None:
+        design = _DEFAULT_DESIGNS[compiled] = DEFAULT_SCHEMA.compile(compiled)
+    return compiled, design
+
+
+def design_vector(model: ScoringModel | CompiledModel, age, gender, hr, bmi, smoking_status,
+                  drinking_status) -> np.ndarray:
+    """單人的設計向量（AGE 數值 + 各分組 one-hot），欄位順序同係數表的 columns。model 同 calculate_linear_predictor。"""
+    _, design = _design_of(model)
+    return design.vector(_profile(age, gender, hr, bmi, smoking_status, drinking_status))
+
+
+def calculate_linear_predictor(disease_name, age, gender, hr, bmi, smoking_status, drinking_status,
+                               model: ScoringModel | CompiledModel | pd.DataFrame) -> float | None:
+    """
+    單一疾病的 LP。model 可為 ScoringModel（建議，使用其 manifest 的 schema 與已建好的 design）、
+    CompiledModel（預設 schema）或 load_model_coefficients() 的原始表。
+    疾病不在係數表中時回傳 None；manifest 另有共變數時缺少輸入而 ValueError，請改用 score_profile。
+    """
+    compiled, design = _design_of(model)
+    i = compiled.disease_index.get(disease_name)
+    if i is None:
+        return None
+    profile = _profile(age, gender, hr, bmi, smoking_status, drinking_status)
+    return float(design.predict_one(compiled.coef[i:i + 1], profile)[0])
+
+
+def calculate_percentile_rank(user_lp, disease_name, gender, age_group,
+                              percentiles: PercentileTable | pd.DataFrame) -> tuple[int | None, int | None]:
+    """
+    單一 LP 的 (內插百分位, 所在百分位門檻)；找不到組別時回傳 (None, None)。
+    percentiles 可為 PercentileTable（建議）或 load_percentile_data() 的原始表。
+    """
+    table = percentiles if isinstance(percentiles, PercentileTable) else compile_percentiles(percentiles)
+    return table.rank_one(user_lp, disease_name, gender, age_group)
+
+
+def risk_category_label(percentile: int) -> str:
+    """百分位 → 風險等級文字。"""
+    for cut, label in RISK_LEVELS:
+        if percentile >= cut:
+            return label
+    return RISK_LEVELS[-1][1]
+
+
+def score_profile(model: ScoringModel, profile: Mapping, horizon: float | None = None) -> list[dict]:
+    """
+    單人評分：一次算出所有疾病的 LP（DesignBuilder.predict_one，與批次的加總順序相同），
+    再一次 searchsorted 算出百分位。
+    profile 以共變數名稱為鍵（model.schema.inputs，預設為 INPUT_COLUMNS），其他鍵不使用；
+    manifest 增減共變數時呼叫端照 schema 給值即可。缺輸入時 ValueError。
+    horizon 為絕對風險的年數，預設為模型的 horizon（manifest 的 baseline_horizon_years）。
+    模型啟用查表模式（model.use_lookup）且該組合在表內時，直接讀表中的一列。
+    回傳每個疾病一個 dict（disease, lp, percentile, exact_percentile, risk_category,
+    H0, abs_risk_years, abs_risk）；找不到百分位組別的疾病略過，沒有 H0 時 abs_risk 為 None。
+    """
+    lookup = model.lookup
+    row = lookup.profile(model.schema, profile) if lookup is not None else None
+    if row is not None:
+        lps, pct, exact, abs_risk = row
+    else:
+        lps = model.design.predict_one(model.compiled.coef[model.coef_rows], profile)
+
+        table = model.percentiles
+        cell = table.cell_index(
+            model.percentile_rows,
+            model.sex_code(profile),
+            AGE_GROUP_BANDS.code(_age(profile)),
+        )
+        pct, exact = table.rank(lps, cell)
+        abs_risk = absolute_risk(lps, model.H0)
+
+    H0 = model.H0
+    if horizon is None:
+        horizon = model.horizon
+    elif float(horizon) != model.horizon:
+        horizon = float(horizon)
+        H0 = model.H0_at(horizon)
+        abs_risk = absolute_risk(lps, H0)
+
+    results = []
+    for k, disease in enumerate(model.diseases):
+        if pct[k] < 0:
+            continue
+        has_h0 = not np.isnan(H0[k])
+        results.append({
+            'disease': disease,
+            'lp': float(lps[k]),
+            'percentile': int(pct[k]),
+            'exact_percentile': int(exact[k]),
+            'risk_category': risk_category_label(int(pct[k])),
+            'H0': float(H0[k]) if has_h0 else None,
+            'abs_risk_years': horizon,
+            'abs_risk': float(abs_risk[k]) if has_h0 else None,
+        })
+    return results
+
+
+def risk_curves(model: ScoringModel, profile: Mapping, horizons=CURVE_HORIZONS) -> pd.DataFrame:
+    """
+    單人各疾病在多個年數的累積絕對風險（0~1）：LP 同 score_profile（查表模式時直接讀表），
+    再以 (疾病, 1) 的 LP 對 (疾病, 年數) 的 H0 一次廣播，不逐疾病、逐年計算。
+    profile 同 score_profile。回傳 index 為年數、欄為 model.diseases 的 DataFrame；該年數沒有 H0 的格子為 NaN。
+    """
+    lookup = model.lookup
+    row = lookup.profile(model.schema, profile) if lookup is not None else None
+    if row is not None:
+        lps = row[0]
+    else:
+        lps = model.design.predict_one(model.compiled.coef[model.coef_rows], profile)
+    horizons = np.asarray(horizons, dtype=np.float64)
+    curves = absolute_risk(lps[:, None], model.H0_at(horizons))  # (疾病, 年數)
+    return pd.DataFrame(curves.T, index=pd.Index(horizons, name="years"), columns=list(model.diseases))
+
+
+def _age(profile: Mapping) -> float:
+    """百分位組別所需的年齡；schema 沒有 age 時也必須提供。"""
+    if "age" not in profile:
+        raise ValueError("缺少輸入：['age']")
+    return float(profile["age"])
+
+
+def _column(data, name: str) -> np.ndarray:
+    if name not in data:
+        raise ValueError(f"批次輸入缺少欄位：{name}")
+    return np.asarray(data[name])
+
+
+def risk_category(percentile: np.ndarray) -> np.ndarray:
+    """百分位 → 風險等級文字（object 陣列）。"""
+    labels = np.array([label for _, label in reversed(RISK_LEVELS)], dtype=object)
+    level = np.zeros(len(percentile), dtype=np.intp)
+    for cut, _ in RISK_LEVELS[:-1]:
+        level += percentile >= cut
+    return labels[level]
+
+
+def score_arrays(model: ScoringModel, age: np.ndarray, sex_code: np.ndarray, codes: Mapping[str, np.ndarray]
+                 ) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    以共變數代碼（model.design.codes 的結果）評分，回傳 (LP, percentile, exact_percentile, abs_risk)，
+    皆為 (N, n_diseases)。age、sex_code 決定百分位組別。
+    百分位找不到組別的位置為 -1；沒有 H0 的疾病 abs_risk 為 NaN。
+    """
+    # 不用 X @ coef.T：加總順序與 score_profile 相同，LP 逐位元一致
+    LP = model.design.predict(model.compiled.coef[model.coef_rows], codes)  # (N, n_diseases)
+    return (LP, *outcome_arrays(model, LP, age, sex_code))
+
+
+def outcome_arrays(model: ScoringModel, LP: np.ndarray, age: np.ndarray, sex_code: np.ndarray
+                   ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """由 (N, n_diseases) 的 LP 算出 (percentile, exact_percentile, abs_risk)。"""
+    # 絕對風險：1 - exp(-H0 * exp(LP))；沒有 H0 的疾病為 NaN
+    abs_risk = absolute_risk(LP, model.H0[None, :])
+
+    # 百分位：每個 (列, 疾病) 對應到張量中的一格，整批一次 searchsorted
+    table = model.percentiles
+    cell = table.cell_index(model.percentile_rows[None, :], sex_code[:, None],
+                            AGE_GROUP_BANDS.codes(age)[:, None])
+    pct, exact = table.rank(LP, cell)
+    return pct, exact, abs_risk
+
+
+def score_batch(data: pd.DataFrame | Mapping[str, np.ndarray], model: ScoringModel | None = None,
+                horizon: float | np.ndarray | None = None) -> pd.DataFrame:
+    """
+    批次評分。
+    data：DataFrame 或 {欄位: 陣列}，需含 model.schema.inputs（預設為 INPUT_COLUMNS：
+      age, gender, current_hr, bmi, smoking_status, drinking_status）；
+      gender 為 Male/Female（或 1/2），吸菸/飲酒為 app 的中文選項。
+    horizon：絕對風險的年數，純量或每列一個值；預設為模型的 horizon。
+    模型啟用查表模式（model.use_lookup）時，表內涵蓋的列直接查表，其餘照常計算。
+    回傳：每個疾病 × RESULT_FIELDS 一欄（欄名見 result_column），列順序與輸入相同。
+    找不到對應百分位組別的列，其 percentile/exact_percentile/risk_category 為缺值；
+    類別輸入無法辨識（不在 levels / aliases 中）的列不計算，全部結果欄皆為缺值。
+    """
+    model = model or load_scoring_model()
+
+    age = _column(data, "age").astype(np.float64)
+    codes = model.design.codes(data)
+    sex_code = model.sex_codes(codes)
+    n = len(age)
+    lookup = model.lookup
+    if lookup is None:
+        LP, pct, exact, abs_risk = score_arrays(model, age, sex_code, codes)
+    else:
+        key = lookup.keys(age, codes)
+        hit = key >= 0
+        LP, pct, exact, abs_risk = lookup.take(key[hit], n, hit)
+        miss = ~hit
+        if miss.any():
+            computed = score_arrays(model, age[miss], sex_code[miss], {k: c[miss] for k, c in codes.items()})
+            for dst, src in zip((LP, pct, exact, abs_risk), computed):
+                dst[miss] = src
+    unknown = model.design.unknown(codes)
+    if unknown.any():
+        LP[unknown] = np.nan
+        pct[unknown] = -1
+        exact[unknown] = -1
+        abs_risk[unknown] = np.nan
+    if horizon is not None and not np.array_equal(horizon, model.horizon):
+        # 其他年數：(疾病,) 或 (疾病, N) 的 H0 對 (N, 疾病) 的 LP 廣播
+        abs_risk = absolute_risk(LP, model.H0_at(horizon).T)
+
+    missing = pct < 0
+    category = risk_category(pct.ravel()).reshape(pct.shape)
+    category[missing] = None
+
+    out: dict[str, object] = {}
+    for k, disease in enumerate(model.diseases):
+        out[result_column(disease, "lp")] = LP[:, k]
+        out[result_column(disease, "percentile")] = pd.arrays.IntegerArray(pct[:, k], missing[:, k])
+        out[result_column(disease, "exact_percentile")] = pd.arrays.IntegerArray(exact[:, k], missing[:, k])
+        out[result_column(disease, "risk_category")] = category[:, k]
+        out[result_column(disease, "abs_risk")] = abs_risk[:, k]
+
+    index = data.index if isinstance(data, pd.DataFrame) else pd.RangeIndex(n)
+    return pd.DataFrame(out, index=index)
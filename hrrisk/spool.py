@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+磁碟上的持久化寫入佇列：評估結果先寫進本機的 SQLite（WAL 模式），再由背景執行緒送往 Supabase，
+寫入成功才從 spool 刪除。Supabase 暫時無法連線或行程重啟時資料都留在 spool 裡，恢復後接續送出。
+
+    writer = SpoolWriter(RestSink(url, anon_key), "spool/risk_log.sqlite3")
+    writer.submit([("user_sessions", [session]), ("risk_events", rows)])
+
+- submit 只做一次本機 INSERT（WAL + synchronous=NORMAL，約 0.1 ms），不碰網路。
+- 同一個 spool 可由多個行程寫入；以 filelock 取得 <spool>.lock 的行程負責送出，
+  其他行程只寫入。負責送出的行程結束後，下一個取得鎖的行程接手。
+- 暫時性失敗（網路、5xx、重試用盡）不丟資料：留在 spool，等 max_backoff 秒後再試。
+  永久錯誤（PermanentError，例如 4xx）的工作標為 failed 留存備查，不再重送。
+- 合併批次中每完成一個資料表就記下進度，重啟後不會重送已寫入的 user_sessions。
+- flush()/close() 在送出者行程等整個 spool 清空；其他行程只等自己寫入的工作，
+  不會因為別的行程的積壓而等到逾時。
+"""
+
+from __future__ import annotations
+
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Sequence
+
+from filelock import FileLock, Timeout
+
+from .logwriter import BackgroundWriter, PermanentError, Sink, Step, _Job
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at REAL NOT NULL,
+    n_rows INTEGER NOT NULL,
+    steps TEXT NOT NULL,
+    failed INTEGER NOT NULL DEFAULT 0,
+    error TEXT
+)
+"""
+
+
+class SpoolWriter(BackgroundWriter):
+    """
+    以 SQLite spool 取代記憶體佇列的 BackgroundWriter；其餘參數（微批次、重試）相同。
+    maxsize 為 spool 中待送出工作的上限；overflow 只支援 "drop_newest" 與 "drop_oldest"。
+    stats() 另外提供 deferred（暫時失敗、留待重試的次數）與 dead（標為 failed 的工作數）。
+    """
+
+    def __init__(self, sink: Sink, path: str | Path, maxsize: int = 100_000, overflow: str = "drop_newest",
+                 **kwargs):
+        if overflow == "block":
+            raise ValueError("SpoolWriter 不支援 overflow='block'（寫入 spool 不會阻塞）")
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.maxsize = maxsize
+        self._db = sqlite3.connect(self.path, timeout=10.0, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(_SCHEMA)
+        self._db_lock = threading.Lock()
+        # 鎖在背景執行緒取得、在 close() 的呼叫端釋放，不能用 filelock 預設的 thread_local
+        self._file_lock = FileLock(str(self.path) + ".lock", thread_local=False)
+        self._wake = threading.Event()
+        self._cursor = 0          # 本輪已交給背景執行緒的最大 id
+        self._resume_at = 0.0     # 暫時失敗後，此時間之前不送出
+        self._own: set[int] = set()  # 本行程寫入、可能尚未送出的工作 id（_db_lock 保護）
+        super().__init__(sink, maxsize=0, overflow=overflow, **kwargs)
+        self._counts.setdefault("deferred", 0)
+
+    # ---- SQLite ----
+    def _sql(self, sql: str, params: Sequence = ()) -> list[tuple]:
+        with self._db_lock:
+            return self._db.execute(sql, params).fetchall()
+
+    # ---- 生產端 ----
+    def _put(self, job: _Job) -> bool:
+        payload = json.dumps(job.steps, ensure_ascii=False, separators=(",", ":"))
+        with self._db_lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                (pending,) = self._db.execute("SELECT COUNT(*) FROM jobs WHERE failed = 0").fetchone()
+                if pending >= self.maxsize:
+                    if self.overflow != "drop_oldest":
+                        self._db.execute("ROLLBACK")
+                        self._count("dropped")
+                        return False
+                    self._db.execute("DELETE FROM jobs WHERE id = (SELECT MIN(id) FROM jobs WHERE failed = 0)")
+                    self._count("dropped")
+                cur = self._db.execute("INSERT INTO jobs (created_at, n_rows, steps) VALUES (?, ?, ?)",
+                                       (time.time(), job.rows, payload))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._own.add(cur.lastrowid)
+        self._wake.set()
+        return True
+
+    # ---- 消費端 ----
+    def _is_drainer(self) -> bool:
+        """是否持有 spool 的送出權（非阻塞地嘗試取得 filelock）。"""
+        if self._file_lock.is_locked:
+            return True
+        try:
+            self._file_lock.acquire(timeout=0)
+        except Timeout:
+            return False
+        self._cursor = 0
+        return True
+
+    def _next(self) -> _Job | None:
+        if time.monotonic() < self._resume_at or not self._is_drainer():
+            return None
+        row = self._sql("SELECT id, created_at, steps FROM jobs WHERE failed = 0 AND id > ? ORDER BY id LIMIT 1",
+                        (self._cursor,))
+        if not row:
+            return None
+        job_id, created_at, steps = row[0]
+        self._cursor = job_id
+        # 換算成 monotonic 時間，使批次的時間門檻與 delay 統計在重啟後仍正確
+        enqueued_at = time.monotonic() - max(0.0, time.time() - created_at)
+        return _Job([(t, r) for t, r in json.loads(steps)], enqueued_at, job_id)
+
+    def _get(self, timeout: float) -> _Job | None:
+        job = self._next()
+        if job is None and not self._stop.is_set():
+            # 同行程的 submit 會立即喚醒；其他行程寫入的工作在逾時後重新查詢時取得
+            self._wake.wait(timeout)
+            self._wake.clear()
+            job = self._next()
+        return job
+
+    def _get_nowait(self) -> _Job | None:
+        return self._next()
+
+    def _finish(self, jobs: list[_Job]) -> None:
+        pass
+
+    def _pending(self) -> int:
+        if self._file_lock.is_locked:
+            return self._sql("SELECT COUNT(*) FROM jobs WHERE failed = 0")[0][0]
+        # 非送出者：只數自己寫入、仍在 spool 中的工作（送出者送完即刪除或標為 failed）
+        with self._db_lock:
+            own = sorted(self._own)
+            left = set()
+            for i in range(0, len(own), 500):
+                part = own[i:i + 500]
+                marks = ",".join("?" * len(part))
+                left.update(r[0] for r in self._db.execute(
+                    f"SELECT id FROM jobs WHERE failed = 0 AND id IN ({marks})", part).fetchall())
+            self._own = left
+            return len(left)
+
+    def _step_done(self, job: _Job) -> None:
+        # 記下每一筆剩下的步驟；重啟後只送尚未寫入的資料表
+        written = {t for t, _ in job.steps[:job.done]}
+        updates = []
+        for part in job.parts:
+            remaining = [(t, r) for t, r in part.steps if t not in written]
+            updates.append((json.dumps(remaining, ensure_ascii=False, separators=(",", ":")), part.id))
+        with self._db_lock:
+            self._db.executemany("UPDATE jobs SET steps = ? WHERE id = ?", updates)
+
+    def _settle(self, jobs: list[_Job], error: Exception | None) -> None:
+        ids = [(job.id,) for job in jobs]
+        if error is None:
+            with self._db_lock:
+                self._db.executemany("DELETE FROM jobs WHERE id = ?", ids)
+                self._own.difference_update(job.id for job in jobs)
+            super()._settle(jobs, None)
+        elif isinstance(error, PermanentError):
+            with self._db_lock:
+                self._db.executemany("UPDATE jobs SET failed = 1, error = ? WHERE id = ?",
+                                     [(str(error)[:1000], job_id) for (job_id,) in ids])
+                self._own.difference_update(job.id for job in jobs)
+            super()._settle(jobs, error)
+        else:
+            # 暫時性失敗：留在 spool，稍後從頭重新讀取
+            self._count("deferred", len(jobs))
+            self._cursor = 0
+            self._resume_at = time.monotonic() + self.max_backoff
+
+    # ---- 管理 ----
+    def stats(self) -> dict[str, float]:
+        counts = super().stats()
+        counts["dead"] = self._sql("SELECT COUNT(*) FROM jobs WHERE failed = 1")[0][0]
+        return counts
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """立即送出 spool 中的工作並等待清空；暫時失敗的等待期也一併略過。"""
+        self._resume_at = 0.0
+        self._wake.set()
+        return super().flush(timeout)
+
+    def close(self, timeout: float | None = 5.0) -> bool:
+        drained = super().close(timeout)
+        if self._file_lock.is_locked:
+            self._file_lock.release()
+        with self._db_lock:
+            self._db.close()
+        return drained
+
+
+def failed_jobs(path: str | Path) -> list[tuple[int, float, list[Step], str]]:
+    """列出 spool 中標為 failed 的工作：(id, 建立時間, 剩餘步驟, 錯誤訊息)。"""
+    with sqlite3.connect(path) as db:
+        rows = db.execute("SELECT id, created_at, steps, error FROM jobs WHERE failed = 1 ORDER BY id").fetchall()
+    return [(i, c, [(t, r) for t, r in json.loads(s)], e) for i, c, s, e in rows]
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""評分 HTTP API（hrrisk.api）：以 starlette.testclient 呼叫各端點。"""
+
+import pandas as pd
+import pytest
+from starlette.testclient import TestClient
+
+from hrrisk import api, metrics
+from hrrisk.registry import ModelRegistry
+from hrrisk.scoring import RESULT_FIELDS, result_column, score_batch, score_profile
+
+PROFILE = {"age": 52, "gender": "Female", "current_hr": 78, "bmi": 26.3,
+           "smoking_status": "曾經吸菸", "drinking_status": "目前飲酒"}
+OTHER = {"age": 71, "gender": "1", "current_hr": 95, "bmi": 17.5,
+         "smoking_status": "目前吸菸", "drinking_status": "從未飲酒"}
+
+
+@pytest.fixture(scope="module")
+def registry():
+    return ModelRegistry(lookup=False)
+
+
+@pytest.fixture
+def client(registry):
+    with TestClient(api.create_app(registry)) as client:
+        yield client
+
+
+def test_lifespan_runs_the_watcher(registry):
+    with TestClient(api.create_app(registry)):
+        # 請求中的 current() 不在事件迴圈上檢查檔案或建模型
+        assert registry.watching
+    assert not registry.watching
+
+
+def test_score(client, registry):
+    r = client.post("/score", json=PROFILE)
+    assert r.status_code == 200
+    body = r.json()
+    assert body["model_version"] == registry.version
+    expected = score_profile(registry.model, PROFILE)
+    assert [x["disease"] for x in body["results"]] == [x["disease"] for x in expected]
+    for got, want in zip(body["results"], expected):
+        assert {f: got[f] for f in RESULT_FIELDS} == {f: want[f] for f in RESULT_FIELDS}
+
+
+def test_score_rejects_bad_json(client):
+    r = client.post("/score", content=b"{")
+    assert r.status_code == 400 and "error" in r.json()
+
+
+@pytest.mark.parametrize("body", [
+    [],
+    {"age": 52},
+    {**PROFILE, "age": "52"},
+    {**PROFILE, "gender": "x"},
+])
+def test_score_rejects_bad_input(client, body):
+    r = client.post("/score", json=body)
+    assert r.status_code == 422 and "error" in r.json()
+
+
+@pytest.mark.parametrize("threadpool_rows", [256, 0])
+def test_score_batch(client, registry, monkeypatch, threadpool_rows):
+    monkeypatch.setattr(api, "THREADPOOL_ROWS", threadpool_rows)
+    r = client.post("/score/batch", json={"profiles": [PROFILE, OTHER]})
+    assert r.status_code == 200
+    body = r.json()
+    model = registry.model
+    assert body["diseases"] == list(model.diseases)
+    expected = score_batch(pd.DataFrame([PROFILE, OTHER]), model)
+    for field in ("lp", "percentile", "exact_percentile", "risk_category"):
+        assert body[field] == [[expected[result_column(d, field)].iloc[i] for d in model.diseases]
+                               for i in range(2)]
+
+
+def test_score_batch_limits(client, monkeypatch):
+    assert client.post("/score/batch", json={"profiles": []}).json()["lp"] == []
+    assert client.post("/score/batch", json=[PROFILE]).status_code == 422
+    r = client.post("/score/batch", json={"profiles": [PROFILE, {**OTHER, "gender": "x"}]})
+    assert r.status_code == 422 and "profiles[1]" in r.json()["error"]
+    monkeypatch.setattr(api, "MAX_BATCH_ROWS", 1)
+    assert client.post("/score/batch", json={"profiles": [PROFILE, OTHER]}).status_code == 413
+
+
+def test_health(client, registry):
+    client.post("/score", json=PROFILE)
+    client.post("/score", json=PROFILE)
+    body = client.get("/health").json()
+    assert body["status"] == "ok"
+    assert body["model_version"] == registry.version
+    assert body["diseases"] == len(registry.model.diseases)
+    assert body["cache"]["hits"] >= 1
+
+
+def test_metrics(client):
+    was = metrics.enabled()
+    try:
+        metrics.set_enabled(False)
+        assert client.get("/metrics").status_code == 404
+        metrics.set_enabled(True)
+        client.post("/score", json=PROFILE)
+        r = client.get("/metrics")
+    finally:
+        metrics.set_enabled(was)
+    assert r.status_code == 200
+    assert r.headers["content-type"] == metrics.CONTENT_TYPE
+    assert 'hrrisk_stage_duration_seconds_count{stage="api.score"}' in r.text
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""Streamlit app（app_test.py）：以 AppTest 執行，記錄寫到本機的 REST 替身。"""
+
+import time
+from pathlib import Path
+
+import pytest
+from streamlit.testing.v1 import AppTest
+
+from hrrisk.reststub import StubRestServer
+
+APP = str(Path(__file__).resolve().parent.parent / "app_test.py")
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    monkeypatch.setenv("HRRISK_SPOOL", str(tmp_path / "spool.sqlite3"))
+    with StubRestServer() as server:
+        yield server
+
+
+def _wait(predicate, timeout: float = 10.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def test_curve_widgets_do_not_log_the_assessment_again(server):
+    at = AppTest.from_file(APP, default_timeout=60)
+    at.secrets["supabase"] = {"url": server.url, "anon_key": "k"}
+    at.run()
+    next(cb for cb in at.sidebar.checkbox if "同意" in cb.label).check()
+    at.sidebar.button[0].click()
+    at.run()
+    assert not at.exception
+    assert _wait(lambda: len(server.rows("risk_events")) > 0)
+    events = len(server.rows("risk_events"))
+
+    # 表單外的曲線元件各觸發一次 rerun
+    at.checkbox(key="show_risk_curves").check().run()
+    diseases = at.multiselect(key="risk_curve_diseases")
+    diseases.unselect(diseases.value[0]).run()
+    at.select_slider(key="risk_curve_years").set_value(5).run()
+    assert not at.exception
+    # 寫入在背景批次送出；等一段時間確認沒有第二筆
+    assert not _wait(lambda: len(server.rows("user_sessions")) > 1, timeout=3.0)
+    assert len(server.rows("user_sessions")) == 1
+    assert len(server.rows("risk_events")) == events
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""編譯後的模型檔（hrrisk.artifact）：compile → mmap 載入的評分與 CSV 相同，來源 CSV 變動時不再使用。"""
+
+import shutil
+import struct
+import sys
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from hrrisk.artifact import ArtifactError, artifact_path, compile_model, load_artifact, read_artifact
+from hrrisk.loaders import load_manifest, model_files
+from hrrisk.scoring import load_scoring_model, score_batch
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "benchmarks"))
+from common import make_cohort  # noqa: E402
+
+
+@pytest.fixture
+def manifest(tmp_path):
+    shutil.copytree(ROOT / "model", tmp_path / "model")
+    return tmp_path / "model" / "manifest.json"
+
+
+@pytest.fixture(scope="module")
+def cohort():
+    return make_cohort(2_000, seed=3)
+
+
+def _from_artifact(model) -> bool:
+    # artifact 的陣列是 mmap 上的唯讀視圖
+    return not model.compiled.coef.flags.writeable
+
+
+def test_round_trip_matches_csv(manifest, cohort):
+    path = compile_model(manifest)
+    assert path == artifact_path(load_manifest(manifest)) and path.exists()
+    mapped = load_scoring_model(manifest)
+    parsed = load_scoring_model(manifest, use_artifact=False)
+    assert _from_artifact(mapped) and not _from_artifact(parsed)
+    assert mapped.diseases == parsed.diseases
+    pd.testing.assert_frame_equal(score_batch(cohort, mapped), score_batch(cohort, parsed))
+
+
+def test_stale_source_falls_back_until_recompiled(manifest, cohort):
+    compile_model(manifest)
+    m = load_manifest(manifest)
+    coef_file = model_files(m)["coef_path"]
+    text = coef_file.read_text(encoding="utf-8")
+    assert "DEATH,HR_cat<60,0.03559" in text
+    coef_file.write_text(text.replace("DEATH,HR_cat<60,0.03559", "DEATH,HR_cat<60,0.5"), encoding="utf-8")
+
+    with pytest.raises(ArtifactError, match="過期"):
+        load_artifact(m)
+    stale = load_scoring_model(manifest)
+    assert not _from_artifact(stale)
+    i, j = stale.compiled.disease_index["Death"], stale.compiled.column_index["HR_cat<60"]
+    assert stale.compiled.coef[i, j] == 0.5
+
+    compile_model(manifest)
+    fresh = load_scoring_model(manifest)
+    assert _from_artifact(fresh) and fresh.compiled.coef[i, j] == 0.5
+    pd.testing.assert_frame_equal(score_batch(cohort, fresh), score_batch(cohort, stale))
+
+
+def test_corrupt_artifact_falls_back(manifest):
+    path = compile_model(manifest)
+    header, _ = read_artifact(path)
+    data = bytearray(path.read_bytes())
+    _, _, header_len = struct.unpack_from("<8sII", data)
+    data[struct.calcsize("<8sII") + header_len + header["arrays"]["coef"]["offset"]] ^= 0xFF
+    path.write_bytes(bytes(data))
+    with pytest.raises(ArtifactError, match="checksum"):
+        load_artifact(load_manifest(manifest))
+    assert not _from_artifact(load_scoring_model(manifest))
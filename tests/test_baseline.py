@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""Baseline hazard 階梯函數（hrrisk.baseline）：邊界年數與 lookup_H0 一致，疾病之間不串到別段。"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from hrrisk.baseline import compile_baseline
+from hrrisk.scoring import load_scoring_model, lookup_H0
+
+# 刻意打亂順序；C 從 t=0 開始，D 只有一階
+BASELINE = pd.DataFrame({
+    "Disease": ["A", "B", "A", "C", "B", "A", "C", "D"],
+    "t_years": [5.0, 10.0, 1.0, 3.0, 2.0, 3.0, 0.0, 3.0],
+    "H0": [0.5, 1.0, 0.1, 0.05, 0.2, 0.3, 0.0, 0.07],
+})
+DISEASES = ["A", "B", "C", "D", "missing"]
+TIMES = [-1.0, 0.0, 0.5, 1.0 - 1e-9, 1.0, 1.5, 2.0, 3.0 - 1e-9, 3.0, 3.0 + 1e-9, 4.999, 5.0, 7.0, 10.0, 25.0, np.nan]
+
+
+def _expected(disease: str, t: float, baseline_df: pd.DataFrame = BASELINE) -> float:
+    h = lookup_H0(disease, t, baseline_df)
+    return np.nan if h is None else h
+
+
+def test_step_function_matches_lookup_H0_at_boundaries():
+    baseline = compile_baseline(BASELINE)
+    rows = baseline.rows(DISEASES)
+    got = baseline.curve(rows, TIMES)
+    want = np.array([[_expected(d, t) for t in TIMES] for d in DISEASES])
+    np.testing.assert_array_equal(got, want)
+
+
+@pytest.mark.parametrize("disease, t, h0", [
+    ("A", 1.0, 0.1),          # 剛好在一階上取該階
+    ("A", 1.0 - 1e-9, np.nan),  # 早於第一階
+    ("A", 4.999, 0.3),
+    ("A", 25.0, 0.5),         # 晚於最後一階沿用最後一階，不落到 B
+    ("B", 1.999, np.nan),
+    ("B", 10.0, 1.0),
+    ("C", 0.0, 0.0),
+    ("D", 2.0, np.nan),
+    ("D", 3.0, 0.07),
+])
+def test_boundary_years(disease, t, h0):
+    baseline = compile_baseline(BASELINE)
+    np.testing.assert_array_equal(baseline.at(baseline.rows([disease]), t), [h0])
+
+
+def test_broadcasts_rows_against_years():
+    baseline = compile_baseline(BASELINE)
+    rows = baseline.rows(["A", "B"])
+    np.testing.assert_array_equal(baseline.at(rows, [3.0, 2.0]), [0.3, 0.2])
+    assert baseline.at(rows[:, None], np.array(TIMES)[None, :]).shape == (2, len(TIMES))
+
+
+@pytest.mark.parametrize("changes, message", [
+    ({"t_years": [5.0, 10.0, 1.0, 3.0, 2.0, 1.0, 0.0, 3.0]}, "重複"),
+    ({"H0": [0.5, 1.0, 0.1, 0.05, 0.2, 0.6, 0.0, 0.07]}, "遞減"),
+    ({"t_years": [5.0, 10.0, -1.0, 3.0, 2.0, 3.0, 0.0, 3.0]}, "不可為負"),
+])
+def test_rejects_invalid_step_function(changes, message):
+    with pytest.raises(ValueError, match=message):
+        compile_baseline(BASELINE.assign(**changes))
+
+
+def test_model_H0_at_matches_lookup_H0():
+    model = load_scoring_model(use_artifact=False)
+    years = [model.horizon - 1e-9, model.horizon, model.horizon + 1.0]
+    got = model.H0_at(years)
+    want = np.array([[_expected(d, t, model.baseline_df) for t in years] for d in model.diseases])
+    np.testing.assert_array_equal(got, want)
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""單人評分快取（hrrisk.cache）：key 依模型 schema 的代碼。"""
+
+import pytest
+
+from hrrisk.cache import ProfileCache, profile_key
+from hrrisk.schema import DEFAULT_SCHEMA, CovariateSchema
+from hrrisk.scoring import load_scoring_model, score_profile
+
+PROFILE = {"age": 52, "gender": "Female", "current_hr": 78, "bmi": 26.3,
+           "smoking_status": "曾經吸菸", "drinking_status": "目前飲酒"}
+
+
+def _custom_hr_schema() -> CovariateSchema:
+    specs = [dict(s) for s in DEFAULT_SCHEMA.spec()]
+    specs[[s["name"] for s in specs].index("current_hr")] = {
+        "name": "current_hr", "type": "banded", "cuts": [60, 70, 80, 90, 100],
+        "levels": ["HR_cat<60", "HR_cat60-69", "HR_cat70-79", "HR_cat80-89", "HR_cat>=90", "HR_cat>=100"],
+        "reference": "HR_cat60-69"}
+    return CovariateSchema.from_spec(specs)
+
+
+def test_key_follows_schema_cuts():
+    schema = _custom_hr_schema()
+    key = lambda hr: profile_key(schema, {**PROFILE, "current_hr": hr}, "v")  # noqa: E731
+    assert key(95) != key(105)
+    assert key(91) == key(95)
+    assert profile_key(DEFAULT_SCHEMA, {**PROFILE, "current_hr": 95}, "v") == \
+        profile_key(DEFAULT_SCHEMA, {**PROFILE, "current_hr": 105}, "v")
+
+
+def test_key_uses_only_schema_inputs():
+    schema = CovariateSchema.from_spec([s for s in DEFAULT_SCHEMA.spec() if s["name"] != "drinking_status"])
+    profile = {k: v for k, v in PROFILE.items() if k != "drinking_status"}
+    assert profile_key(schema, profile, "v") == profile_key(schema, {**profile, "drinking_status": "x"}, "v")
+    with pytest.raises(ValueError):
+        profile_key(DEFAULT_SCHEMA, profile, "v")
+
+
+def test_cached_results_match_score_profile():
+    model = load_scoring_model(use_artifact=False)
+    cache = ProfileCache()
+    first = cache.score(model, "v", PROFILE)
+    assert first == score_profile(model, PROFILE)
+    assert cache.score(model, "v", {**PROFILE, "current_hr": 75, "gender": "2"}) == first
+    assert cache.stats()["hits"] == 1
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""命令列批次評分（hrrisk.cli score）：多塊串流、多行程的輸出與單行程一致。"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from hrrisk import cli
+from hrrisk.scoring import load_scoring_model
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "benchmarks"))
+from common import make_cohort  # noqa: E402
+
+ROWS = 1_000
+CHUNKSIZE = 300
+
+
+@pytest.fixture(scope="module")
+def cohort_csv(tmp_path_factory):
+    path = tmp_path_factory.mktemp("cli") / "cohort.csv"
+    make_cohort(ROWS, seed=7).assign(patient_id=lambda d: range(len(d))).to_csv(path, index=False)
+    return path
+
+
+def _score(src, dst, *extra):
+    assert cli.main(["score", str(src), str(dst), "--chunksize", str(CHUNKSIZE), *extra]) == 0
+    return dst
+
+
+@pytest.mark.parametrize("suffix", [".csv", ".csv.gz"])
+def test_csv_workers_match_serial(cohort_csv, tmp_path, suffix):
+    serial = _score(cohort_csv, tmp_path / f"serial{suffix}", "--workers", "1")
+    parallel = _score(cohort_csv, tmp_path / f"parallel{suffix}", "--workers", "2")
+    a, b = pd.read_csv(serial), pd.read_csv(parallel)
+    assert len(a) == ROWS
+    pd.testing.assert_frame_equal(a, b)
+    if suffix == ".csv":
+        assert serial.read_bytes() == parallel.read_bytes()
+
+
+def test_csv_matches_to_csv(cohort_csv, tmp_path):
+    # 分塊編碼後串接的內容與整份結果 DataFrame.to_csv 相同
+    out = _score(cohort_csv, tmp_path / "out.csv")
+    model = load_scoring_model()
+    chunks = cli.iter_chunks(cohort_csv, CHUNKSIZE)
+    whole = pd.concat([cli.score_chunk(c, model, None, None) for c in chunks], ignore_index=True)
+    assert out.read_text(encoding="utf-8") == whole.to_csv(index=False)
+
+
+def test_parquet_workers_match_serial(cohort_csv, tmp_path):
+    pytest.importorskip("pyarrow")
+    serial = _score(cohort_csv, tmp_path / "serial.parquet", "--workers", "1")
+    parallel = _score(cohort_csv, tmp_path / "parallel.parquet", "--workers", "2")
+    a, b = pd.read_parquet(serial), pd.read_parquet(parallel)
+    assert len(a) == ROWS
+    pd.testing.assert_frame_equal(a, b)
+
+
+@pytest.fixture(scope="module")
+def ragged():
+    # 各塊的型別不同：note 第一塊全缺值、之後為文字；visit 第一塊為整數、之後出現缺值；bmi 第一塊為整數
+    data = make_cohort(ROWS, seed=11)
+    data["note"] = np.where(np.arange(ROWS) < CHUNKSIZE, None, "追蹤")
+    data["visit"] = pd.array(np.where(np.arange(ROWS) % 7 == 0, -1, np.arange(ROWS)), dtype="Int64")
+    data.loc[data.index >= CHUNKSIZE, "visit"] = data["visit"].where(data["visit"] >= 0)
+    data.loc[data.index < CHUNKSIZE, "bmi"] = data["bmi"].round()
+    return data
+
+
+@pytest.mark.parametrize("source", ["csv", "parquet"])
+def test_parquet_streaming_keeps_one_schema(ragged, tmp_path, source):
+    pytest.importorskip("pyarrow")
+    src = tmp_path / f"in.{source}"
+    if source == "csv":
+        ragged.to_csv(src, index=False)
+    else:
+        ragged.to_parquet(src, index=False)
+    out = _score(src, tmp_path / "out.parquet", "--workers", "2")
+    scored = pd.read_parquet(out)
+    assert len(scored) == ROWS
+    assert scored["note"].isna().sum() == CHUNKSIZE
+    assert (scored["note"].dropna() == "追蹤").all()
+    visit = pd.to_numeric(scored["visit"])
+    pd.testing.assert_series_equal(visit.astype("Int64"), ragged["visit"], check_names=False)
+    assert scored["bmi"].dtype == np.float64
+
+    # 評分欄位與 CSV 輸出一致
+    csv = pd.read_csv(_score(src, tmp_path / "out.csv"))
+    results = [c for c in csv.columns if "|" in c]
+    pd.testing.assert_frame_equal(scored[results], csv[results], check_dtype=False)
+
+
+def test_csv_streaming_multiple_chunks(ragged, tmp_path):
+    src = tmp_path / "in.csv"
+    ragged.to_csv(src, index=False)
+    out = _score(src, tmp_path / "out.csv", "--keep", "note,visit")
+    scored = pd.read_csv(out)
+    assert list(scored.columns[:2]) == ["note", "visit"]
+    assert len(scored) == ROWS
+    assert scored["note"].isna().sum() == CHUNKSIZE
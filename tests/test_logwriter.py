@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""背景寫入（hrrisk.logwriter）：以本機的 REST 替身（hrrisk.reststub）測試，不連網。"""
+
+import threading
+import time
+
+import pytest
+
+from hrrisk.logwriter import BackgroundWriter, RestSink, Sink
+from hrrisk.reststub import StubRestServer
+
+
+def _job(i: int) -> list:
+    return [("user_sessions", [{"session": i}]), ("risk_events", [{"session": i, "disease": "A"},
+                                                                  {"session": i, "disease": "B"}])]
+
+
+@pytest.fixture
+def close_later():
+    """測試結束時關閉建立的 writer / sink。"""
+    objs = []
+    yield objs.append
+    for obj in objs:
+        obj.close()
+
+
+def test_retries_until_stub_recovers(close_later):
+    with StubRestServer(fail_first=3) as server:
+        writer = BackgroundWriter(RestSink(server.url, "k"), batch_rows=1, backoff=0.001)
+        close_later(writer)
+        assert writer.submit(_job(1))
+        assert writer.flush(timeout=5)
+        stats = writer.stats()
+        assert (stats["written"], stats["failed"], stats["retries"]) == (1, 0, 3)
+        assert server.requests == 3 + 2
+        assert server.rows("user_sessions") == [{"session": 1}]
+        assert len(server.rows("risk_events")) == 2
+
+
+def test_gives_up_after_max_retries(close_later):
+    failed = []
+    with StubRestServer(fail_first=100) as server:
+        writer = BackgroundWriter(RestSink(server.url, "k"), batch_rows=1, backoff=0.001, max_retries=2,
+                                  on_failure=lambda steps, e: failed.append(steps))
+        close_later(writer)
+        writer.submit(_job(1))
+        assert writer.flush(timeout=5)
+        assert writer.stats()["failed"] == 1
+        assert server.requests == 3
+        assert [table for table, _ in failed[0]] == ["user_sessions", "risk_events"]
+
+
+def test_permanent_error_is_not_retried_and_resumes_from_failed_step(close_later):
+    failed = []
+    reject = lambda table, row: table == "risk_events"  # noqa: E731
+    with StubRestServer(reject=reject) as server:
+        writer = BackgroundWriter(RestSink(server.url, "k"), batch_rows=1, backoff=0.001,
+                                  on_failure=lambda steps, e: failed.append(steps))
+        close_later(writer)
+        writer.submit(_job(1))
+        assert writer.flush(timeout=5)
+        assert writer.stats()["retries"] == 0
+        assert server.rows("user_sessions") == [{"session": 1}]
+        # 只回報沒寫成功的步驟
+        assert [table for table, _ in failed[0]] == ["risk_events"]
+
+
+def test_micro_batch_merges_jobs_per_table(close_later):
+    with StubRestServer() as server:
+        writer = BackgroundWriter(RestSink(server.url, "k"), batch_rows=1000, batch_interval=60)
+        close_later(writer)
+        for i in range(10):
+            writer.submit(_job(i))
+        assert writer.flush(timeout=5)
+        assert [(table, len(rows)) for table, rows in server.inserts] == [("user_sessions", 10), ("risk_events", 20)]
+        stats = writer.stats()
+        assert (stats["written"], stats["batches"], stats["rows"]) == (10, 2, 30)
+
+
+def test_rejected_row_splits_batch_and_keeps_the_others(close_later):
+    failed = []
+    reject = lambda table, row: row.get("session") == 3  # noqa: E731
+    with StubRestServer(reject=reject) as server:
+        writer = BackgroundWriter(RestSink(server.url, "k"), batch_rows=1000, batch_interval=60,
+                                  on_failure=lambda steps, e: failed.append(steps))
+        close_later(writer)
+        for i in range(5):
+            writer.submit(_job(i))
+        assert writer.flush(timeout=5)
+        assert sorted(r["session"] for r in server.rows("user_sessions")) == [0, 1, 2, 4]
+        assert sorted({r["session"] for r in server.rows("risk_events")}) == [0, 1, 2, 4]
+        stats = writer.stats()
+        assert (stats["written"], stats["failed"], stats["retries"]) == (4, 1, 0)
+        assert failed[0][0] == ("user_sessions", [{"session": 3}])
+
+
+def test_submit_does_not_wait_for_slow_server(close_later):
+    with StubRestServer(delay=0.2) as server:
+        writer = BackgroundWriter(RestSink(server.url, "k"), batch_rows=1)
+        close_later(writer)
+        start = time.monotonic()
+        for i in range(5):
+            assert writer.submit(_job(i))
+        assert time.monotonic() - start < 0.1
+        assert not writer.flush(timeout=0.1)
+        assert writer.flush(timeout=10)
+        assert len(server.rows("user_sessions")) == 5
+        assert writer.stats()["insert_ms_max"] >= 200
+
+
+def test_rest_sink_reuses_keep_alive_connection(close_later):
+    with StubRestServer(api_key="k") as server:
+        sink = RestSink(server.url, "k")
+        close_later(sink)
+        for i in range(5):
+            sink.insert("risk_events", [{"session": i}])
+        stats = sink.stats()
+        assert (stats["requests"], stats["connections"], stats["reused"]) == (5, 1, 4)
+        assert len(server.rows("risk_events")) == 5
+
+
+def test_rest_sink_replaces_idle_connection_closed_by_server(close_later):
+    with StubRestServer(idle_close=True) as server:
+        sink = RestSink(server.url, "k")
+        close_later(sink)
+        for i in range(3):
+            sink.insert("risk_events", [{"session": i}])
+            time.sleep(0.05)  # 等伺服器關閉連線
+        stats = sink.stats()
+        assert (stats["requests"], stats["connections"], stats["reused"], stats["stale"]) == (3, 3, 0, 2)
+        assert [r["session"] for r in server.rows("risk_events")] == [0, 1, 2]
+
+
+def test_rest_sink_does_not_resend_after_request_was_sent(close_later):
+    with StubRestServer() as server:
+        sink = RestSink(server.url, "k")
+        close_later(sink)
+        sink.insert("risk_events", [{"session": 0}])
+        # 重複使用的連線上，伺服器寫入後斷線、沒有回應：不能自動重送造成重複寫入
+        server.drop_first = 1
+        with pytest.raises(ConnectionError):
+            sink.insert("risk_events", [{"session": 1}])
+        assert [r["session"] for r in server.rows("risk_events")] == [0, 1]
+        sink.insert("risk_events", [{"session": 2}])
+        assert [r["session"] for r in server.rows("risk_events")] == [0, 1, 2]
+
+
+class GateSink(Sink):
+    """insert 停在 gate 上，直到測試放行；用來讓佇列塞滿。"""
+
+    def __init__(self):
+        self.entered = threading.Event()
+        self.gate = threading.Event()
+        self.sessions = []
+
+    def insert(self, table, rows):
+        self.entered.set()
+        assert self.gate.wait(5)
+        if table == "user_sessions":
+            self.sessions.extend(r["session"] for r in rows)
+
+
+def _fill(writer: BackgroundWriter, sink: GateSink) -> None:
+    """第 0 筆卡在 insert 中，第 1、2 筆佔滿佇列（maxsize=2）。"""
+    assert writer.submit(_job(0))
+    assert sink.entered.wait(5)
+    assert writer.submit(_job(1)) and writer.submit(_job(2))
+
+
+@pytest.mark.parametrize("overflow, accepted, written", [
+    ("drop_newest", False, [0, 1, 2]),
+    ("drop_oldest", True, [0, 2, 3]),
+    ("block", False, [0, 1, 2]),
+])
+def test_overflow_policy(close_later, overflow, accepted, written):
+    sink = GateSink()
+    writer = BackgroundWriter(sink, maxsize=2, overflow=overflow, batch_rows=1, block_timeout=0.05)
+    close_later(writer)
+    _fill(writer, sink)
+    assert writer.submit(_job(3)) is accepted
+    assert writer.stats()["dropped"] == 1
+    sink.gate.set()
+    assert writer.flush(timeout=5)
+    assert sink.sessions == written
+
+
+def test_block_waits_for_free_slot(close_later):
+    sink = GateSink()
+    writer = BackgroundWriter(sink, maxsize=2, overflow="block", batch_rows=1, block_timeout=5)
+    close_later(writer)
+    _fill(writer, sink)
+    threading.Timer(0.1, sink.gate.set).start()
+    start = time.monotonic()
+    assert writer.submit(_job(3))
+    assert time.monotonic() - start >= 0.05
+    assert writer.flush(timeout=5)
+    assert sink.sessions == [0, 1, 2, 3]
+    assert writer.stats()["dropped"] == 0
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""分段計時（hrrisk.metrics）：Prometheus 文字格式、histogram bucket 的 le 語意與滾動視窗。"""
+
+import math
+import re
+import urllib.error
+import urllib.request
+
+import pytest
+
+from hrrisk import metrics
+from hrrisk.metrics import METRIC_NAME, RollingHistogram, StageMetrics
+
+BUCKETS = (0.001, 0.01, 0.1)
+# 0.001 剛好在上界上，依 le（<=）算進第一個 bucket；0.5 只落在 +Inf
+OBSERVED = (0.0005, 0.001, 0.005, 0.05, 0.05, 0.5)
+
+# name{labels} value，value 為 Go 的 ParseFloat 可接受的數字（含 +Inf / NaN）
+SAMPLE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)\{((?:[a-zA-Z_]\w*="(?:[^"\\\n]|\\.)*",?)*)\} (\S+)$')
+
+
+def _parse(text: str) -> tuple[dict[str, str], list[tuple[str, dict[str, str], float]]]:
+    types, samples = {}, []
+    assert text.endswith("\n")
+    for line in text.splitlines():
+        if line.startswith("# TYPE "):
+            _, _, name, kind = line.split(" ")
+            types[name] = kind
+            continue
+        if line.startswith("# HELP "):
+            continue
+        m = SAMPLE.match(line)
+        assert m, line
+        labels = dict(re.findall(r'([a-zA-Z_]\w*)="((?:[^"\\]|\\.)*)"', m.group(2)))
+        samples.append((m.group(1), labels, float(m.group(3))))
+    return types, samples
+
+
+@pytest.fixture
+def rendered():
+    stages = StageMetrics(buckets=BUCKETS, window=60.0, slots=6)
+    for seconds in OBSERVED:
+        stages.histogram("score").observe(seconds, now=1000.0)
+    stages.histogram("load_manifest").observe(0.002, now=1000.0)
+    return stages, _parse(stages.render_prometheus(now=1000.0))
+
+
+def test_histogram_buckets_are_cumulative(rendered):
+    _, (types, samples) = rendered
+    assert types == {METRIC_NAME: "histogram", f"{METRIC_NAME}_recent": "summary"}
+    buckets = [(labels["le"], v) for name, labels, v in samples
+               if name == f"{METRIC_NAME}_bucket" and labels["stage"] == "score"]
+    assert buckets == [("0.001", 2), ("0.01", 3), ("0.1", 5), ("+Inf", 6)]
+    by_name = {(name, labels.get("stage")): v for name, labels, v in samples if "quantile" not in labels}
+    assert by_name[(f"{METRIC_NAME}_count", "score")] == len(OBSERVED)
+    assert by_name[(f"{METRIC_NAME}_sum", "score")] == pytest.approx(sum(OBSERVED))
+    assert by_name[(f"{METRIC_NAME}_count", "load_manifest")] == 1
+
+
+def test_recent_summary_quantiles(rendered):
+    stages, (_, samples) = rendered
+    quantiles = {labels["quantile"]: v for name, labels, v in samples
+                 if name == f"{METRIC_NAME}_recent" and labels["stage"] == "score"}
+    assert set(quantiles) == {"0.5", "0.9", "0.99"}
+    # 第 3 個觀測值落在 (0.001, 0.01]：bucket 內線性內插
+    assert quantiles["0.5"] == pytest.approx(0.001 + (0.01 - 0.001) * (3 - 2) / 1)
+    assert quantiles["0.99"] == BUCKETS[-1]
+    assert all(a <= b for a, b in zip(quantiles.values(), list(quantiles.values())[1:]))
+
+    # 視窗過後 summary 歸零，累計的 histogram 不變
+    _, later = _parse(stages.render_prometheus(now=1000.0 + 61.0))
+    recent = {(name, labels.get("quantile")): v for name, labels, v in later if labels["stage"] == "score"}
+    assert recent[(f"{METRIC_NAME}_recent_count", None)] == 0
+    assert math.isnan(recent[(f"{METRIC_NAME}_recent", "0.5")])
+    assert recent[(f"{METRIC_NAME}_count", None)] == len(OBSERVED)
+
+
+def test_label_values_are_escaped():
+    stages = StageMetrics(buckets=BUCKETS)
+    stages.observe('chart "A"\\n\nnext', 0.01)
+    _, samples = _parse(stages.render_prometheus())
+    assert {labels["stage"] for _, labels, _ in samples} == {'chart \\"A\\"\\\\n\\nnext'}
+
+
+def test_rolling_window_drops_expired_slots():
+    hist = RollingHistogram(BUCKETS, window=10.0, slots=5)
+    hist.observe(0.005, now=0.0)
+    hist.observe(0.05, now=4.0)
+    assert hist.recent(now=9.9)[0] == [0, 1, 1, 0]
+    assert hist.recent(now=10.5)[0] == [0, 0, 1, 0]
+    hist.observe(0.5, now=20.0)  # 同一格位的舊資料先清空
+    assert hist.recent(now=20.0)[0] == [0, 0, 0, 1]
+    assert hist.snapshot()[0] == [0, 1, 1, 1]
+
+
+def test_disabled_stage_records_nothing(monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS", StageMetrics())
+    metrics.set_enabled(False)
+    try:
+        with metrics.stage("score"):
+            pass
+        assert metrics.METRICS.stages == []
+        metrics.set_enabled(True)
+        with metrics.stage("score"):
+            pass
+        assert metrics.METRICS.histogram("score").count == 1
+    finally:
+        metrics.set_enabled(metrics._env_enabled())
+
+
+def test_serve_metrics():
+    stages = StageMetrics(buckets=BUCKETS)
+    stages.observe("score", 0.01)
+    server = metrics.serve_metrics(0, metrics=stages)
+    try:
+        host, port = server.server_address[:2]
+        with urllib.request.urlopen(f"http://{host}:{port}/metrics", timeout=5) as r:
+            assert r.headers["Content-Type"] == metrics.CONTENT_TYPE
+            _, samples = _parse(r.read().decode("utf-8"))
+        assert (f"{METRIC_NAME}_count", {"stage": "score"}, 1.0) in samples
+        with pytest.raises(urllib.error.HTTPError) as e:
+            urllib.request.urlopen(f"http://{host}:{port}/other", timeout=5)
+        assert e.value.code == 404
+    finally:
+        server.shutdown()
+        server.server_close()
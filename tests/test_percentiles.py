@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""百分位排名（hrrisk.percentiles）：高解析度表與 17 欄表的向量化排名，與逐欄比對的原始做法完全相同。"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from hrrisk.loaders import PERCENTILE_VALUES, load_percentile_data
+from hrrisk.percentiles import AGE_GROUP_LABELS, PercentileTable, compile_percentiles
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "benchmarks"))
+from bench_scoring import dense_table  # noqa: E402
+
+
+def _brute_force(lp: float, row: np.ndarray, grid: np.ndarray) -> tuple[int, int]:
+    """app 原本的 calculate_percentile_rank：逐欄找第一個 lp <= 門檻，與前一欄線性內插。"""
+    for i, threshold in enumerate(row):
+        if lp <= threshold:
+            exact = grid[i]
+            if i > 0 and threshold != row[i - 1]:
+                ratio = (lp - row[i - 1]) / (threshold - row[i - 1])
+                return int(round(grid[i - 1] + ratio * (exact - grid[i - 1]))), int(round(exact))
+            return int(round(exact)), int(round(exact))
+    return 100, 100
+
+
+def _synthetic(k: int, seed: int = 0) -> PercentileTable:
+    """隨機遞增門檻，含重複門檻、整格同值與缺的格子。"""
+    rng = np.random.default_rng(seed)
+    steps = rng.exponential(0.05, (4, 2, 6, k)) * (rng.random((4, 2, 6, k)) > 0.2)
+    values = rng.normal(0, 1, (4, 2, 6, 1)) + np.cumsum(steps, axis=-1)
+    values[1, 0, 2] = 0.25
+    present = np.ones((4, 2, 6), dtype=bool)
+    present[2, 1, :3] = False
+    values[~present] = np.nan
+    grid = PERCENTILE_VALUES if k == len(PERCENTILE_VALUES) else np.linspace(0.0, 100.0, k)
+    return PercentileTable(["A", "B", "C", "D"], values, present, grid=grid)
+
+
+def _random_queries(table: PercentileTable, n: int, seed: int) -> tuple[np.ndarray, np.ndarray]:
+    rng = np.random.default_rng(seed)
+    k = len(table.grid)
+    flat = table.values.reshape(-1, k)
+    cells = rng.choice(np.flatnonzero(table.present.ravel()), n)
+    lo, hi = flat[cells, 0], flat[cells, -1]
+    lp = lo - 0.5 + rng.random(n) * (hi - lo + 1.0)
+    # 一部分剛好落在門檻上（排名邊界），少數為 NaN
+    on_knot = rng.random(n) < 0.3
+    lp[on_knot] = flat[cells[on_knot], rng.integers(0, k, on_knot.sum())]
+    lp[rng.random(n) < 0.01] = np.nan
+    return lp, cells
+
+
+TABLES = {
+    "shipped": lambda: compile_percentiles(load_percentile_data()),
+    "shipped-1001": lambda: dense_table(compile_percentiles(load_percentile_data())),
+    "synthetic-17": lambda: _synthetic(len(PERCENTILE_VALUES)),
+    "synthetic-1001": lambda: _synthetic(1001),
+    "synthetic-4001": lambda: _synthetic(4001, seed=1),
+}
+
+
+@pytest.mark.parametrize("name", TABLES)
+@pytest.mark.parametrize("n", [17, 20_000])  # 小批走整箱比對、大批走逐步二分
+def test_rank_matches_brute_force(name, n):
+    table = TABLES[name]()
+    lp, cells = _random_queries(table, n, seed=n)
+    pct, exact = table.rank(lp, cells)
+    flat = table.values.reshape(-1, len(table.grid))
+    want = np.array([_brute_force(x, flat[c], table.grid) for x, c in zip(lp, cells)])
+    np.testing.assert_array_equal(pct, want[:, 0])
+    np.testing.assert_array_equal(exact, want[:, 1])
+
+
+def test_dense_table_uses_bins():
+    assert _synthetic(1001).dense and not _synthetic(len(PERCENTILE_VALUES)).dense
+
+
+def test_missing_cells_rank_as_missing():
+    table = _synthetic(1001)
+    cell = table.cell_index(2, 1, 0)
+    assert cell == -1
+    pct, exact = table.rank(np.array([0.0]), np.array([cell]))
+    assert (pct[0], exact[0]) == (-1, -1)
+    assert table.rank_one(0.0, "C", "Female", AGE_GROUP_LABELS[0]) == (None, None)
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""百分位表重建（hrrisk.quantiles）：世代成員以重建的表評分，名次與門檻一致。"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from hrrisk import ScoringModel, load_scoring_model, result_column, score_batch
+from hrrisk.engine import DRINKING_VARIABLES, SMOKING_VARIABLES
+from hrrisk.loaders import PERCENTILE_COLUMNS, PERCENTILE_VALUES, load_manifest, load_percentile_data
+from hrrisk.percentiles import compile_percentiles
+from hrrisk.quantiles import build_percentiles, write_percentiles
+
+GRID = np.asarray(PERCENTILE_VALUES, dtype=np.float64)
+
+
+def _cohort(seed: int = 0) -> pd.DataFrame:
+    """兩個格子（男 50–54 歲、女 60 歲以上）各 101 人：(n - 1) * p% 為整數，每個門檻都恰好是某位成員的 LP。"""
+    rng = np.random.default_rng(seed)
+    parts = []
+    for gender, ages in (("Male", [50, 51, 52.5, 53, 54]), ("Female", [60, 64.5, 71, 88])):
+        n = 101
+        parts.append(pd.DataFrame({
+            "age": rng.choice(ages, n),  # 整數年齡走查表鍵，非整數年齡逐列計算
+            "gender": gender,
+            "current_hr": rng.choice([55, 65, 75, 85, 95], n),
+            "bmi": rng.choice([17.0, 22.0, 25.0, 30.0], n),
+            "smoking_status": rng.choice(list(SMOKING_VARIABLES), n),
+            "drinking_status": rng.choice(list(DRINKING_VARIABLES), n),
+        }))
+    return pd.concat(parts, ignore_index=True)
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_cohort_scores_back_to_its_own_ranks(tmp_path, workers):
+    cohort = _cohort()
+    manifest = load_manifest()
+    table = build_percentiles([cohort.iloc[:150], cohort.iloc[150:]], manifest, workers=workers)
+    path = write_percentiles(table, tmp_path / "percentiles.csv", decimals=17)
+    pct_df = load_percentile_data(path)
+    # 文字往返（pandas 讀浮點數）末位可能差一個 ulp；門檻改用重建時的原值，只比較 LP 的一致性
+    pct_df[PERCENTILE_COLUMNS] = table[PERCENTILE_COLUMNS].to_numpy()
+    base = load_scoring_model(manifest=manifest, use_artifact=False)
+    model = ScoringModel(base.compiled, compile_percentiles(pct_df), base.baseline_df, base.horizon, base.schema)
+
+    out = score_batch(cohort, model)
+    for d in model.diseases:
+        lp = out[result_column(d, "lp")].to_numpy()
+        exact = out[result_column(d, "exact_percentile")].to_numpy()
+        for cell in (cohort["gender"] == "Male").to_numpy(), (cohort["gender"] == "Female").to_numpy():
+            # 由評分端的 LP 求門檻：每位成員應落在第一個 >= 自己 LP 的門檻上
+            thresholds = np.quantile(lp[cell], GRID / 100)
+            expected = GRID[np.minimum(np.searchsorted(thresholds, lp[cell]), len(GRID) - 1)]
+            np.testing.assert_array_equal(exact[cell], expected, err_msg=d)
+            # 排第 p 位（0 起算）的成員剛好等於 p% 的門檻
+            order = np.sort(lp[cell])
+            assert np.array_equal(order[GRID.astype(int)], thresholds)
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""模型註冊表（hrrisk.registry）：熱更新換版、同內容不重建、查表不在請求路徑上建立。"""
+
+import json
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from hrrisk import registry as registry_module
+from hrrisk.registry import ModelRegistry
+from hrrisk.scoring import score_profile
+
+MODEL_DIR = Path(__file__).resolve().parent.parent / "model"
+PROFILE = {"age": 52, "gender": "Female", "current_hr": 78, "bmi": 26.3,
+           "smoking_status": "曾經吸菸", "drinking_status": "目前飲酒"}
+
+
+@pytest.fixture
+def manifest(tmp_path):
+    shutil.copytree(MODEL_DIR, tmp_path / "model")
+    return tmp_path / "model" / "manifest.json"
+
+
+@pytest.fixture
+def builds(monkeypatch):
+    """記錄 registry 編譯模型的次數。"""
+    calls = []
+    load = registry_module.load_scoring_model
+
+    def counting(*args, **kwargs):
+        calls.append(kwargs.get("manifest"))
+        return load(*args, **kwargs)
+
+    monkeypatch.setattr(registry_module, "load_scoring_model", counting)
+    return calls
+
+
+def _rewrite(path: Path, **changes) -> None:
+    data = json.loads(path.read_text(encoding="utf-8"))
+    data.update(changes)
+    path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+    _bump_mtime(path)
+
+
+def _bump_mtime(path: Path) -> None:
+    # 同一個 mtime 刻度內改寫也要讓 stat 簽章不同
+    st = path.stat()
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+
+
+def _wait(predicate, timeout=5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return predicate()
+
+
+def test_changed_manifest_swaps_version(manifest, builds):
+    registry = ModelRegistry(manifest, check_interval=None, lookup=False)
+    first = registry.current()
+    assert len(builds) == 1
+
+    _rewrite(manifest, note="v2")
+    assert registry.refresh()
+    second = registry.current()
+    assert second.digest != first.digest
+    assert registry.swaps == 1 and len(builds) == 2
+
+    # 改回原內容：沿用快取的舊版本，不重新編譯
+    shutil.copyfile(MODEL_DIR / "manifest.json", manifest)
+    _bump_mtime(manifest)
+    assert registry.refresh()
+    assert registry.current() is first
+    assert len(builds) == 2
+
+
+def test_same_digest_does_not_rebuild(manifest, builds):
+    registry = ModelRegistry(manifest, check_interval=None, lookup=False)
+    version = registry.current()
+    _bump_mtime(manifest)
+    for path in version.files.values():
+        path.write_bytes(path.read_bytes())
+        _bump_mtime(path)
+    assert not registry.refresh()
+    assert registry.current() is version
+    assert registry.swaps == 0 and len(builds) == 1
+
+
+def test_lookup_is_built_off_the_request_path(manifest, monkeypatch):
+    gate = threading.Event()
+    build = registry_module.load_or_build_lookup
+
+    def slow_build(model, path=None):
+        assert threading.current_thread().name.startswith("hrrisk-lookup-")
+        gate.wait(5.0)
+        return build(model, path)
+
+    monkeypatch.setattr(registry_module, "load_or_build_lookup", slow_build)
+    registry = ModelRegistry(manifest, check_interval=None)
+    version = registry.current()
+    # 建構與評分不等查表
+    assert version.model.lookup is None and not version.lookup_ready.is_set()
+    expected = score_profile(version.model, PROFILE)
+
+    gate.set()
+    assert version.lookup_ready.wait(5.0)
+    assert version.lookup_error is None and version.model.lookup is not None
+    assert score_profile(version.model, PROFILE) == expected
+
+
+def test_watcher_builds_lookup_before_swapping(manifest):
+    registry = ModelRegistry(manifest, check_interval=None)
+    first = registry.current()
+    assert first.lookup_ready.wait(5.0)
+    registry.watch(interval=0.05)
+    try:
+        _rewrite(manifest, note="v2")
+        assert _wait(lambda: registry.current() is not first)
+        # 換上時查表已就緒
+        second = registry.current()
+        assert second.lookup_ready.is_set() and second.model.lookup is not None
+    finally:
+        registry.stop()
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""共變數 schema（hrrisk.schema）：單人與批次的輸入正規化一致，無法辨識的選項不計算。"""
+
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from hrrisk import load_scoring_model, result_column, score_batch, score_profile
+from hrrisk.categories import BMI_BANDS, HR_BANDS
+from hrrisk.schema import DEFAULT_SCHEMA, covariate_from_spec, load_schema
+
+ROOT = Path(__file__).resolve().parent.parent
+PROFILE = {"age": 52, "gender": "Female", "current_hr": 78, "bmi": 26.3,
+           "smoking_status": "曾經吸菸", "drinking_status": "目前飲酒"}
+
+
+@pytest.fixture(scope="module")
+def model():
+    return load_scoring_model(use_artifact=False)
+
+
+@pytest.mark.parametrize("value, code", [
+    ("Male", 0), ("Female ", 1), (" Male", 0), ("1", 0), (2, 1), (1.0, 0), (np.float64(2.0), 1),
+])
+def test_code_and_codes_agree(value, code):
+    gender = DEFAULT_SCHEMA.by_name["gender"]
+    assert gender.code(value) == code
+    assert gender.codes(np.array([value, "Male"], dtype=object)).tolist() == [code, 0]
+
+
+@pytest.mark.parametrize("value", ["male", "1.5", 3, None, float("nan")])
+def test_unknown_level(value):
+    gender = DEFAULT_SCHEMA.by_name["gender"]
+    with pytest.raises(ValueError):
+        gender.code(value)
+    assert gender.codes(np.array([value], dtype=object)).tolist() == [-1]
+
+
+def test_score_profile_rejects_unknown_level(model):
+    with pytest.raises(ValueError):
+        score_profile(model, {**PROFILE, "smoking_status": "偶爾吸菸"})
+    assert score_profile(model, {**PROFILE, "gender": " 2 "}) == score_profile(model, PROFILE)
+
+
+def test_score_batch_reports_unknown_rows(model):
+    df = pd.DataFrame([PROFILE, {**PROFILE, "gender": "x"}, {**PROFILE, "gender": 2.0}])
+    out = score_batch(df, model)
+    for d in model.diseases:
+        lp = out[result_column(d, "lp")]
+        assert np.isnan(lp.iloc[1]) and lp.iloc[0] == lp.iloc[2]
+        assert out[result_column(d, "percentile")].isna().tolist() == [False, True, False]
+        assert out[result_column(d, "risk_category")].isna().iloc[1]
+        assert np.isnan(out[result_column(d, "abs_risk")].iloc[1])
+
+
+def test_manifest_bands_come_from_categories():
+    manifest = json.loads((ROOT / "model" / "manifest.json").read_text(encoding="utf-8"))
+    schema = load_schema(manifest)
+    assert schema.spec() == DEFAULT_SCHEMA.spec()
+    assert schema.by_name["current_hr"].bands.cuts == HR_BANDS.cuts
+    assert schema.by_name["bmi"].bands.labels == BMI_BANDS.labels
+
+
+def test_bands_reference_is_exclusive():
+    with pytest.raises(ValueError):
+        covariate_from_spec({"name": "current_hr", "type": "banded", "bands": "current_hr", "cuts": [60]})
+    with pytest.raises(ValueError):
+        covariate_from_spec({"name": "x", "type": "banded", "bands": "nope"})
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""批次、單人評分在百分位門檻上的一致性（以 model/ 內的模型檔）。"""
+
+import itertools
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from hrrisk import build_lookup_table, load_scoring_model, result_column, score_batch, score_profile
+from hrrisk.engine import DRINKING_VARIABLES, SMOKING_VARIABLES
+from hrrisk.schema import DEFAULT_SCHEMA, CovariateSchema
+from hrrisk.scoring import ScoringModel, calculate_linear_predictor, design_vector
+
+# 每個心率 / BMI 分組各取一個代表值，與年齡 20–90 組成全部輸入組合
+HR_VALUES = (55, 65, 75, 85, 95)
+BMI_VALUES = (17.0, 22.0, 25.0, 30.0)
+
+
+@pytest.fixture(scope="module")
+def model():
+    return load_scoring_model(use_artifact=False)
+
+
+@pytest.fixture(scope="module")
+def lookup_model():
+    m = load_scoring_model(use_artifact=False)
+    m.use_lookup(build_lookup_table(m))
+    return m
+
+
+@pytest.fixture(scope="module")
+def profiles():
+    rows = itertools.product(range(20, 91), ("Male", "Female"), HR_VALUES, BMI_VALUES,
+                             SMOKING_VARIABLES, DRINKING_VARIABLES)
+    df = pd.DataFrame(rows, columns=["age", "gender", "current_hr", "bmi", "smoking_status", "drinking_status"])
+    df["age"] = df["age"].astype(float)
+    return df
+
+
+def _on_knot(model, lp: np.ndarray) -> np.ndarray:
+    """LP 剛好等於某個百分位門檻的列。"""
+    knots = model.percentiles.values
+    return np.isin(lp, np.unique(knots[np.isfinite(knots)])).any(axis=1)
+
+
+def _assert_same(model, batch: pd.DataFrame, i: int, results: list[dict]) -> None:
+    assert [r["disease"] for r in results] == list(model.diseases)
+    for r in results:
+        for field in ("lp", "percentile", "exact_percentile", "risk_category", "abs_risk"):
+            assert batch[result_column(r["disease"], field)].iloc[i] == r[field], (i, r["disease"], field)
+
+
+def test_batch_matches_profile_at_knots(model, profiles):
+    batch = score_batch(profiles, model)
+    lp = batch[[result_column(d, "lp") for d in model.diseases]].to_numpy()
+    rows = np.flatnonzero(_on_knot(model, lp))
+    assert len(rows) > 0  # 模型檔中確實有 LP 剛好落在門檻上的組合
+    rows = np.concatenate([rows, np.arange(0, len(profiles), 97)])
+    for i in rows:
+        results = score_profile(model, profiles.iloc[i].to_dict())
+        _assert_same(model, batch, i, results)
+
+
+def test_lookup_matches_computed(model, lookup_model, profiles):
+    batch = score_batch(profiles, model)
+    pd.testing.assert_frame_equal(score_batch(profiles, lookup_model), batch)
+    lp = batch[[result_column(d, "lp") for d in model.diseases]].to_numpy()
+    for i in np.flatnonzero(_on_knot(model, lp)):
+        results = score_profile(lookup_model, profiles.iloc[i].to_dict())
+        _assert_same(model, batch, i, results)
+
+
+def test_linear_predictor_uses_the_model_schema(model, monkeypatch):
+    # 心率多切一組（>=100）的 schema：ScoringModel 的 LP 應依它的 design，而不是預設 schema
+    specs = [dict(s) for s in DEFAULT_SCHEMA.spec()]
+    hr = specs[[s["name"] for s in specs].index("current_hr")]
+    hr.pop("bands", None)
+    hr.update(cuts=list(hr["cuts"]) + [100], levels=list(hr["levels"]) + ["HR_cat>=100"])
+    custom = ScoringModel(model.compiled, model.percentiles, model.baseline_df, model.horizon,
+                          CovariateSchema.from_spec(specs))
+    args = (52, "Female", 105, 26.3, "曾經吸菸", "目前飲酒")
+    disease = custom.diseases[0]
+    profile = dict(zip(custom.schema.inputs, args))
+
+    compiles = []
+    compile_ = CovariateSchema.compile
+    monkeypatch.setattr(CovariateSchema, "compile", lambda self, c: compiles.append(self) or compile_(self, c))
+    lp = calculate_linear_predictor(disease, *args, custom)
+    i = custom.compiled.disease_index[disease]
+    assert lp == custom.design.predict_one(custom.compiled.coef[i:i + 1], profile)[0]
+    assert lp != calculate_linear_predictor(disease, *args, model.compiled)
+    assert lp == next(r["lp"] for r in score_profile(custom, profile) if r["disease"] == disease)
+    assert (design_vector(custom, *args) == custom.design.vector(profile)).all()
+    assert calculate_linear_predictor(disease, *args, model) == calculate_linear_predictor(
+        disease, *args, model.compiled)
+    for _ in range(3):
+        calculate_linear_predictor(disease, *args, model.compiled)
+    # ScoringModel 沿用已建好的 design；CompiledModel 的預設 schema design 只編譯一次
+    assert len(compiles) <= 1
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""持久化佇列（hrrisk.spool）：重啟接續、跨行程只有一個送出者、暫時失敗的延後重試。"""
+
+import subprocess
+import sys
+import textwrap
+import time
+from pathlib import Path
+
+import pytest
+from filelock import FileLock
+
+from hrrisk.logwriter import RestSink, Sink
+from hrrisk.reststub import StubRestServer
+from hrrisk.spool import SpoolWriter, failed_jobs
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def _job(i: int) -> list:
+    return [("user_sessions", [{"session": i}]), ("risk_events", [{"session": i, "disease": "A"}])]
+
+
+def _sessions(server: StubRestServer, table: str = "user_sessions") -> list[int]:
+    return sorted(r["session"] for r in server.rows(table))
+
+
+def _wait(predicate, timeout: float = 10.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def _python(code: str, *args: str, **kwargs) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable, "-c", textwrap.dedent(code), *args], cwd=ROOT, text=True, **kwargs)
+
+
+@pytest.fixture
+def spool(tmp_path) -> Path:
+    return tmp_path / "spool.sqlite3"
+
+
+def test_reopen_same_spool_in_process(spool):
+    with StubRestServer() as server:
+        first = SpoolWriter(RestSink(server.url, "k"), spool, batch_rows=1)
+        first.submit(_job(0))
+        assert first.flush(timeout=5)
+        first.close()
+        # close 後送出權（<spool>.lock）已釋放
+        lock = FileLock(str(spool) + ".lock")
+        lock.acquire(timeout=0)
+        lock.release()
+
+        second = SpoolWriter(RestSink(server.url, "k"), spool, batch_interval=0.05)
+        try:
+            for i in range(1, 51):
+                second.submit(_job(i))
+            assert second.flush(timeout=10)
+        finally:
+            second.close()
+        assert _sessions(server) == list(range(51))
+
+
+class _SessionsOnly(Sink):
+    """user_sessions 寫得進去，risk_events 一律暫時失敗。"""
+
+    def __init__(self):
+        self.tables = []
+
+    def insert(self, table, rows):
+        if table == "risk_events":
+            raise ConnectionError("risk_events 暫時無法寫入")
+        self.tables.append(table)
+
+
+def test_restart_resumes_after_last_written_step(spool):
+    writer = SpoolWriter(_SessionsOnly(), spool, batch_rows=1, max_retries=0, max_backoff=60)
+    writer.submit(_job(1))
+    assert _wait(lambda: writer.stats()["deferred"] == 1)
+    assert writer.sink.tables == ["user_sessions"]
+    writer.close(timeout=0)
+
+    with StubRestServer() as server:
+        writer = SpoolWriter(RestSink(server.url, "k"), spool, batch_rows=1)
+        try:
+            assert writer.flush(timeout=5)
+        finally:
+            writer.close()
+        assert _sessions(server, "user_sessions") == []
+        assert _sessions(server, "risk_events") == [1]
+
+
+def test_crashed_process_leaves_jobs_for_the_next_one(spool):
+    # 送不出去（連到沒有服務的埠）的行程寫入 20 筆後直接結束，不呼叫 close
+    proc = _python("""
+        import os, sys
+        from hrrisk.logwriter import RestSink
+        from hrrisk.spool import SpoolWriter
+        writer = SpoolWriter(RestSink("http://127.0.0.1:9", "k", timeout=0.5), sys.argv[1],
+                             max_retries=0, max_backoff=60)
+        for i in range(20):
+            writer.submit([("user_sessions", [{"session": i}])])
+        os._exit(0)
+    """, str(spool))
+    assert proc.wait(timeout=30) == 0
+
+    with StubRestServer() as server:
+        writer = SpoolWriter(RestSink(server.url, "k"), spool, batch_interval=0.05)
+        try:
+            assert writer.flush(timeout=10)
+        finally:
+            writer.close()
+        assert _sessions(server) == list(range(20))
+
+
+def test_only_one_process_drains(spool):
+    with StubRestServer() as server:
+        # 另一個行程先取得送出權，等 stdin 關閉才結束
+        drainer = _python("""
+            import sys
+            from filelock import FileLock, Timeout
+            from hrrisk.logwriter import RestSink
+            from hrrisk.spool import SpoolWriter
+            writer = SpoolWriter(RestSink(sys.argv[1], "k"), sys.argv[2], batch_interval=0.05)
+            probe = FileLock(sys.argv[2] + ".lock")
+            while True:  # 另開一個 FileLock 取不到鎖，表示 writer 已是送出者
+                try:
+                    probe.acquire(timeout=0)
+                    probe.release()
+                except Timeout:
+                    break
+            print("ready", flush=True)
+            sys.stdin.read()
+            writer.close()
+        """, server.url, str(spool), stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        try:
+            assert drainer.stdout.readline().strip() == "ready"
+            writer = SpoolWriter(RestSink(server.url, "k"), spool, batch_interval=0.05)
+            try:
+                for i in range(30):
+                    writer.submit(_job(i))
+                # 由另一個行程送出，本行程只寫入 spool
+                assert _wait(lambda: len(server.rows("risk_events")) == 30)
+                assert writer.stats()["batches"] == 0
+                drainer.stdin.close()
+                assert drainer.wait(timeout=10) == 0
+
+                # 送出者結束後由本行程接手
+                for i in range(30, 40):
+                    writer.submit(_job(i))
+                assert writer.flush(timeout=10)
+                assert writer.stats()["batches"] > 0
+            finally:
+                writer.close()
+        finally:
+            if drainer.poll() is None:
+                drainer.kill()
+        assert _sessions(server) == list(range(40))
+        assert _sessions(server, "risk_events") == list(range(40))
+
+
+class _SlowSink(Sink):
+    """每次寫入花 delay 秒，記下寫入的 session。"""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.sessions = []
+
+    def insert(self, table, rows):
+        time.sleep(self.delay)
+        if table == "user_sessions":
+            self.sessions += [r["session"] for r in rows]
+
+
+def test_flush_waits_only_for_own_jobs(spool):
+    # 同一行程內的兩個 SpoolWriter 各自開檔上鎖，效果同兩個行程
+    sink = _SlowSink(0.1)
+    drainer = SpoolWriter(sink, spool, batch_rows=1)
+    try:
+        assert _wait(lambda: drainer._file_lock.is_locked)
+        writer = SpoolWriter(Sink(), spool, batch_rows=1)
+        try:
+            writer.submit(_job(0))
+            for i in range(1, 41):  # 送出者行程自己的積壓，排在本行程的工作之後
+                drainer.submit(_job(i))
+            start = time.monotonic()
+            assert writer.flush(timeout=5)
+            assert time.monotonic() - start < 2
+            assert 0 in sink.sessions and len(sink.sessions) < 40
+            assert writer.stats()["queued"] == 0 and drainer.stats()["queued"] > 0
+        finally:
+            assert writer.close(timeout=1)
+    finally:
+        drainer.close(timeout=0)
+
+
+def test_transient_failure_waits_max_backoff(spool):
+    with StubRestServer(fail_first=1) as server:
+        writer = SpoolWriter(RestSink(server.url, "k"), spool, batch_rows=1, max_retries=0, max_backoff=0.5)
+        try:
+            start = time.monotonic()
+            writer.submit(_job(1))
+            assert _wait(lambda: writer.stats()["deferred"] == 1)
+            time.sleep(0.2)
+            assert server.requests == 1 and writer.stats()["queued"] == 1
+            assert _wait(lambda: writer.stats()["written"] == 1)
+            assert time.monotonic() - start >= 0.5
+            assert server.requests == 3
+        finally:
+            writer.close()
+        assert _sessions(server) == [1]
+
+
+def test_permanent_failure_is_kept_as_dead(spool):
+    with StubRestServer(reject=lambda table, row: row.get("session") == 2) as server:
+        writer = SpoolWriter(RestSink(server.url, "k"), spool, batch_rows=1)
+        try:
+            for i in range(3):
+                writer.submit(_job(i))
+            assert writer.flush(timeout=5)
+            assert writer.stats()["dead"] == 1
+        finally:
+            writer.close()
+        assert _sessions(server) == [0, 1]
+    [(_, _, steps, error)] = failed_jobs(spool)
+    assert steps[0] == ("user_sessions", [{"session": 2}])
+    assert "400" in error